@@ -2,32 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import calendar
+import hashlib
+import io
 import logging
 import os
 import math
 
 from flask import Flask, abort, jsonify, render_template, request,\
-    make_response, send_from_directory, send_file
+    make_response, send_from_directory, send_file, json, stream_with_context
 from flask.json import JSONEncoder
 from flask_compress import Compress
 from datetime import datetime
 from s2sphere import LatLng
 
-from pogom.dyn_img import get_gym_icon, get_pokemon_map_icon, get_pokemon_raw_icon
+from pogom.dyn_img import (get_gym_icon, get_pokemon_map_icon,
+                           get_pokemon_raw_icon, load_icon)
 from pogom.pgscout import scout_error, pgscout_encounter, perform_lure
 from pogom.utils import get_args, get_pokemon_name
 from datetime import timedelta
 from collections import OrderedDict
-from bisect import bisect_left
+from threading import Lock
+from cachetools import TTLCache, LRUCache
 
 from pogom.weather import get_weather_cells, get_s2_coverage, get_weather_alerts
 from .models import (Geofence, Pokemon, LurePokemon, Gym, Pokestop, ScannedLocation,
                      MainWorker, WorkerStatus, Token, HashKeys,
-                     SpawnPoint, Weather)
-from .utils import now, dottedQuadToNum, degrees_to_cardinal
+                     SpawnPoint, Weather, change_log, tile_versions,
+                     change_stream, replica_router)
+from .replicas import replica_reads
+from .utils import now, degrees_to_cardinal
 from .client_auth import (redirect_client_to_auth, valid_client_auth, valid_discord_guild,
-                          redirect_to_discord_guild_invite, valid_discord_guild_role)
-from .blacklist import fingerprints, get_ip_blacklist
+                          redirect_to_discord_guild_invite, valid_discord_guild_role,
+                          DiscordAuthCache)
+from .blacklist import fingerprints, IPBlacklist
+from .columnar import wants_columns, to_columns
+from .tiles import valid_tile, tile_bounds, tile_etag, tile_expiry
 
 from pgoapi.protos.pogoprotos.map.weather.gameplay_weather_pb2 import *
 from pgoapi.protos.pogoprotos.map.weather.weather_alert_pb2 import *
@@ -36,6 +45,9 @@ from pgoapi.protos.pogoprotos.networking.responses.get_map_objects_response_pb2
 log = logging.getLogger(__name__)
 compress = Compress()
 
+# Seconds browsers may use an icon before revalidating it.
+ICON_MAX_AGE = 3600
+
 
 class Pogom(Flask):
 
@@ -46,36 +58,45 @@ class Pogom(Flask):
         args = get_args()
 
         # Global blist
+        self.blacklist = IPBlacklist()
         if not args.disable_blacklist:
-            log.info('Retrieving blacklist...')
-            self.blacklist = get_ip_blacklist()
-            # Sort & index for binary search
-            self.blacklist.sort(key=lambda r: r[0])
-            self.blacklist_keys = [
-                dottedQuadToNum(r[0]) for r in self.blacklist
-            ]
+            # Start from the last known blacklist, don't wait for the
+            # network.
+            self.blacklist.load_snapshot()
+            self.blacklist.start()
         else:
             log.info('Blacklist disabled for this session.')
-            self.blacklist = []
-            self.blacklist_keys = []
 
-        self.user_auth_code_cache = {}
+        self.user_auth_code_cache = DiscordAuthCache()
+
+        # Rendered map tiles, see map_tile().
+        self.tile_cache = TTLCache(maxsize=2000, ttl=60)
+        self.tile_cache_lock = Lock()
+
+        # Icon request parameters -> (path, ETag), see icon_response().
+        self.icon_cache = LRUCache(maxsize=20000)
+        self.icon_cache_lock = Lock()
 
         # Routes
         self.json_encoder = CustomJSONEncoder
         self.route("/", methods=['GET'])(self.fullmap)
         self.route("/auth_callback", methods=['GET'])(self.auth_callback)
-        self.route("/raw_data", methods=['GET'])(self.raw_data)
+        self.route("/raw_data", methods=['GET'])(self.replica(self.raw_data))
+        self.route("/tile/<int:z>/<int:x>/<int:y>", methods=['GET'])(
+            self.map_tile)
+        self.route("/stream", methods=['GET'])(self.stream)
         self.route("/loc", methods=['GET'])(self.loc)
         self.route("/next_loc", methods=['POST'])(self.next_loc)
-        self.route("/mobile", methods=['GET'])(self.list_pokemon)
+        self.route("/mobile", methods=['GET'])(
+            self.replica(self.list_pokemon))
         self.route("/search_control", methods=['GET'])(self.get_search_control)
         self.route("/search_control", methods=['POST'])(
             self.post_search_control)
-        self.route("/stats", methods=['GET'])(self.get_stats)
+        self.route("/stats", methods=['GET'])(self.replica(self.get_stats))
         self.route("/status", methods=['GET'])(self.get_status)
         self.route("/status", methods=['POST'])(self.post_status)
-        self.route("/gym_data", methods=['GET'])(self.get_gymdata)
+        self.route("/gym_data", methods=['GET'])(
+            self.replica(self.get_gymdata))
         self.route("/bookmarklet", methods=['GET'])(self.get_bookmarklet)
         self.route("/inject.js", methods=['GET'])(self.render_inject_js)
         self.route("/submit_token", methods=['POST'])(self.submit_token)
@@ -88,7 +109,12 @@ class Pogom(Flask):
         self.route("/scout", methods=['GET'])(self.scout_pokemon)
         self.route("/lure", methods=['GET'])(self.scout_lure)
         self.route("/<statusname>", methods=['GET'])(self.fullmap)
-        self.route("/weather", methods=['GET'])(self.get_weather)
+        self.route("/weather", methods=['GET'])(
+            self.replica(self.get_weather))
+
+    # Map data and statistics may come from a read replica.
+    def replica(self, view):
+        return replica_reads(replica_router, view)
 
     def get_weather(self, page=1):
 
@@ -149,15 +175,21 @@ class Pogom(Flask):
         )
 
     def gym_img(self):
+        return self.icon_response(self.gym_icon_path)
+
+    def gym_icon_path(self):
         team = request.args.get('team')
         level = request.args.get('level')
         raidlevel = request.args.get('raidlevel')
         pkm = request.args.get('pkm')
         is_in_battle = request.args.get('battle')
         time = int(request.args.get('time')) if 'time' in request.args else 0
-        return send_file(get_gym_icon(team, level, raidlevel, pkm, time, is_in_battle), mimetype='image/png')
+        return get_gym_icon(team, level, raidlevel, pkm, time, is_in_battle)
 
     def pokemon_img(self):
+        return self.icon_response(self.pokemon_icon_path)
+
+    def pokemon_icon_path(self):
         raw = 'raw' in request.args
         pkm = int(request.args.get('pkm'))
         medal = request.args.get('medal') if 'medal' in request.args else None
@@ -173,7 +205,34 @@ class Pogom(Flask):
                                             shiny=shiny, previous_id=previous_id)
         else:
             filename = get_pokemon_map_icon(pkm, time, medal=medal, gender=gender, form=form, costume=costume, weather=weather, previous_id=previous_id)
-        return send_file(filename, mimetype='image/png')
+        return filename
+
+    # Icons only depend on their parameters and the assets they're drawn
+    # from. Once the path and ETag of a URL are known, repeat requests are
+    # answered without touching the disk.
+    def icon_response(self, get_path):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        with self.icon_cache_lock:
+            cached = self.icon_cache.get(key)
+        if cached is None:
+            filename = get_path()
+            cached = (filename, hashlib.md5(load_icon(filename)).hexdigest())
+            with self.icon_cache_lock:
+                self.icon_cache[key] = cached
+
+        filename, etag = cached
+        if etag in request.if_none_match:
+            response = self.response_class(status=304)
+        else:
+            response = send_file(io.BytesIO(load_icon(filename)),
+                                 mimetype='image/png')
+
+        response.set_etag(etag)
+        # URLs don't change with PogoAssets or the renderer, so browsers
+        # revalidate with the ETag now and then.
+        response.cache_control.public = True
+        response.cache_control.max_age = ICON_MAX_AGE
+        return response
 
 
     def scout_pokemon(self):
@@ -320,17 +379,7 @@ class Pogom(Flask):
             abort(403)
 
     def _ip_is_blacklisted(self, ip):
-        if not self.blacklist:
-            return False
-
-        # Get the nearest IP range
-        pos = max(bisect_left(self.blacklist_keys, ip) - 1, 0)
-        ip_range = self.blacklist[pos]
-
-        start = dottedQuadToNum(ip_range[0])
-        end = dottedQuadToNum(ip_range[1])
-
-        return start <= dottedQuadToNum(ip) <= end
+        return self.blacklist.contains(ip)
 
     def set_db_updates_queue(self, db_updates_queue):
         self.db_updates_queue = db_updates_queue
@@ -418,7 +467,9 @@ class Pogom(Flask):
                                show=visibility_flags
                                )
 
-    def raw_data(self):
+    # Access checks shared by the map data endpoints. Returns a response
+    # to send instead when the client isn't allowed in.
+    def check_map_access(self):
         # Make sure fingerprint isn't blacklisted.
         fingerprint_blacklisted = any([
             fingerprints['no_referrer'](request),
@@ -433,7 +484,6 @@ class Pogom(Flask):
         args = get_args()
         if args.on_demand_timeout > 0:
             self.control_flags['on_demand'].clear()
-        d = {}
 
         if args.user_auth_service == "Discord":
           if not valid_client_auth(request, self.user_auth_code_cache, args):
@@ -444,8 +494,27 @@ class Pogom(Flask):
             if args.uas_discord_required_roles and not valid_discord_guild_role(request, self.user_auth_code_cache, args):
               return redirect_to_discord_guild_invite(args)
 
-        # Request time of this request.
-        d['timestamp'] = datetime.utcnow()
+        return None
+
+    def raw_data(self):
+        denied = self.check_map_access()
+        if denied:
+            return denied
+
+        args = get_args()
+        d = {}
+
+        # Request time of this request. A read replica may not have the
+        # latest changes yet, the next request asks for them again.
+        lag = replica_router.current_lag()
+        d['timestamp'] = datetime.utcnow() - timedelta(seconds=lag)
+
+        # Change sequence cursor of this request. Clients send it back with
+        # the next one so we only load rows that changed in between.
+        changed = {}
+        if change_log.enabled:
+            d['seq'], changed = change_log.since(request.args.get('seq'),
+                                                 lag)
 
         # Request time of previous request.
         if request.args.get('timestamp'):
@@ -521,8 +590,9 @@ class Pogom(Flask):
             else:
                 # If map is already populated only request modified Pokemon
                 # since last request time.
-                d['pokemons'] = Pokemon.get_active(swLat, swLng, neLat, neLng,
-                                                   timestamp=timestamp)
+                d['pokemons'] = Pokemon.get_active(
+                    swLat, swLng, neLat, neLng, timestamp=timestamp,
+                    changed=changed.get('pokemon'))
                 if newArea:
                     # If screen is moved add newly uncovered Pokemon to the
                     # ones that were modified since last request time.
@@ -558,8 +628,9 @@ class Pogom(Flask):
                 d['pokestops'] = Pokestop.get_stops(swLat, swLng, neLat, neLng,
                                                     lured=luredonly)
             else:
-                d['pokestops'] = Pokestop.get_stops(swLat, swLng, neLat, neLng,
-                                                    timestamp=timestamp)
+                d['pokestops'] = Pokestop.get_stops(
+                    swLat, swLng, neLat, neLng, timestamp=timestamp,
+                    changed=changed.get('pokestops'))
                 if newArea:
                     d['pokestops'] = d['pokestops'] + (
                         Pokestop.get_stops(swLat, swLng, neLat, neLng,
@@ -572,7 +643,8 @@ class Pogom(Flask):
                 d['gyms'] = Gym.get_gyms(swLat, swLng, neLat, neLng)
             else:
                 d['gyms'] = Gym.get_gyms(swLat, swLng, neLat, neLng,
-                                         timestamp=timestamp)
+                                         timestamp=timestamp,
+                                         changed=changed.get('gyms'))
                 if newArea:
                     d['gyms'].update(
                         Gym.get_gyms(swLat, swLng, neLat, neLng,
@@ -584,9 +656,9 @@ class Pogom(Flask):
                 d['scanned'] = ScannedLocation.get_recent(swLat, swLng,
                                                           neLat, neLng)
             else:
-                d['scanned'] = ScannedLocation.get_recent(swLat, swLng,
-                                                          neLat, neLng,
-                                                          timestamp=timestamp)
+                d['scanned'] = ScannedLocation.get_recent(
+                    swLat, swLng, neLat, neLng, timestamp=timestamp,
+                    changed=changed.get('scanned'))
                 if newArea:
                     d['scanned'] = d['scanned'] + ScannedLocation.get_recent(
                         swLat, swLng, neLat, neLng, oSwLat=oSwLat,
@@ -614,7 +686,7 @@ class Pogom(Flask):
             else:
                 d['spawnpoints'] = SpawnPoint.get_spawnpoints(
                     swLat=swLat, swLng=swLng, neLat=neLat, neLng=neLng,
-                    timestamp=timestamp)
+                    timestamp=timestamp, changed=changed.get('spawnpoints'))
                 if newArea:
                     d['spawnpoints'] = d['spawnpoints'] + (
                         SpawnPoint.get_spawnpoints(
@@ -623,25 +695,7 @@ class Pogom(Flask):
                             oNeLat=oNeLat, oNeLng=oNeLng))
 
         if request.args.get('geofences', 'true') == 'true':
-            db_geofences = Geofence.get_geofences()
-
-            geofences = {}
-            for g in db_geofences:
-                # Check if already there
-                geofence = geofences.get(g['name'], None)
-                if not geofence:  # Create a new sub-dict if new
-                    geofences[g['name']] = {
-                        'excluded': g['excluded'],
-                        'name': g['name'],
-                        'coordinates': []
-                    }
-                coordinate = {
-                    'lat': g['latitude'],
-                    'lng': g['longitude']
-                }
-                geofences[g['name']]['coordinates'].append(coordinate)
-
-            d['geofences'] = geofences
+            d['geofences'] = Geofence.get_map_geofences()
 
         if request.args.get('status', 'false') == 'true':
             args = get_args()
@@ -665,8 +719,133 @@ class Pogom(Flask):
         if request.args.get('time', 'false') == 'true':
             d['time'] = get_time(swLat, swLng, neLat, neLng)
 
+        # Opt-in compact format, see pogom/columnar.py.
+        if wants_columns(request):
+            d = to_columns(d)
+
         return jsonify(d)
 
+    # Everything on the map inside one tile, so clients looking at the same
+    # area share responses. Tiles are versioned by the db updater when it
+    # runs in this process, otherwise the ETag is a hash of the content.
+    def map_tile(self, z, x, y):
+        denied = self.check_map_access()
+        if denied:
+            return denied
+
+        if not valid_tile(z, x, y):
+            abort(404)
+
+        # The ETag is the tile's version, until the first Pokemon, lure,
+        # raid or scan in it expires.
+        if change_log.enabled:
+            version = tile_versions.etag(x, y)
+            with self.tile_cache_lock:
+                cached = self.tile_cache.get((x, y))
+            if (cached and cached[0] == version and
+                    (cached[3] is None or cached[3] > datetime.utcnow())):
+                etag, body, expiry = cached[1:]
+                if request.if_none_match.contains_weak(etag):
+                    body = None
+                return self.tile_response(body, etag, expiry)
+
+        data = self.get_tile_data(z, x, y)
+        expiry = tile_expiry(data)
+        body = json.dumps(data)
+
+        if change_log.enabled:
+            etag = tile_etag(version, expiry)
+            with self.tile_cache_lock:
+                self.tile_cache[(x, y)] = (version, etag, body, expiry)
+        else:
+            etag = hashlib.md5(body).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            body = None
+
+        return self.tile_response(body, etag, expiry)
+
+    # Server-Sent Events stream of Pokemon, gym, raid and lure changes
+    # inside the given bounds, as the db updater commits them.
+    def stream(self):
+        denied = self.check_map_access()
+        if denied:
+            return denied
+
+        # Changes are only seen by the process running the db updater.
+        if not change_log.enabled:
+            abort(404)
+
+        try:
+            bounds = tuple(float(request.args[k])
+                           for k in ('swLat', 'swLng', 'neLat', 'neLng'))
+        except (KeyError, ValueError):
+            abort(400)
+
+        subscription = change_stream.subscribe(bounds)
+        if subscription is None:
+            log.warning('Too many map change stream clients.')
+            abort(503)
+
+        def events():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    event = subscription.get(timeout=15)
+                    # Connected clients count as map activity.
+                    self.heartbeat[0] = now()
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                        continue
+
+                    kind, data = event
+                    yield 'event: {}\ndata: {}\n\n'.format(
+                        kind, json.dumps(data))
+            finally:
+                change_stream.unsubscribe(subscription)
+
+        return self.response_class(
+            stream_with_context(events()), mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache',
+                     'X-Accel-Buffering': 'no'})
+
+    def get_tile_data(self, z, x, y):
+        args = get_args()
+        swLat, swLng, neLat, neLng = [
+            repr(c) for c in tile_bounds(x, y, z)]
+
+        d = {'tile': [z, x, y]}
+        if not args.no_pokemon:
+            d['pokemons'] = Pokemon.get_active(swLat, swLng, neLat, neLng)
+        if not args.no_pokestops:
+            d['pokestops'] = Pokestop.get_stops(swLat, swLng, neLat, neLng)
+        if not args.no_gyms:
+            d['gyms'] = Gym.get_gyms(swLat, swLng, neLat, neLng)
+        d['scanned'] = ScannedLocation.get_recent(swLat, swLng, neLat, neLng)
+
+        return d
+
+    def tile_response(self, body, etag, expiry=None):
+        if body is None:
+            response = self.response_class(status=304)
+        else:
+            response = self.response_class(body, mimetype='application/json')
+
+        response.set_etag(etag, weak=True)
+        # Pokemon despawn without a new version, keep shared copies short
+        # lived and not past the first expiry. Behind user auth only the
+        # browser may cache.
+        args = get_args()
+        max_age = 30
+        if expiry is not None:
+            max_age = min(max_age, max(0, int(
+                (expiry - datetime.utcnow()).total_seconds())))
+        response.cache_control.max_age = max_age
+        if args.user_auth_service:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        return response
+
     def loc(self):
         d = {}
         d['lat'] = self.current_location[0]
@@ -708,7 +887,11 @@ class Pogom(Flask):
         lon = request.args.get('lon', self.current_location[1], type=float)
         origin_point = LatLng.from_degrees(lat, lon)
 
-        for pokemon in Pokemon.get_active(None, None, None, None):
+        # Only the closest ones, in meters.
+        radius = request.args.get('radius', 10000, type=int)
+        limit = request.args.get('limit', 100, type=int)
+
+        for dist, pokemon in Pokemon.get_nearest(lat, lon, radius, limit):
             pokemon_point = LatLng.from_degrees(pokemon['latitude'],
                                                 pokemon['longitude'])
             diff = pokemon_point - origin_point
@@ -722,8 +905,7 @@ class Pogom(Flask):
                 'id': pokemon['pokemon_id'],
                 'name': pokemon['pokemon_name'],
                 'card_dir': direction,
-                'distance': int(origin_point.get_distance(
-                    pokemon_point).radians * 6366468.241830914),
+                'distance': dist,
                 'time_to_disappear': '%d min %d sec' % (divmod(
                     (pokemon['disappear_time'] - datetime.utcnow()).seconds,
                     60)),
@@ -733,8 +915,7 @@ class Pogom(Flask):
                 'latitude': pokemon['latitude'],
                 'longitude': pokemon['longitude']
             }
-            pokemon_list.append((entry, entry['distance']))
-        pokemon_list = [y[0] for y in sorted(pokemon_list, key=lambda x: x[1])]
+            pokemon_list.append(entry)
         args = get_args()
         visibility_flags = {
             'custom_css': args.custom_css,
@@ -1,11 +1,24 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
 import logging
+import os
+import socket
+import struct
+import threading
+import time
 import requests
 
+from array import array
+from bisect import bisect_right
+
 log = logging.getLogger(__name__)
 
+# Last retrieved blacklist, so a restart doesn't have to wait for it.
+snapshot_path = os.path.join(os.path.dirname(__file__), '..', 'config',
+                             'blacklist.json')
+
 
 # Global IP blacklist.
 def get_ip_blacklist():
@@ -14,9 +27,122 @@ def get_ip_blacklist():
         blacklist = requests.get(url, timeout=5).json()
         log.debug('Entries in blacklist: %s.', len(blacklist))
         return blacklist
-    except (requests.exceptions.RequestException, IndexError, KeyError):
-        log.error('Unable to retrieve blacklist, setting to empty.')
-        return []
+    except (requests.exceptions.RequestException, IndexError, KeyError,
+            ValueError):
+        log.error('Unable to retrieve blacklist.')
+        return None
+
+
+# IPv4 address as an integer, None for anything else.
+def ip_to_num(ip):
+    try:
+        return struct.unpack('!L', socket.inet_aton(ip.strip()))[0]
+    except (socket.error, AttributeError, UnicodeError):
+        return None
+
+
+# Blacklisted ranges compiled into sorted, non-overlapping intervals of
+# integers, so a lookup is a single binary search. Tables are never
+# modified, a refresh builds a new one.
+class IPRangeTable(object):
+
+    def __init__(self, ranges=()):
+        intervals = []
+        for r in ranges:
+            start = ip_to_num(r[0])
+            end = ip_to_num(r[1])
+            if start is None or end is None:
+                continue
+            intervals.append((min(start, end), max(start, end)))
+        intervals.sort()
+
+        # 'L' is at least 32 bits.
+        self.starts = array('L')
+        self.ends = array('L')
+        for start, end in intervals:
+            # Merge overlapping and adjacent ranges.
+            if self.ends and start <= self.ends[-1] + 1:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, ip):
+        num = ip_to_num(ip)
+        if num is None:
+            return False
+        pos = bisect_right(self.starts, num) - 1
+        return pos >= 0 and num <= self.ends[pos]
+
+
+# The blacklist used by the web server. It starts from the local snapshot
+# and is refreshed in the background, swapping in a new table when done.
+class IPBlacklist(object):
+
+    def __init__(self, refresh_interval=6 * 60 * 60, retry_interval=5 * 60):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.table = IPRangeTable()
+
+    def contains(self, ip):
+        return self.table.contains(ip)
+
+    def load_snapshot(self):
+        try:
+            with open(snapshot_path, 'r') as f:
+                ranges = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        self.table = IPRangeTable(ranges)
+        log.info('Loaded %d blacklisted IP ranges from snapshot.',
+                 len(self.table))
+        return True
+
+    def save_snapshot(self, ranges):
+        # WSGI workers each refresh the blacklist.
+        tmp_path = '{}.{}.tmp'.format(snapshot_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(ranges, f)
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+            os.rename(tmp_path, snapshot_path)
+        except (IOError, OSError) as e:
+            log.warning('Unable to save blacklist snapshot: %s', repr(e))
+
+    def refresh(self):
+        ranges = get_ip_blacklist()
+        if ranges is None:
+            return False
+
+        self.table = IPRangeTable(ranges)
+        log.info('Retrieved blacklist: %d ranges, %d after merging.',
+                 len(ranges), len(self.table))
+        self.save_snapshot(ranges)
+        return True
+
+    def start(self):
+        t = threading.Thread(target=self.refresh_loop,
+                             name='blacklist-refresher')
+        t.daemon = True
+        t.start()
+
+    def refresh_loop(self):
+        while True:
+            try:
+                refreshed = self.refresh()
+            except Exception as e:
+                log.exception('Exception while refreshing blacklist: %s',
+                              repr(e))
+                refreshed = False
+
+            time.sleep(self.refresh_interval if refreshed
+                       else self.retry_interval)
 
 
 # Fingerprinting methods. They receive Flask's request object as
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+# Per entity type change sequences for incremental map updates.
+#
+# The db updater records the keys of every row it commits and each one gets
+# the next sequence number of its type. Map clients get an opaque cursor
+# back with every response and send it with the next request, we then know
+# exactly which rows changed in between, instead of guessing from
+# last_modified with an overlap.
+#
+# Only the most recent changes are kept. When a cursor is too old (or from
+# another process/run) since() returns None for that type and callers fall
+# back to the timestamp based queries.
+#
+# Responses built from a lagging read replica hand out a cursor from behind
+# seconds ago, so changes the replica didn't have yet are sent again.
+class ChangeLog(object):
+
+    def __init__(self, kinds, maxlen=10000):
+        self.kinds = tuple(kinds)
+        self.enabled = False
+        # Cursors from a previous run must not be mistaken for ours.
+        self.epoch = '%x' % random.getrandbits(32)
+        self._seq = dict((kind, 0) for kind in self.kinds)
+        self._changes = dict((kind, deque(maxlen=maxlen))
+                             for kind in self.kinds)
+        self._lock = threading.Lock()
+
+    def record(self, kind, keys):
+        with self._lock:
+            seq = self._seq[kind]
+            changes = self._changes[kind]
+            now = time.time()
+            for key in keys:
+                seq += 1
+                changes.append((seq, key, now))
+            self._seq[kind] = seq
+
+    def cursor(self):
+        with self._lock:
+            return self._cursor()
+
+    # Returns (cursor, changed) where changed maps each type to the set of
+    # keys changed since the given cursor, or None if we can't tell.
+    def since(self, cursor, behind=0):
+        last_seq = self._parse(cursor)
+
+        with self._lock:
+            changed = {}
+            for kind in self.kinds:
+                changed[kind] = None
+                if last_seq is None:
+                    continue
+
+                changes = self._changes[kind]
+                seq = last_seq[kind]
+                if seq > self._seq[kind]:
+                    continue
+                # Changes right after the cursor have been pushed out.
+                if changes and changes[0][0] > seq + 1:
+                    continue
+
+                keys = set()
+                for change_seq, key, changed_at in reversed(changes):
+                    if change_seq <= seq:
+                        break
+                    keys.add(key)
+                changed[kind] = keys
+
+            return self._cursor(behind), changed
+
+    def _cursor(self, behind=0):
+        return ':'.join([self.epoch] +
+                        [str(self._seq_before(kind, time.time() - behind)
+                             if behind else self._seq[kind])
+                         for kind in self.kinds])
+
+    # Last sequence number of a type recorded at or before a time.
+    def _seq_before(self, kind, before):
+        seq = self._seq[kind]
+        for change_seq, key, changed_at in reversed(self._changes[kind]):
+            if changed_at <= before:
+                break
+            seq = change_seq - 1
+        return seq
+
+    def _parse(self, cursor):
+        if not cursor:
+            return None
+
+        parts = cursor.split(':')
+        if parts[0] != self.epoch or len(parts) != len(self.kinds) + 1:
+            return None
+
+        try:
+            return dict(zip(self.kinds, [int(x) for x in parts[1:]]))
+        except ValueError:
+            return None
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+from timeit import default_timer
+
+log = logging.getLogger(__name__)
+
+
+# Runs cleaning tasks in small batches so they don't hold row locks the db
+# updater is waiting for. Between batches it sleeps, for longer while the
+# db update queue is backed up. A task does at most budget rows per run,
+# the rest is left for the next one.
+#
+# A task is a function taking the max number of rows to clean and
+# returning how many it cleaned.
+class IncrementalCleaner(object):
+
+    def __init__(self, db_updates_queue=None, batch_size=500, budget=10000,
+                 pause=0.05, max_pause=10, busy_depth=50):
+        self.db_updates_queue = db_updates_queue
+        self.batch_size = batch_size
+        self.budget = budget
+        self.pause = pause
+        self.max_pause = max_pause
+        self.busy_depth = busy_depth
+        self._reset()
+
+    def _reset(self):
+        # name -> rows cleaned this pass
+        self.cleaned = {}
+        self.started = default_timer()
+
+    def queue_depth(self):
+        if self.db_updates_queue is None:
+            return 0
+        return self.db_updates_queue.qsize()
+
+    # Give the db updater some room, up to max_pause while it's behind.
+    def throttle(self):
+        time.sleep(self.pause)
+        waited = self.pause
+        while (self.queue_depth() > self.busy_depth and
+               waited < self.max_pause):
+            time.sleep(0.5)
+            waited += 0.5
+        return waited
+
+    def run(self, name, task, budget=None):
+        budget = budget or self.budget
+        total = 0
+        while total < budget:
+            limit = min(self.batch_size, budget - total)
+            rows = task(limit)
+            total += rows
+            if rows < limit:
+                break
+            self.throttle()
+        else:
+            log.debug('Cleaning budget of %s used up, continuing later.',
+                      name)
+
+        self.cleaned[name] = self.cleaned.get(name, 0) + total
+        return total
+
+    # Logs rows cleaned per second since the last report.
+    def report(self, label):
+        elapsed = default_timer() - self.started
+        total = sum(self.cleaned.values())
+        details = ', '.join('{} {}'.format(name, rows)
+                            for name, rows in sorted(self.cleaned.items())
+                            if rows)
+        log.info('%s: %d rows in %.1f seconds (%.0f/s)%s.', label, total,
+                 elapsed, total / elapsed if elapsed else 0,
+                 ': ' + details if details else '')
+        self._reset()
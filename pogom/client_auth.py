@@ -5,13 +5,121 @@ import logging
 import requests
 import urllib
 import datetime
+import threading
+import time
 
+from collections import OrderedDict
 from flask import jsonify
-from requests.exceptions import HTTPError
+from queue import Queue
+from requests.exceptions import HTTPError, RequestException
 
 log = logging.getLogger(__name__)
 log.setLevel('INFO')
 
+# Tests point this at a local server.
+discord_api = 'https://discordapp.com/api/v6'
+
+
+# OAuth responses plus guilds and roles of known users, by userAuthCode.
+# Guilds and roles are served from the cache while they're fresh, and
+# while stale (up to stale_ttl) they're still served while a background
+# thread fetches them again, so map polls don't wait on Discord. Entries
+# are replaced, never modified in place.
+class DiscordAuthCache(object):
+
+  def __init__(self, maxsize=10000, ttl=5 * 60, stale_ttl=60 * 60,
+               min_refresh=15):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.stale_ttl = stale_ttl
+    # Don't ask Discord about the same user more often than this.
+    self.min_refresh = min_refresh
+    self._entries = OrderedDict()
+    self._pending = set()
+    self._queue = Queue()
+    self._refresher = None
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, code):
+    with self._lock:
+      return self._entries.get(code)
+
+  def put(self, code, entry):
+    with self._lock:
+      self._entries.pop(code, None)
+      self._entries[code] = entry
+      # Oldest users go first.
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def discard(self, code):
+    with self._lock:
+      self._entries.pop(code, None)
+
+  def age(self, entry):
+    return time.time() - entry.get('checked', 0)
+
+  # Fetch guilds and roles again in the background.
+  def revalidate(self, code, args):
+    entry = self.get(code)
+    if entry is None or self.age(entry) < self.min_refresh:
+      return
+    with self._lock:
+      if code in self._pending:
+        return
+      self._pending.add(code)
+      if self._refresher is None:
+        self._refresher = threading.Thread(target=self._refresh_loop,
+                                           name='discord-auth-refresher')
+        self._refresher.daemon = True
+        self._refresher.start()
+    self._queue.put((code, args))
+
+  def _refresh_loop(self):
+    while True:
+      code, args = self._queue.get()
+      try:
+        self.refresh(code, args)
+      except Exception as e:
+        log.exception('Exception while refreshing Discord auth: %s', repr(e))
+      finally:
+        with self._lock:
+          self._pending.discard(code)
+
+  # Returns the refreshed entry, or None if the user is no longer valid.
+  # Network errors, rate limits and Discord errors keep what we have.
+  def refresh(self, code, args):
+    entry = self.get(code)
+    if entry is None:
+      return None
+    try:
+      entry = load_memberships(dict(entry), args)
+    except RequestException as e:
+      log.warning('Unable to reach Discord, keeping cached auth: %s', repr(e))
+      return self.get(code)
+    if entry is None:
+      self.discard(code)
+      return None
+    self.put(code, entry)
+    return entry
+
+
+# Adds guilds (and roles if required) to an auth entry. Returns None if
+# Discord turns us down.
+def load_memberships(entry, args):
+  entry['guilds'] = get_user_guilds(entry['access_token'])
+  if not entry['guilds']:
+    return None
+  if args.uas_discord_required_roles:
+    entry['roles'] = get_user_guild_roles(entry['access_token'], args)
+    if not entry['roles']:
+      return None
+  entry['checked'] = time.time()
+  return entry
+
 def redirect_client_to_auth(url_root, args):
   d = {}
   host = args.uas_host_override
@@ -25,29 +133,35 @@ def valid_client_auth(request, user_auth_code_cache, args):
   if not userAuthCode:
     log.debug("no userAuthCode")
     return False
-  oauth_response = user_auth_code_cache.get(userAuthCode, False)
-  if not oauth_response:
-    oauth_response = exchange_code(userAuthCode, request.url_root, args)
-    if (not oauth_response):
+  entry = user_auth_code_cache.get(userAuthCode)
+  if not entry:
+    # Unknown user, this one has to wait for Discord.
+    try:
+      oauth_response = exchange_code(userAuthCode, request.url_root, args)
+      if (not oauth_response):
+        return False
+      entry = dict(oauth_response)
+      entry['expires'] = datetime.datetime.now() + datetime.timedelta(0, int(oauth_response.get('expires_in')))
+      if args.uas_discord_required_guild:
+        entry = load_memberships(entry, args)
+        if not entry:
+          return False
+    except RequestException as e:
+      log.warning('Unable to reach Discord: %s', repr(e))
       return False
-    user_auth_code_cache[userAuthCode] = oauth_response
-    user_auth_code_cache[userAuthCode]['expires'] = datetime.datetime.now() + datetime.timedelta(0, int(oauth_response.get('expires_in')))
-  if user_auth_code_cache[userAuthCode]['expires'] < datetime.datetime.now():
+    user_auth_code_cache.put(userAuthCode, entry)
+  if entry['expires'] < datetime.datetime.now():
     log.debug("oauth expired")
-    del user_auth_code_cache[userAuthCode]
+    user_auth_code_cache.discard(userAuthCode)
     return False
   if args.uas_discord_required_guild:
-    if not user_auth_code_cache[userAuthCode].get('guilds', False):
-      user_auth_code_cache[userAuthCode]['guilds'] = get_user_guilds(user_auth_code_cache[userAuthCode]['access_token'])
-      if not user_auth_code_cache[userAuthCode]['guilds']:
-        del user_auth_code_cache[userAuthCode]
+    age = user_auth_code_cache.age(entry)
+    if age > user_auth_code_cache.stale_ttl:
+      # Too old to go on, check now.
+      if not user_auth_code_cache.refresh(userAuthCode, args):
         return False
-    if args.uas_discord_required_roles:
-      if not user_auth_code_cache[userAuthCode].get('roles', False):
-        user_auth_code_cache[userAuthCode]['roles'] = get_user_guild_roles(user_auth_code_cache[userAuthCode]['access_token'], args)
-        if not user_auth_code_cache[userAuthCode]['roles']:
-          del user_auth_code_cache[userAuthCode]
-          return False
+    elif age > user_auth_code_cache.ttl:
+      user_auth_code_cache.revalidate(userAuthCode, args)
   return True
 
 def valid_discord_guild(request, user_auth_code_cache, args):
@@ -57,7 +171,8 @@ def valid_discord_guild(request, user_auth_code_cache, args):
     if g['id'] == args.uas_discord_required_guild:
       return True
   log.debug("User not in required discord guild.")
-  del user_auth_code_cache[userAuthCode]['guilds']
+  # They may be joining right now, look again for the next poll.
+  user_auth_code_cache.revalidate(userAuthCode, args)
   return False
 
 def valid_discord_guild_role(request, user_auth_code_cache, args):
@@ -68,7 +183,7 @@ def valid_discord_guild_role(request, user_auth_code_cache, args):
     if r in requiredRoles:
       return True
   log.debug("User not in required discord guild role.")
-  del user_auth_code_cache[userAuthCode]['roles']
+  user_auth_code_cache.revalidate(userAuthCode, args)
   return False
   
 def redirect_to_discord_guild_invite(args):
@@ -87,7 +202,7 @@ def exchange_code(code, url_root, args):
   headers = {
     'Content-Type': 'application/x-www-form-urlencoded'
   }
-  r = requests.post('%s/oauth2/token' % 'https://discordapp.com/api/v6', data, headers)
+  r = requests.post('%s/oauth2/token' % discord_api, data, headers, timeout=10)
   if r.status_code == 401:
     return False
   try:
@@ -97,15 +212,25 @@ def exchange_code(code, url_root, args):
     return False
   return r.json()
 
+# False if Discord turned the user down (revoked token, not a member).
+# Rate limits and outages raise HTTPError instead, so cached users stay
+# logged in.
+def discord_accepted(r, attempt):
+  try:
+    r.raise_for_status()
+  except HTTPError:
+    log.debug('' + str(r.status_code) + ' returned from ' + attempt + ' attempt: ' + r.text)
+    if r.status_code not in (401, 403, 404):
+      raise
+    return False
+  return True
+
 def get_user_guilds(auth_token):
   headers = {
     'Authorization': 'Bearer ' + auth_token
   }
-  r = requests.get('https://discordapp.com/api/v6/users/@me/guilds', headers=headers)
-  try:
-    r.raise_for_status()
-  except:
-    log.debug('' + str(r.status_code) + ' returned from guild list attempt: ' + r.text)
+  r = requests.get(discord_api + '/users/@me/guilds', headers=headers, timeout=10)
+  if not discord_accepted(r, 'guild list'):
     return False
   return r.json()
     
@@ -114,21 +239,15 @@ def get_user_guild_roles(auth_token, args):
   headers = {
     'Authorization': 'Bearer ' + auth_token
   }
-  r = requests.get('https://discordapp.com/api/v6/users/@me', headers=headers)
-  try:
-    r.raise_for_status()
-  except:
-    log.debug('' + str(r.status_code) + ' returned from Discord @me attempt: ' + r.text)
+  r = requests.get(discord_api + '/users/@me', headers=headers, timeout=10)
+  if not discord_accepted(r, 'Discord @me'):
     return False
   user_id = r.json()['id']
   headers = {
     'Authorization': 'Bot ' + args.uas_discord_bot_token
   }
-  r = requests.get('https://discordapp.com/api/v6/guilds/' + args.uas_discord_required_guild + '/members/' + user_id, headers=headers)
-  try:
-    r.raise_for_status()
-  except:
-    log.debug('' + str(r.status_code) + ' returned from Discord guild member attempt: ' + r.text)
+  r = requests.get(discord_api + '/guilds/' + args.uas_discord_required_guild + '/members/' + user_id, headers=headers, timeout=10)
+  if not discord_accepted(r, 'Discord guild member'):
     return False
   return r.json()['roles']
     
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Column oriented encoding of raw_data responses.
+#
+# Instead of a list of dicts every list becomes
+#   {'count': n, 'columns': {'field': [value_0, ..., value_n-1]}}
+# so keys are sent once per field rather than once per row. Columns that are
+# null for every row are left out, and per species data (name, rarity,
+# types) is moved to a single 'species' dict keyed by pokemon_id.
+#
+# The result is still plain JSON made of the same values, so it goes
+# through CustomJSONEncoder like the regular format does.
+
+COLUMNS_MIMETYPE = 'application/vnd.rocketmap.columns+json'
+
+# raw_data lists that are encoded column-wise.
+COLUMN_KEYS = ('pokemons', 'lurePokemons', 'pokestops', 'scanned',
+               'spawnpoints')
+
+# Fields that only depend on pokemon_id.
+SPECIES_FIELDS = ('pokemon_name', 'pokemon_rarity', 'pokemon_types')
+
+
+def wants_columns(request):
+    if request.args.get('format') == 'columns':
+        return True
+    return request.accept_mimetypes.best == COLUMNS_MIMETYPE
+
+
+def encode_columns(rows, species=None):
+    fields = []
+    seen = set()
+    for row in rows:
+        for field in row:
+            if field not in seen:
+                seen.add(field)
+                fields.append(field)
+
+    if species is not None and 'pokemon_id' in seen:
+        for row in rows:
+            if row['pokemon_id'] not in species:
+                species[row['pokemon_id']] = dict(
+                    (field, row.get(field)) for field in SPECIES_FIELDS)
+        fields = [f for f in fields if f not in SPECIES_FIELDS]
+
+    columns = {}
+    for field in fields:
+        column = [row.get(field) for row in rows]
+        if any(value is not None for value in column):
+            columns[field] = column
+
+    return {'count': len(rows), 'columns': columns}
+
+
+def to_columns(d):
+    species = {}
+    for key in COLUMN_KEYS:
+        if key in d:
+            d[key] = encode_columns(d[key], species)
+
+    d['species'] = species
+    d['format'] = 'columns'
+    return d
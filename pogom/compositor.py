@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# In-process rendering of the dynamic Pokemon and gym icons with Pillow.
+#
+# Layouts follow the ImageMagick command lines built in dyn_img.py, so icons
+# look the same whichever way they were generated.
+
+import io
+import logging
+
+from threading import Lock
+from cachetools import LRUCache
+
+# Pillow is optional, dyn_img falls back to ImageMagick without it.
+try:
+    from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageFont
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# Badge background, ImageMagick's "#FFFD".
+BADGE_FILL = (255, 255, 255, 221)
+
+# Decoded source images (sprites, badges, gym bases) by path.
+source_cache = LRUCache(maxsize=512)
+source_lock = Lock()
+font_cache = {}
+
+
+def available():
+    return Image is not None
+
+
+def load_image(path):
+    with source_lock:
+        image = source_cache.get(path)
+    if image is None:
+        image = Image.open(path).convert('RGBA')
+        image.load()
+        with source_lock:
+            source_cache[path] = image
+    # Callers draw on what they get.
+    return image.copy()
+
+
+def load_font(path, size):
+    key = (path, size)
+    if key not in font_cache:
+        font_cache[key] = ImageFont.truetype(path, size)
+    return font_cache[key]
+
+
+def encode_png(image):
+    out = io.BytesIO()
+    image.save(out, 'PNG', optimize=False)
+    return out.getvalue()
+
+
+# Scale to fit within width x height, keeping the aspect ratio. Like
+# ImageMagick's geometry, "shrink_only" is the ">" flag.
+def fit(image, width, height, shrink_only=False):
+    ratio = min(width / float(image.width), height / float(image.height))
+    if shrink_only and ratio >= 1:
+        return image
+    size = (max(1, int(round(image.width * ratio))),
+            max(1, int(round(image.height * ratio))))
+    return image.resize(size, Image.LANCZOS)
+
+
+# -trim +repage
+def trim(image):
+    bbox = image.getchannel('A').getbbox()
+    return image.crop(bbox) if bbox else image
+
+
+# -background none -gravity center -extent WxH
+def extent(image, width, height):
+    canvas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    canvas.paste(image, ((width - image.width) // 2,
+                         (height - image.height) // 2), image)
+    return canvas
+
+
+# -unsharp 0x1
+def unsharp(image):
+    return image.filter(ImageFilter.UnsharpMask(radius=1, percent=100,
+                                                threshold=0))
+
+
+# ( +clone -background black -shadow 80x3+5+5 ) +swap -layers merge
+def drop_shadow(image, opacity=0.8, sigma=3, offset=5):
+    pad = 2 * sigma
+    canvas = Image.new('RGBA', (image.width + 2 * pad,
+                                image.height + 2 * pad), (0, 0, 0, 0))
+    alpha = image.getchannel('A').point(lambda a: int(a * opacity))
+    shadow = Image.new('RGBA', image.size, (0, 0, 0, 255))
+    shadow.putalpha(alpha)
+    canvas.paste(shadow, (pad, pad))
+    canvas = canvas.filter(ImageFilter.GaussianBlur(sigma))
+
+    # The shadow's page offset is +offset-pad, the merged canvas starts at
+    # whichever of the two layers is further up/left.
+    shift = offset - pad
+    origin = min(0, shift)
+    merged = Image.new('RGBA', (max(image.width, shift + canvas.width) -
+                                origin,
+                                max(image.height, shift + canvas.height) -
+                                origin), (0, 0, 0, 0))
+    merged.alpha_composite(canvas, (shift - origin, shift - origin))
+    merged.alpha_composite(image, (-origin, -origin))
+    return merged
+
+
+# Top left corner of a width x height box placed with ImageMagick's gravity
+# and offset on a canvas.
+def gravity_position(canvas, width, height, gravity, dx=0, dy=0):
+    if gravity == 'north':
+        return (canvas.width - width) // 2 + dx, dy
+    elif gravity == 'northeast':
+        return canvas.width - width - dx, dy
+    elif gravity == 'east':
+        return canvas.width - width - dx, (canvas.height - height) // 2 + dy
+    return ((canvas.width - width) // 2 + dx,
+            (canvas.height - height) // 2 + dy)
+
+
+# -gravity G ( image ) -geometry +dx+dy -composite
+def composite(canvas, image, gravity, dx=0, dy=0):
+    x, y = gravity_position(canvas, image.width, image.height, gravity,
+                            dx, dy)
+    # Whatever sticks out of the canvas is cut off, as with ImageMagick.
+    left, top = max(0, -x), max(0, -y)
+    if left or top:
+        image = image.crop((left, top, image.width, image.height))
+    canvas.alpha_composite(image, (x + left, y + top))
+
+
+# -draw "circle x,y x,y2"
+def circle(canvas, x, y, radius, fill):
+    # Draw on a layer of its own so a translucent fill blends in.
+    layer = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+    ImageDraw.Draw(layer).ellipse(
+        (x - radius, y - radius, x + radius, y + radius),
+        fill=fill, outline=(0, 0, 0, 255))
+    canvas.alpha_composite(layer)
+
+
+def text_size(draw, text, font):
+    # textsize() is gone from recent Pillow releases.
+    if hasattr(draw, 'textbbox'):
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        return right - left, bottom - top
+    return draw.textsize(text, font=font)
+
+
+# -draw "image over dx,dy w,h 'path'"
+def draw_image(canvas, path, gravity, dx, dy, width, height):
+    image = fit(load_image(path), width, height)
+    x, y = gravity_position(canvas, width, height, gravity, dx, dy)
+    canvas.alpha_composite(image, (x + (width - image.width) // 2,
+                                   y + (height - image.height) // 2))
+
+
+# A round badge with a small image on the right hand side of a Pokemon
+# icon. top is the y of the circle's top edge.
+def side_badge(canvas, path, top, radius, dx, dy, size):
+    x = canvas.width - radius - 2
+    circle(canvas, x, top + radius, radius, BADGE_FILL)
+    draw_image(canvas, path, 'east', dx, dy, size, size)
+
+
+def pokemon_raw_icon(source, medal_img=None):
+    image = extent(unsharp(fit(trim(load_image(source)), 96, 96,
+                               shrink_only=True)), 96, 96)
+    if medal_img:
+        side_badge(image, medal_img, 65, 12, 6, 29, 15)
+    return image
+
+
+def pokemon_map_icon(source, crop=None, gender_img=None, weather_img=None,
+                     medal_img=None, previous_img=None):
+    image = load_image(source)
+    if crop:
+        # Spritesheet tile, -crop WxH+X+Y +repage
+        image = image.crop(crop)
+    else:
+        # -bordercolor none -border 2
+        image = extent(image, image.width + 4, image.height + 4)
+        # -background black -alpha background -channel A -blur 0x1
+        # -level 0,10%: a soft dark outline around the Pokemon.
+        outline = image.getchannel('A').filter(
+            ImageFilter.GaussianBlur(1)).point(lambda a: min(255, a * 10))
+        backed = Image.new('RGBA', image.size, (0, 0, 0, 255))
+        backed.alpha_composite(image)
+        backed.putalpha(outline)
+        # -adaptive-resize 96x96 -modulate 100,110
+        image = ImageEnhance.Color(fit(backed, 96, 96)).enhance(1.1)
+
+    if gender_img:
+        side_badge(image, gender_img, 40, 12, 6, 5, 15)
+    if weather_img:
+        radius = 20
+        circle(image, image.width - radius - 2, radius + 1, radius,
+               BADGE_FILL)
+        draw_image(image, weather_img, 'northeast', 1, 1, 42, 42)
+    if medal_img:
+        side_badge(image, medal_img, 65, 12, 6, 29, 15)
+    if previous_img:
+        side_badge(image, previous_img, 65, 12, 3, 29, 22)
+
+    return image
+
+
+class GymIcon(object):
+
+    def __init__(self, base, font, font_size):
+        self.image = load_image(base)
+        self.font = load_font(font, font_size)
+
+    def subject(self, path, size, gravity='north', trimmed=False):
+        image = load_image(path)
+        if trimmed:
+            image = trim(image)
+        image = drop_shadow(unsharp(fit(image, size, size)))
+        composite(self.image, image, gravity)
+
+    def badge(self, pos, radius, fill, text_col, text):
+        x, y = pos
+        circle(self.image, x, y, radius, fill)
+        draw = ImageDraw.Draw(self.image)
+        text = str(text)
+        width, height = text_size(draw, text, self.font)
+        # Same spot as the ImageMagick version's -gravity center offset.
+        draw.text((x + 1 - width // 2, y + 4 - height // 2), text,
+                  fill=text_col, font=self.font)
+
+    def battle(self, path):
+        image = drop_shadow(fit(load_image(path), 90, 90))
+        composite(self.image, image, 'center')
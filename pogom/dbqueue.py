@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from collections import deque
+from queue import Empty, Full
+
+log = logging.getLogger(__name__)
+
+# Lanes in the order they're served, with what happens when one is full:
+# 'block' makes the producer wait (backpressure on the scanners), 'shed'
+# drops the oldest item, which a newer one supersedes anyway.
+LANES = (
+    ('map', 'block'),
+    ('scan', 'block'),
+    ('status', 'shed')
+)
+
+# Lane of each model, by name. Anything else goes in the scan lane.
+MODEL_LANES = {
+    # What the map and webhooks show.
+    'Pokemon': 'map',
+    'LurePokemon': 'map',
+    'Pokestop': 'map',
+    'Gym': 'map',
+    'Raid': 'map',
+    'Weather': 'map',
+    # Worker and key status, rewritten every scan.
+    'WorkerStatus': 'status',
+    'MainWorker': 'status',
+    'HashKeys': 'status'
+}
+
+# A lane waiting this long is served before the ones above it, so status
+# rows still get written while the map lane is busy.
+MAX_WAIT = 30
+
+
+class Lane(object):
+
+    def __init__(self, name, policy, maxsize):
+        self.name = name
+        self.policy = policy
+        self.maxsize = maxsize
+        # (enqueued at, item)
+        self.items = deque()
+        self.shed = 0
+        # Moving average of the time items waited.
+        self.latency = 0.0
+
+    def full(self):
+        return self.maxsize > 0 and len(self.items) >= self.maxsize
+
+    def waited(self, now):
+        return now - self.items[0][0] if self.items else 0
+
+
+# Drop-in for the Queue of (model, data) items consumed by db_updater,
+# with a bounded lane per kind of data.
+class DBUpdateQueue(object):
+
+    def __init__(self, maxsize=0):
+        self.lanes = [Lane(name, policy, maxsize) for name, policy in LANES]
+        self._by_name = dict((lane.name, lane) for lane in self.lanes)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._all_done = threading.Condition(self._lock)
+        self._last_shed_warning = 0
+
+    def lane(self, model):
+        return self._by_name[MODEL_LANES.get(model.__name__, 'scan')]
+
+    def put(self, item, block=True, timeout=None):
+        lane = self.lane(item[0])
+        with self._not_full:
+            if lane.full() and lane.policy == 'shed':
+                lane.items.popleft()
+                lane.shed += 1
+                self._unfinished -= 1
+                self._warn_shed(lane)
+            elif lane.full():
+                deadline = timeout is not None and time.time() + timeout
+                while lane.full():
+                    remaining = deadline and deadline - time.time()
+                    if not block or (deadline and remaining <= 0):
+                        raise Full
+                    self._not_full.wait(remaining or None)
+
+            lane.items.append((time.time(), item))
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def _warn_shed(self, lane):
+        if time.time() - self._last_shed_warning > 60:
+            self._last_shed_warning = time.time()
+            log.warning('DB %s lane is full (%d), dropped %d old items so '
+                        'far; try increasing --db-threads.', lane.name,
+                        lane.maxsize, lane.shed)
+
+    # Highest lane with something in it, unless some have waited too long:
+    # then the one that has waited longest.
+    def _next_lane(self):
+        now = time.time()
+        first = None
+        overdue = None
+        for lane in self.lanes:
+            if not lane.items:
+                continue
+            if lane.waited(now) > MAX_WAIT and (
+                    overdue is None or
+                    lane.waited(now) > overdue.waited(now)):
+                overdue = lane
+            first = first or lane
+        return overdue or first
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            deadline = timeout is not None and time.time() + timeout
+            lane = self._next_lane()
+            while lane is None:
+                remaining = deadline and deadline - time.time()
+                if not block or (deadline and remaining <= 0):
+                    raise Empty
+                self._not_empty.wait(remaining or None)
+                lane = self._next_lane()
+
+            enqueued, item = lane.items.popleft()
+            lane.latency = 0.9 * lane.latency + 0.1 * (time.time() - enqueued)
+            self._not_full.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def task_done(self):
+        with self._all_done:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        with self._all_done:
+            while self._unfinished > 0:
+                self._all_done.wait()
+
+    def qsize(self):
+        with self._lock:
+            return sum(len(lane.items) for lane in self.lanes)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    # [(name, depth, average wait, oldest item's wait, items shed)]
+    def lane_stats(self):
+        now = time.time()
+        with self._lock:
+            return [(lane.name, len(lane.items), lane.latency,
+                     lane.waited(now), lane.shed) for lane in self.lanes]
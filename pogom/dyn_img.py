@@ -1,8 +1,13 @@
 import logging
 import os
 import subprocess
+import threading
 from string import join
 
+from cachetools import LRUCache
+
+from pogom import compositor
+
 from pgoapi.protos.pogoprotos.enums.costume_pb2 import Costume
 from pgoapi.protos.pogoprotos.enums.form_pb2 import Form
 from pgoapi.protos.pogoprotos.enums.gender_pb2 import MALE, FEMALE, Gender, GENDERLESS, GENDER_UNSET
@@ -16,9 +21,14 @@ log = logging.getLogger(__name__)
 
 # Will be set during config parsing
 generate_images = False
+native_images = False
 imagemagick_executable = None
 pogo_assets = None
 
+# Encoded PNGs in front of the generated files on disk, by path.
+icon_cache = LRUCache(maxsize=32 * 1024 * 1024, getsizeof=len)
+icon_cache_lock = threading.Lock()
+
 path_static = os.path.join(os.path.dirname(__file__), '..', 'static')
 path_icons = os.path.join(path_static, 'sprites')
 path_images = os.path.join(path_static, 'images')
@@ -107,6 +117,10 @@ font_pointsize = 25
 def get_pokemon_raw_icon(pkm, time, medal=None, gender=None, form=None, costume=None, weather=None, shiny=False, previous_id=None):
     if generate_images and pogo_assets:
         source, target = pokemon_asset_path_shuffle(pkm, time, classifier='icon', medal=medal, gender=gender, form=form, costume=costume, weather=weather, shiny=shiny, previous_id=previous_id)
+        if native_images:
+            return render_icon(target, lambda: compositor.pokemon_raw_icon(
+                source, medal_img=medal_images[pkm] if medal else None))
+
         im_lines = ['-fuzz 0.5% -trim +repage'
                     ' -scale "96x96>" -unsharp 0x1'
                     ' -background none -gravity center -extent 96x96'
@@ -128,6 +142,7 @@ def get_pokemon_raw_icon(pkm, time, medal=None, gender=None, form=None, costume=
 
 def get_pokemon_map_icon(pkm, time, weather=None, medal=None, gender=None, form=None, costume=None, previous_id=None):
     im_lines = []
+    crop = None
 
     # Add Pokemon icon
     if pogo_assets:
@@ -160,6 +175,23 @@ def get_pokemon_map_icon(pkm, time, weather=None, medal=None, gender=None, form=
         x = (pkm_idx % pkm_sprites_cols) * pkm_sprites_size
         y = (pkm_idx / pkm_sprites_cols) * pkm_sprites_size
         im_lines.append(' -crop {size}x{size}+{x}+{y} +repage'.format(size=target_size, x=x, y=y))
+        crop = (x, y, x + target_size, y + target_size)
+
+    weather_img = None
+    if weather:
+        if time == 2 and weather in (1, 3):
+            weather_img = weather_images[weather + 10]
+        else:
+            weather_img = weather_images[weather]
+
+    if native_images:
+        return render_icon(target, lambda: compositor.pokemon_map_icon(
+            source, crop=crop,
+            gender_img=gender_images[gender] if gender else None,
+            weather_img=weather_img,
+            medal_img=medal_images[pkm] if medal else None,
+            previous_img=os.path.join(
+                path_icons, '{}.png'.format(previous_id)) if previous_id else None))
 
     if gender:
         radius = 12
@@ -177,25 +209,11 @@ def get_pokemon_map_icon(pkm, time, weather=None, medal=None, gender=None, form=
         x = target_size - radius - 2
         y = radius + 1
         y2 = 1
-        if time == 2:
-            if not weather == 1 and not weather == 3:
-                im_lines.append(
-                    '-gravity northeast'
-                    ' -fill "#FFFD" -stroke black -draw "circle {x},{y} {x},{y2}"'
-                    ' -draw "image over 1,1 42,42 \'{weather_img}\'"'.format(x=x, y=y, y2=y2, weather_img=weather_images[weather])
-                )
-            else:
-                im_lines.append(
-                    '-gravity northeast'
-                    ' -fill "#FFFD" -stroke black -draw "circle {x},{y} {x},{y2}"'
-                    ' -draw "image over 1,1 42,42 \'{weather_img}\'"'.format(x=x, y=y, y2=y2, weather_img=weather_images[weather + 10])
-                )
-        else:
-            im_lines.append(
-                '-gravity northeast'
-                ' -fill "#FFFD" -stroke black -draw "circle {x},{y} {x},{y2}"'
-                ' -draw "image over 1,1 42,42 \'{weather_img}\'"'.format(x=x, y=y, y2=y2, weather_img=weather_images[weather])
-            )
+        im_lines.append(
+            '-gravity northeast'
+            ' -fill "#FFFD" -stroke black -draw "circle {x},{y} {x},{y2}"'
+            ' -draw "image over 1,1 42,42 \'{weather_img}\'"'.format(x=x, y=y, y2=y2, weather_img=weather_img)
+        )
 
     if medal:
         radius = 12
@@ -261,27 +279,59 @@ def get_gym_icon(team, level, raidlevel, pkm, time, is_in_battle):
         im_lines.extend(draw_battle_indicator())
 
     gym_image = os.path.join(path_gym, '{}.png'.format(team))
+    if native_images:
+        return render_icon(out_filename, lambda: compose_gym_icon(
+            gym_image, level, raidlevel, pkm, time, is_in_battle))
+
     return run_imagemagick(gym_image, im_lines, out_filename)
 
 
-def draw_raid_pokemon(pkm, time, raidlevel):
-    raidlevel = int(raidlevel)
+# Same layout as the ImageMagick lines built by get_gym_icon().
+def compose_gym_icon(gym_image, level, raidlevel, pkm, time, is_in_battle):
+    icon = compositor.GymIcon(gym_image, font, font_pointsize)
+    if pkm and pkm != 'null':
+        raidlevel = int(raidlevel)
+        pkm_path, trim = raid_pokemon_source(pkm, time)
+        icon.subject(pkm_path, int(pkm_sizes[raidlevel]), trimmed=trim)
+        icon.badge(badge_upper_right, gym_badge_radius, "white", "black",
+                   raidlevel)
+    elif raidlevel:
+        raidlevel = int(raidlevel)
+        icon.subject(raid_egg_source(raidlevel), int(egg_sizes[raidlevel]),
+                     gravity='center')
+        icon.badge(badge_upper_right, gym_badge_radius, "white", "black",
+                   raidlevel)
+
+    if level > 0:
+        icon.badge(badge_lower_right, gym_badge_radius, "black", "white",
+                   level)
+    if is_in_battle:
+        icon.battle(os.path.join(path_gym, 'battle.png'))
+
+    return icon.image
+
+
+def raid_pokemon_source(pkm, time):
     if pogo_assets:
         pkm_path, dummy = pokemon_asset_path_shuffle(int(pkm), time)
-        trim = True
-    else:
-        pkm_path = os.path.join(path_icons, '{}.png'.format(pkm))
-        trim = False
+        return pkm_path, True
+    return os.path.join(path_icons, '{}.png'.format(pkm)), False
+
+
+def raid_egg_source(raidlevel):
+    if pogo_assets:
+        return os.path.join(pogo_assets, egg_images_assets[raidlevel])
+    return egg_images[raidlevel]
+
+
+def draw_raid_pokemon(pkm, time, raidlevel):
+    raidlevel = int(raidlevel)
+    pkm_path, trim = raid_pokemon_source(pkm, time)
     return draw_gym_subject(pkm_path, pkm_sizes[raidlevel], trim=trim)
 
 
 def draw_raid_egg(raidlevel):
-    if pogo_assets:
-        egg_path = os.path.join(pogo_assets, egg_images_assets[raidlevel])
-    else:
-        egg_path = egg_images[raidlevel]
-    #raidlevel = int(raidlevel)
-    return draw_gym_subject(egg_path, egg_sizes[raidlevel], gravity='center')
+    return draw_gym_subject(raid_egg_source(raidlevel), egg_sizes[raidlevel], gravity='center')
 
 
 def draw_gym_level(level):
@@ -492,6 +542,46 @@ def default_gym_image(team, level, raidlevel, pkm):
     return os.path.join(path, icon)
 
 
+# Render an icon in-process unless it has been generated before, keeping
+# the PNG in memory for the request that's waiting for it.
+def render_icon(out_filename, compose):
+    if os.path.isfile(out_filename):
+        return out_filename
+
+    # Make sure, target path exists
+    init_image_dir(os.path.split(out_filename)[0])
+
+    log.info("Generating icon '{}'".format(out_filename))
+    data = compositor.encode_png(compose())
+
+    # Write next to the target and move it in place, so concurrent requests
+    # never read half a file.
+    tmp_filename = '{}.{}.tmp'.format(out_filename, threading.current_thread().ident)
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+    try:
+        os.rename(tmp_filename, out_filename)
+    except OSError:
+        # Windows won't rename over a file another thread just created.
+        os.remove(tmp_filename)
+
+    with icon_cache_lock:
+        icon_cache[out_filename] = data
+    return out_filename
+
+
+# PNG bytes of an icon returned by the functions above.
+def load_icon(filename):
+    with icon_cache_lock:
+        data = icon_cache.get(filename)
+    if data is None:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        with icon_cache_lock:
+            icon_cache[filename] = data
+    return data
+
+
 def run_imagemagick(source, im_lines, out_filename):
     if not os.path.isfile(out_filename):
         # Make sure, target path exists
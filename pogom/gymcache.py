@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from collections import OrderedDict
+
+
+# Assembled gym documents (details, defenders and raid) keyed by gym_id.
+#
+# A document is stored along with the last_scanned of the Gym row it was
+# built for and is only handed out for that same last_scanned, so gyms
+# rescanned by another instance are rebuilt. Writes to the tables a
+# document is assembled from invalidate it, and the TTL covers writes from
+# other processes that don't touch the Gym row.
+class GymDocuments(object):
+
+    def __init__(self, maxsize=20000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # gym_id -> (last_scanned, expires, doc)
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, gym_id, last_scanned):
+        with self._lock:
+            entry = self._docs.get(gym_id)
+            if entry is None:
+                return None
+            if entry[0] != last_scanned or entry[1] <= time.time():
+                del self._docs[gym_id]
+                return None
+            return entry[2]
+
+    def put(self, gym_id, last_scanned, doc):
+        with self._lock:
+            self._docs.pop(gym_id, None)
+            self._docs[gym_id] = (last_scanned, time.time() + self.ttl, doc)
+            # Oldest documents go first.
+            while len(self._docs) > self.maxsize:
+                self._docs.popitem(last=False)
+
+    def invalidate(self, gym_ids):
+        with self._lock:
+            for gym_id in gym_ids:
+                self._docs.pop(gym_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import math
+import threading
+
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+
+# In-memory index of active Pokemon, bucketed on a fixed lat/lng grid.
+# It is fed with the same dicts parse_map pushes to the db updater queue, so
+# map viewport queries can be answered without hitting MySQL. Entries are
+# dropped once their disappear_time has passed.
+class LivePokemonIndex(object):
+
+    def __init__(self, cell_size=0.01):
+        # 0.01 degrees is roughly 1.1km of latitude.
+        self.cell_size = cell_size
+        self.ready = False
+        self._pokemon = {}
+        self._cells = {}
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pokemon)
+
+    # Bulk load rows (e.g. from the DB on a cold start) and mark the index
+    # as ready to answer queries.
+    def load(self, rows):
+        self.update(rows)
+        self.ready = True
+        log.info('Loaded %d active Pokemon into the live index.', len(self))
+
+    def update(self, rows):
+        now_date = datetime.utcnow()
+        with self._lock:
+            for row in rows:
+                if row['disappear_time'] > now_date:
+                    self._put(row, now_date)
+            self._expire(now_date)
+
+    def query(self, swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
+              oSwLng=None, oNeLat=None, oNeLng=None, pokemon_ids=None,
+              encounter_ids=None):
+        now_date = datetime.utcnow()
+        modified_since = None
+        if timestamp > 0:
+            modified_since = datetime.utcfromtimestamp(timestamp / 1000)
+
+        bounds = None
+        if None not in (swLat, swLng, neLat, neLng):
+            bounds = (float(swLat), float(swLng), float(neLat), float(neLng))
+
+        # The caller knows exactly what changed, skip the time filter.
+        if encounter_ids is not None:
+            modified_since = None
+
+        # Only exclude the old viewport on the "newly uncovered" path, like
+        # the SQL version does.
+        old_bounds = None
+        if (bounds and not modified_since and encounter_ids is None and
+                None not in (oSwLat, oSwLng, oNeLat, oNeLng)):
+            old_bounds = (float(oSwLat), float(oSwLng),
+                          float(oNeLat), float(oNeLng))
+
+        pokemon = []
+        with self._lock:
+            self._expire(now_date)
+
+            for row in self._candidates(bounds):
+                if row['disappear_time'] <= now_date:
+                    continue
+                if encounter_ids is not None and (
+                        row['encounter_id'] not in encounter_ids):
+                    continue
+                if pokemon_ids is not None and (
+                        row['pokemon_id'] not in pokemon_ids):
+                    continue
+                if bounds and not _in_bounds(row, bounds):
+                    continue
+                if old_bounds and _in_bounds(row, old_bounds):
+                    continue
+                if modified_since and not (
+                        row.get('last_modified') and
+                        row['last_modified'] > modified_since):
+                    continue
+
+                # Callers decorate the result, hand out a copy.
+                pokemon.append(dict(row))
+
+        return pokemon
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lng / self.cell_size)))
+
+    def _candidates(self, bounds):
+        if not bounds:
+            return list(self._pokemon.values())
+
+        sw = self._cell(bounds[0], bounds[1])
+        ne = self._cell(bounds[2], bounds[3])
+        num_cells = (ne[0] - sw[0] + 1) * (ne[1] - sw[1] + 1)
+
+        # Zoomed out far enough that walking the grid costs more than
+        # checking every bucket we actually have.
+        if num_cells > len(self._cells):
+            keys = [k for k in self._cells
+                    if sw[0] <= k[0] <= ne[0] and sw[1] <= k[1] <= ne[1]]
+        else:
+            keys = [(x, y)
+                    for x in range(sw[0], ne[0] + 1)
+                    for y in range(sw[1], ne[1] + 1)]
+
+        rows = []
+        for key in keys:
+            for encounter_id in self._cells.get(key, ()):
+                rows.append(self._pokemon[encounter_id])
+        return rows
+
+    def _put(self, row, now_date):
+        row = dict(row)
+        # Rows from the db updater have just been written, the parse_map
+        # dicts don't carry a last_modified.
+        if not row.get('last_modified'):
+            row['last_modified'] = now_date
+
+        encounter_id = row['encounter_id']
+        old = self._pokemon.get(encounter_id)
+        if old is not None:
+            # Don't let a stale snapshot (e.g. the cold start load) replace
+            # a row the db updater has committed since.
+            if old['last_modified'] > row['last_modified']:
+                return
+            self._remove(encounter_id)
+
+        self._pokemon[encounter_id] = row
+        self._cells.setdefault(
+            self._cell(row['latitude'], row['longitude']),
+            set()).add(encounter_id)
+        heapq.heappush(self._expiry, (row['disappear_time'], encounter_id))
+
+    def _remove(self, encounter_id):
+        row = self._pokemon.pop(encounter_id)
+        key = self._cell(row['latitude'], row['longitude'])
+        bucket = self._cells.get(key)
+        if bucket is not None:
+            bucket.discard(encounter_id)
+            if not bucket:
+                del self._cells[key]
+
+    def _expire(self, now_date):
+        while self._expiry and self._expiry[0][0] <= now_date:
+            disappear_time, encounter_id = heapq.heappop(self._expiry)
+            row = self._pokemon.get(encounter_id)
+            # The Pokemon may have been upserted again with a later
+            # disappear_time, in which case a newer heap entry covers it.
+            if row is not None and row['disappear_time'] <= now_date:
+                self._remove(encounter_id)
+
+
+def _in_bounds(row, bounds):
+    return (bounds[0] <= row['latitude'] <= bounds[2] and
+            bounds[1] <= row['longitude'] <= bounds[3])
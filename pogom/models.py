@@ -9,35 +9,50 @@ import gc
 import time
 import geopy
 import math
+import heapq
 
 import traceback
 import random
 
-import s2sphere
 from peewee import (InsertQuery, Check, CompositeKey, ForeignKeyField,
                     SmallIntegerField, IntegerField, CharField, DoubleField,
                     BooleanField, DateTimeField, fn, DeleteQuery, FloatField,
                     TextField, BigIntegerField, PrimaryKeyField,
-                    JOIN, OperationalError)
+                    JOIN, OperationalError, SQL)
 from playhouse.flask_utils import FlaskDB
 from playhouse.pool import PooledMySQLDatabase
 from playhouse.shortcuts import RetryOperationalError, case
 from playhouse.migrate import migrate, MySQLMigrator
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from cachetools import TTLCache
 from cachetools import cached
 from timeit import default_timer
+from operator import itemgetter
+from queue import Empty
 
 from pogom.dyn_img import get_gym_icon, get_pokemon_map_icon
 from pogom.gainxp import gxp_spin_stops, DITTO_CANDIDATES_IDS, is_ditto, lure_pokestop
 from pogom.pgscout import pgscout_encounter
-from .utils import (get_pokemon_name, get_pokemon_types,
+from .utils import (get_pokemon_name, get_pokemon_types, get_pokemon_rarity,
                     get_args, cellid, in_radius, date_secs, clock_between,
                     get_move_name, get_move_damage, get_move_energy,
                     get_move_type, calc_pokemon_level, i8ln, degrees_to_cardinal,
-                    peewee_attr_to_col)
+                    distance)
 from .transform import transform_from_wgs_to_gcj, get_new_coords
 from .customLog import printPokemon
+from .liveindex import LivePokemonIndex
+from .rarity import RarityTable
+from .rollup import NewSightings, stats_rollups, stats_hour, stats_day
+from .changelog import ChangeLog
+from .tiles import TileVersions
+from .stream import ChangeStream
+from .gymcache import GymDocuments
+from .writebehind import WriteBehindBuffer
+from .partitions import PARTITIONED_TABLES, maintain_partitions
+from .cleaner import IncrementalCleaner
+from .replicas import ReplicaRouter
+from .s2geometry import get_cell_geometry
 
 from .account import pokestop_spinnable, spin_pokestop, incubate_eggs, setup_mrmime_account, \
     encounter_pokemon_request, clear_pokemon, fort_details_request
@@ -51,8 +66,22 @@ log = logging.getLogger(__name__)
 args = get_args()
 flaskDb = FlaskDB()
 cache = TTLCache(maxsize=100, ttl=60 * 5)
-
-db_schema_version = 32
+# Geofences only change when pushed, which clears this. The TTL covers
+# processes that didn't do the push.
+geofence_cache = TTLCache(maxsize=1, ttl=60 * 10)
+rarity_table = RarityTable()
+replica_router = ReplicaRouter()
+new_sightings = NewSightings()
+change_log = ChangeLog(('pokemon', 'pokestops', 'gyms', 'scanned',
+                        'spawnpoints'))
+tile_versions = TileVersions()
+change_stream = ChangeStream()
+# Gym details, defenders and raid as sent to the map, and as shown on the
+# gym page.
+gym_documents = GymDocuments()
+gym_detail_documents = GymDocuments(maxsize=1000)
+
+db_schema_version = 34
 
 
 class MyRetryDB(RetryOperationalError, PooledMySQLDatabase):
@@ -88,14 +117,41 @@ def init_database(app):
     flaskDb._load_database(app, db)
     if app is not None:
         flaskDb._register_handlers(app)
+
+    # Read replicas for the map, same database and credentials.
+    replicas = []
+    for replica in args.db_replicas or []:
+        host, _, port = replica.partition(':')
+        replicas.append((replica, MyRetryDB(
+            args.db_name,
+            user=args.db_user,
+            password=args.db_pass,
+            host=host,
+            port=int(port or args.db_port),
+            stale_timeout=30,
+            max_connections=None,
+            charset='utf8mb4')))
+    if replicas:
+        log.info('Using %d read replicas for map queries.', len(replicas))
+        replica_router.configure(replicas, args.db_replica_max_lag)
+
     return db
 
 
 class BaseModel(flaskDb.Model):
 
+    # Inside replica_router.reads(), queries go to a read replica.
     @classmethod
     def database(cls):
-        return cls._meta.database
+        return replica_router.current() or cls._meta.database
+
+    @classmethod
+    def select(cls, *selection):
+        query = super(BaseModel, cls).select(*selection)
+        database = replica_router.current()
+        if database is not None:
+            query.database = database
+        return query
 
     @classmethod
     def get_all(cls):
@@ -131,6 +187,7 @@ class Geofence(BaseModel):
         # Remove all geofences without interfering with other threads.
         with flaskDb.database.transaction():
             DeleteQuery(Geofence).execute()
+        geofence_cache.clear()
 
     @staticmethod
     def remove_duplicates(geofences):
@@ -161,6 +218,7 @@ class Geofence(BaseModel):
         # Make a DB save.
         with flaskDb.database.transaction():
             Geofence.insert_many(db_geofences).execute()
+        geofence_cache.clear()
 
         return db_geofences
 
@@ -185,6 +243,29 @@ class Geofence(BaseModel):
 
         return geofences
 
+    # Geofences by name, as sent to the map. Shared between requests, don't
+    # modify the result.
+    @staticmethod
+    @cached(geofence_cache)
+    def get_map_geofences():
+        geofences = {}
+        for g in Geofence.get_geofences():
+            # Check if already there
+            geofence = geofences.get(g['name'], None)
+            if not geofence:  # Create a new sub-dict if new
+                geofences[g['name']] = {
+                    'excluded': g['excluded'],
+                    'name': g['name'],
+                    'coordinates': []
+                }
+            coordinate = {
+                'lat': g['latitude'],
+                'lng': g['longitude']
+            }
+            geofences[g['name']]['coordinates'].append(coordinate)
+
+        return geofences
+
 
 class PokemonBaseModel(BaseModel):
     # We are base64 encoding the ids delivered by the api
@@ -217,15 +298,44 @@ class PokemonBaseModel(BaseModel):
     last_modified = DateTimeField(
         null=True, index=True, default=datetime.utcnow)
 
+    # In-memory index of active rows, set up by init_live_index().
+    live_index = None
+
+    # Names and such the map shows along with a Pokemon row.
+    @staticmethod
+    def add_map_fields(p):
+        p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
+        p['pokemon_rarity'] = Pokemon.get_rarity(p['pokemon_id'])
+        p['pokemon_types'] = get_pokemon_types(p['pokemon_id'])
+        p['encounter_id'] = str(p['encounter_id'])
+        if args.china:
+            p['latitude'], p['longitude'] = \
+                transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
+        return p
+
     @classmethod
     def get_active(cls, swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
-                   oSwLng=None, oNeLat=None, oNeLng=None):
+                   oSwLng=None, oNeLat=None, oNeLng=None, changed=None):
         now_date = datetime.utcnow()
         query = cls.select()
-        if not (swLat and swLng and neLat and neLng):
+        if cls.live_index is not None and cls.live_index.ready:
+            query = cls.live_index.query(swLat, swLng, neLat, neLng,
+                                         timestamp, oSwLat, oSwLng, oNeLat,
+                                         oNeLng, encounter_ids=changed)
+        elif not (swLat and swLng and neLat and neLng):
             query = (query
                      .where(cls.disappear_time > now_date)
                      .dicts())
+        elif changed is not None:
+            # Only load Pokemon changed since the client's cursor.
+            query = (query
+                     .where(key_in(cls.encounter_id, changed) &
+                            (cls.disappear_time > now_date) &
+                            (cls.latitude >= swLat) &
+                            (cls.longitude >= swLng) &
+                            (cls.latitude <= neLat) &
+                            (cls.longitude <= neLng))
+                     .dicts())
         elif timestamp > 0:
             # If timestamp is known only load modified Pokemon.
             query = (query
@@ -270,15 +380,7 @@ class PokemonBaseModel(BaseModel):
 
         pokemon = []
         for p in list(query):
-
-            p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
-            p['pokemon_rarity'] = Pokemon.get_rarity(p['pokemon_id'])
-            p['pokemon_types'] = get_pokemon_types(p['pokemon_id'])
-            p['encounter_id'] = str(p['encounter_id'])
-            if args.china:
-                p['latitude'], p['longitude'] = \
-                    transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
-            pokemon.append(p)
+            pokemon.append(cls.add_map_fields(p))
 
         # Re-enable the GC.
         gc.enable()
@@ -287,7 +389,10 @@ class PokemonBaseModel(BaseModel):
 
     @classmethod
     def get_active_by_id(cls, ids, swLat, swLng, neLat, neLng):
-        if not (swLat and swLng and neLat and neLng):
+        if cls.live_index is not None and cls.live_index.ready:
+            query = cls.live_index.query(swLat, swLng, neLat, neLng,
+                                         pokemon_ids=set(ids))
+        elif not (swLat and swLng and neLat and neLng):
             query = (cls
                      .select()
                      .where((cls.pokemon_id << ids) &
@@ -310,14 +415,7 @@ class PokemonBaseModel(BaseModel):
 
         pokemon = []
         for p in query:
-            p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
-            p['pokemon_rarity'] = Pokemon.get_rarity(p['pokemon_id'])
-            p['pokemon_types'] = get_pokemon_types(p['pokemon_id'])
-            p['encounter_id'] = str(p['encounter_id'])
-            if args.china:
-                p['latitude'], p['longitude'] = \
-                    transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
-            pokemon.append(p)
+            pokemon.append(cls.add_map_fields(p))
 
         # Re-enable the GC.
         gc.enable()
@@ -325,41 +423,48 @@ class PokemonBaseModel(BaseModel):
         return pokemon
 
 
+class Pokemon(PokemonBaseModel):
+    spawnpoint_id = UBigIntegerField(index=True)
+
+    class Meta:
+        indexes = ((('latitude', 'longitude'), False),)
+
+    # Statistics come from the rollup tables, so timediff (in hours) is
+    # rounded out to whole hours, or whole days per spawnpoint.
+    @staticmethod
+    def _stats_since(timediff, truncate=stats_hour):
+        if timediff:
+            return truncate(datetime.utcnow() - timedelta(hours=timediff))
+        return 0
+
     @classmethod
     @cached(cache)
     def get_seen(cls, timediff):
-        if timediff:
-            timediff = datetime.utcnow() - timedelta(hours=timediff)
-
-        # Note: pokemon_id+0 forces SQL to ignore the pokemon_id index
-        # and should use the disappear_time index and hopefully
-        # improve performance
-        pokemon_count_query = (cls
-                               .select((cls.pokemon_id+0).alias(
-                                           'pokemon_id'),
-                                       fn.COUNT((cls.pokemon_id+0)).alias(
-                                           'count'),
-                                       fn.MAX(cls.disappear_time).alias(
-                                           'lastappeared')
-                                       )
-                               .where(cls.disappear_time > timediff)
-                               .group_by((cls.pokemon_id+0))
-                               .alias('counttable')
-                               )
-        query = (cls
-                 .select(cls.pokemon_id,
-                         cls.disappear_time,
-                         cls.latitude,
-                         cls.longitude,
+        since = cls._stats_since(timediff)
+        pokemon_count_query = (PokemonHourlyStats
+                               .select(PokemonHourlyStats.pokemon_id,
+                                       fn.SUM(PokemonHourlyStats.sightings)
+                                       .alias('count'),
+                                       fn.MAX(PokemonHourlyStats.last_appeared)
+                                       .alias('lastappeared'))
+                               .where(PokemonHourlyStats.hour >= since)
+                               .group_by(PokemonHourlyStats.pokemon_id)
+                               .alias('counttable'))
+        query = (PokemonHourlyStats
+                 .select(PokemonHourlyStats.pokemon_id,
+                         PokemonHourlyStats.last_appeared.alias(
+                             'disappear_time'),
+                         PokemonHourlyStats.latitude,
+                         PokemonHourlyStats.longitude,
                          pokemon_count_query.c.count)
                  .join(pokemon_count_query,
-                       on=(cls.pokemon_id ==
-                           pokemon_count_query.c.pokemon_id))
+                       on=((PokemonHourlyStats.pokemon_id ==
+                            pokemon_count_query.c.pokemon_id) &
+                           (PokemonHourlyStats.last_appeared ==
+                            pokemon_count_query.c.lastappeared)))
+                 .where(PokemonHourlyStats.hour >= since)
                  .distinct()
-                 .where(cls.disappear_time ==
-                        pokemon_count_query.c.lastappeared)
-                 .dicts()
-                 )
+                 .dicts())
 
         # Performance:  disable the garbage collector prior to creating a
         # (potentially) large dict with append().
@@ -368,6 +473,8 @@ class PokemonBaseModel(BaseModel):
         pokemon = []
         total = 0
         for p in query:
+            # SUM() comes back as a Decimal.
+            p['count'] = int(p['count'])
             p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
             pokemon.append(p)
             total += p['count']
@@ -377,7 +484,6 @@ class PokemonBaseModel(BaseModel):
 
         return {'pokemon': pokemon, 'total': total}
 
-
     @classmethod
     def get_appearances(cls, pokemon_id, timediff):
         '''
@@ -385,30 +491,28 @@ class PokemonBaseModel(BaseModel):
         :param timediff: limiting period of the selection
         :return: list of Pokemon appearances over a selected period
         '''
-        if timediff:
-            timediff = datetime.utcnow() - timedelta(hours=timediff)
-        query = (cls
-                 .select(cls.latitude,
-                         cls.longitude,
-                         cls.pokemon_id,
-                         fn.Count(cls.spawnpoint_id).alias('count'),
-                         cls.spawnpoint_id)
-                 .where((cls.pokemon_id == pokemon_id) &
-                        (cls.disappear_time > timediff)
-                        )
-                 .group_by(cls.latitude, cls.longitude,
-                           cls.pokemon_id, cls.spawnpoint_id)
-                 .dicts()
-                 )
-
-        return list(query)
-
+        since = cls._stats_since(timediff, stats_day)
+        query = (SpawnpointDailyStats
+                 .select(SpawnpointDailyStats.latitude,
+                         SpawnpointDailyStats.longitude,
+                         SpawnpointDailyStats.pokemon_id,
+                         fn.SUM(SpawnpointDailyStats.sightings).alias(
+                             'count'),
+                         SpawnpointDailyStats.spawnpoint_id)
+                 .where((SpawnpointDailyStats.pokemon_id == pokemon_id) &
+                        (SpawnpointDailyStats.day >= since))
+                 .group_by(SpawnpointDailyStats.latitude,
+                           SpawnpointDailyStats.longitude,
+                           SpawnpointDailyStats.pokemon_id,
+                           SpawnpointDailyStats.spawnpoint_id)
+                 .dicts())
 
-class Pokemon(PokemonBaseModel):
-    spawnpoint_id = UBigIntegerField(index=True)
+        appearances = []
+        for a in query:
+            a['count'] = int(a['count'])
+            appearances.append(a)
 
-    class Meta:
-        indexes = ((('latitude', 'longitude'), False),)
+        return appearances
 
     @classmethod
     def get_appearances_times_by_spawnpoint(cls, pokemon_id,
@@ -419,48 +523,62 @@ class Pokemon(PokemonBaseModel):
         :param timediff: limiting period of the selection.
         :return: list of time appearances over a selected period.
         '''
+        # The spawnpoint_id index keeps this off the rollups, which only
+        # have the latest sighting of each day.
         if timediff:
             timediff = datetime.utcnow() - timedelta(hours=timediff)
         query = (cls
                  .select(cls.disappear_time)
                  .where((cls.pokemon_id == pokemon_id) &
                         (cls.spawnpoint_id == spawnpoint_id) &
-                        (cls.disappear_time > timediff)
-                        )
+                        (cls.disappear_time > timediff))
                  .order_by(cls.disappear_time.asc())
-                 .tuples()
-                 )
+                 .tuples())
 
         return list(itertools.chain(*query))
 
+    # The limit closest active Pokemon within radius meters, as
+    # (distance, pokemon) tuples sorted by distance.
+    @classmethod
+    def get_nearest(cls, lat, lng, radius, limit):
+        # Only load what's inside the radius' bounding box.
+        d_lat = radius / 111320.0
+        d_lng = d_lat / max(math.cos(math.radians(lat)), 0.01)
+        swLat, swLng = lat - d_lat, lng - d_lng
+        neLat, neLng = lat + d_lat, lng + d_lng
+
+        if cls.live_index is not None and cls.live_index.ready:
+            query = cls.live_index.query(swLat, swLng, neLat, neLng)
+        else:
+            query = (cls
+                     .select()
+                     .where((cls.disappear_time > datetime.utcnow()) &
+                            (cls.latitude >= swLat) &
+                            (cls.longitude >= swLng) &
+                            (cls.latitude <= neLat) &
+                            (cls.longitude <= neLng))
+                     .dicts())
+
+        in_range = []
+        for p in query:
+            dist = distance((lat, lng), (p['latitude'], p['longitude']))
+            if dist <= radius:
+                in_range.append((dist, p))
+
+        nearest = heapq.nsmallest(limit, in_range, key=lambda x: x[0])
+        return [(int(meters), cls.add_map_fields(p))
+                for meters, p in nearest]
 
     @staticmethod
     def get_rarity(pokemon_id):
-        seen = Pokemon.get_seen(0)
-        total = seen['total']
-        found = 0
-        spawn_group = ''
-        for pokemon in seen['pokemon']:
-                if pokemon['pokemon_id'] == pokemon_id:
-                    found = 1
-                    pokemon_count = pokemon['count']
-        if found == 0:
-            pokemon_count = 0
-        spawn_rate = round(100 * pokemon_count / float(total), 4)
-
-        if spawn_rate < 0.01:
-             spawn_group = 'Ultra Rare'
-        elif spawn_rate < 0.03:
-            spawn_group = 'Very Rare'
-        elif spawn_rate < 0.5:
-            spawn_group = 'Rare'
-        elif spawn_rate < 1:
-            spawn_group = 'Uncommon'
-        else:
-            spawn_group = 'Common'
+        spawn_group = rarity_table.get_spawn_group(pokemon_id)
+        if spawn_group is None:
+            # Rarity table not loaded yet, use the static rarity.
+            return get_pokemon_rarity(pokemon_id)
 
         return i8ln(spawn_group)
 
+
 class LurePokemon(PokemonBaseModel):
     pokestop_id = Utf8mb4CharField(index=True, max_length=50)
 
@@ -496,7 +614,8 @@ class Pokestop(BaseModel):
 
     @staticmethod
     def get_stops(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
-                  oSwLng=None, oNeLat=None, oNeLng=None, lured=False):
+                  oSwLng=None, oNeLat=None, oNeLng=None, lured=False,
+                  changed=None):
 
         query = (Pokestop.select(Pokestop.active_fort_modifier,
                                 Pokestop.enabled, Pokestop.latitude,
@@ -511,6 +630,14 @@ class Pokestop(BaseModel):
         if not (swLat and swLng and neLat and neLng):
             query = (query
                      .dicts())
+        elif changed is not None:
+            query = (query
+                     .where(key_in(Pokestop.pokestop_id, changed) &
+                            (Pokestop.latitude >= swLat) &
+                            (Pokestop.longitude >= swLng) &
+                            (Pokestop.latitude <= neLat) &
+                            (Pokestop.longitude <= neLng))
+                     .dicts())
         elif timestamp > 0:
             query = (query
                      .where(((Pokestop.last_updated >
@@ -663,11 +790,21 @@ class Gym(BaseModel):
 
     @staticmethod
     def get_gyms(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
-                 oSwLng=None, oNeLat=None, oNeLng=None):
+                 oSwLng=None, oNeLat=None, oNeLng=None, changed=None):
         if not (swLat and swLng and neLat and neLng):
             results = (Gym
                        .select()
                        .dicts())
+        elif changed is not None:
+            # Only send Gyms changed since the client's cursor.
+            results = (Gym
+                       .select()
+                       .where(key_in(Gym.gym_id, changed) &
+                              (Gym.latitude >= swLat) &
+                              (Gym.longitude >= swLng) &
+                              (Gym.latitude <= neLat) &
+                              (Gym.longitude <= neLng))
+                       .dicts())
         elif timestamp > 0:
             # If timestamp is known only send last scanned Gyms.
             results = (Gym
@@ -708,12 +845,17 @@ class Gym(BaseModel):
         gc.disable()
 
         gyms = {}
+        docs = {}
         gym_ids = []
         for g in results:
-            g['name'] = None
-            g['pokemon'] = []
-            g['raid'] = None
             gyms[g['gym_id']] = g
+            doc = gym_documents.get(g['gym_id'], g['last_scanned'])
+            if doc is not None:
+                g.update(doc)
+                continue
+
+            # Not cached, or the gym has been rescanned since.
+            docs[g['gym_id']] = {'name': None, 'pokemon': [], 'raid': None}
             gym_ids.append(g['gym_id'])
 
         if len(gym_ids) > 0:
@@ -745,7 +887,7 @@ class Gym(BaseModel):
 
             for p in pokemon:
                 p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
-                gyms[p['gym_id']]['pokemon'].append(p)
+                docs[p['gym_id']]['pokemon'].append(p)
 
             details = (GymDetails
                        .select(
@@ -757,9 +899,9 @@ class Gym(BaseModel):
                        .dicts())
 
             for d in details:
-                gyms[d['gym_id']]['name'] = d['name']
-                gyms[d['gym_id']]['description'] = d['description']
-                gyms[d['gym_id']]['url'] = d['url']
+                docs[d['gym_id']]['name'] = d['name']
+                docs[d['gym_id']]['description'] = d['description']
+                docs[d['gym_id']]['url'] = d['url']
 
             raids = (Raid
                      .select()
@@ -770,7 +912,11 @@ class Gym(BaseModel):
                 if r['pokemon_id']:
                     r['pokemon_name'] = get_pokemon_name(r['pokemon_id'])
                     r['pokemon_types'] = get_pokemon_types(r['pokemon_id'])
-                gyms[r['gym_id']]['raid'] = r
+                docs[r['gym_id']]['raid'] = r
+
+            for gym_id, doc in docs.items():
+                gym_documents.put(gym_id, gyms[gym_id]['last_scanned'], doc)
+                gyms[gym_id].update(doc)
 
         # Re-enable the GC.
         gc.enable()
@@ -810,7 +956,13 @@ class Gym(BaseModel):
 
         result['guard_pokemon_name'] = get_pokemon_name(
             result['guard_pokemon_id']) if result['guard_pokemon_id'] else ''
-        result['pokemon'] = []
+
+        doc = gym_detail_documents.get(id, result['last_scanned'])
+        if doc is not None:
+            result.update(doc)
+            return result
+
+        doc = {'pokemon': []}
 
         pokemon = (GymMember
                    .select(GymPokemon.cp.alias('pokemon_cp'),
@@ -855,17 +1007,19 @@ class Gym(BaseModel):
             p['move_2_energy'] = get_move_energy(p['move_2'])
             p['move_2_type'] = get_move_type(p['move_2'])
 
-            result['pokemon'].append(p)
+            doc['pokemon'].append(p)
 
         try:
             raid = Raid.select(Raid).where(Raid.gym_id == id).dicts().get()
             if raid['pokemon_id']:
                 raid['pokemon_name'] = get_pokemon_name(raid['pokemon_id'])
                 raid['pokemon_types'] = get_pokemon_types(raid['pokemon_id'])
-            result['raid'] = raid
+            doc['raid'] = raid
         except Raid.DoesNotExist:
             pass
 
+        gym_detail_documents.put(id, result['last_scanned'], doc)
+        result.update(doc)
         return result
 
     @classmethod
@@ -1034,9 +1188,18 @@ class ScannedLocation(BaseModel):
 
     @staticmethod
     def get_recent(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
-                   oSwLng=None, oNeLat=None, oNeLng=None):
+                   oSwLng=None, oNeLat=None, oNeLng=None, changed=None):
         activeTime = (datetime.utcnow() - timedelta(minutes=15))
-        if timestamp > 0:
+        if changed is not None:
+            query = (ScannedLocation
+                     .select()
+                     .where(key_in(ScannedLocation.cellid, changed) &
+                            (ScannedLocation.latitude >= swLat) &
+                            (ScannedLocation.longitude >= swLng) &
+                            (ScannedLocation.latitude <= neLat) &
+                            (ScannedLocation.longitude <= neLng))
+                     .dicts())
+        elif timestamp > 0:
             query = (ScannedLocation
                      .select()
                      .where(((ScannedLocation.last_modified >=
@@ -1502,7 +1665,8 @@ class SpawnPoint(BaseModel):
 
     @staticmethod
     def get_spawnpoints(swLat, swLng, neLat, neLng, timestamp=0,
-                        oSwLat=None, oSwLng=None, oNeLat=None, oNeLng=None):
+                        oSwLat=None, oSwLng=None, oNeLat=None, oNeLng=None,
+                        changed=None):
         spawnpoints = {}
         with SpawnPoint.database().execution_context():
             query = (SpawnPoint
@@ -1514,7 +1678,15 @@ class SpawnPoint(BaseModel):
                      .join(ScannedLocation)
                      .dicts())
 
-            if timestamp > 0:
+            if changed is not None:
+                query = (query
+                         .where(key_in(SpawnPoint.id, changed) &
+                                ((SpawnPoint.latitude >= swLat) &
+                                 (SpawnPoint.longitude >= swLng) &
+                                 (SpawnPoint.latitude <= neLat) &
+                                 (SpawnPoint.longitude <= neLng)))
+                         .dicts())
+            elif timestamp > 0:
                 query = (query
                          .where(((SpawnPoint.last_scanned >
                                   datetime.utcfromtimestamp(timestamp / 1000))) &
@@ -2178,6 +2350,77 @@ class HashKeys(BaseModel):
             return result
 
 
+# Hourly Pokemon sighting counts per species, kept up to date by the db
+# updater so the statistics page doesn't have to scan the pokemon table.
+class PokemonHourlyStats(BaseModel):
+    hour = DateTimeField()
+    pokemon_id = SmallIntegerField()
+    sightings = IntegerField(default=0)
+    # Where and when the species was last seen in this hour.
+    last_appeared = DateTimeField()
+    latitude = DoubleField()
+    longitude = DoubleField()
+
+    class Meta:
+        primary_key = CompositeKey('hour', 'pokemon_id')
+
+
+# Daily Pokemon sighting counts per species and spawnpoint.
+class SpawnpointDailyStats(BaseModel):
+    pokemon_id = SmallIntegerField()
+    spawnpoint_id = UBigIntegerField()
+    day = DateTimeField(index=True)
+    sightings = IntegerField(default=0)
+    last_appeared = DateTimeField()
+    latitude = DoubleField()
+    longitude = DoubleField()
+
+    class Meta:
+        primary_key = CompositeKey('pokemon_id', 'spawnpoint_id', 'day')
+
+
+# Add new sightings to the statistics rollup tables. Counters are summed on
+# conflict, the location follows the latest sighting.
+def update_stats_rollups(rows, db):
+    if not rows:
+        return
+
+    species, spawnpoints = stats_rollups(rows)
+    merge = ('ON DUPLICATE KEY UPDATE '
+             '`latitude` = IF(VALUES(`last_appeared`) > `last_appeared`, '
+             'VALUES(`latitude`), `latitude`), '
+             '`longitude` = IF(VALUES(`last_appeared`) > `last_appeared`, '
+             'VALUES(`longitude`), `longitude`), '
+             '`last_appeared` = GREATEST(`last_appeared`, '
+             'VALUES(`last_appeared`)), '
+             '`sightings` = `sightings` + VALUES(`sightings`)')
+
+    with db.atomic():
+        cursor = db.get_cursor()
+        cursor.executemany(
+            'INSERT INTO `pokemonhourlystats` (`hour`, `pokemon_id`, '
+            '`sightings`, `last_appeared`, `latitude`, `longitude`) '
+            'VALUES (%s, %s, %s, %s, %s, %s) ' + merge,
+            [(hour, pokemon_id, s['sightings'], s['last_appeared'],
+              s['latitude'], s['longitude'])
+             for (hour, pokemon_id), s in species.items()])
+        cursor.executemany(
+            'INSERT INTO `spawnpointdailystats` (`pokemon_id`, '
+            '`spawnpoint_id`, `day`, `sightings`, `last_appeared`, '
+            '`latitude`, `longitude`) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s) ' + merge,
+            [(pokemon_id, spawnpoint_id, day, s['sightings'],
+              s['last_appeared'], s['latitude'], s['longitude'])
+             for (pokemon_id, spawnpoint_id, day), s in spawnpoints.items()])
+
+
+# peewee renders an empty IN () which MySQL rejects, match nothing instead.
+def key_in(field, keys):
+    if not keys:
+        return SQL('0 = 1')
+    return field << list(keys)
+
+
 def hex_bounds(center, steps=None, radius=None):
     # Make a box that is (70m * step_limit * 2) + 70m away from the
     # center point.  Rationale is that you need to travel.
@@ -2293,18 +2536,13 @@ def parse_map(args, map_dict, scan_coords, scan_location, db_update_queue,
         weather_alert = cell.alerts
 
         # Convert Cell To Lat, Long
-        cell_id = s2sphere.CellId(long(s2_cell_id))
-        cell = s2sphere.Cell(cell_id)
-        center = s2sphere.LatLng.from_point(cell.get_center())
-        lat = center.lat().degrees
-        lng = center.lng().degrees
+        geometry = get_cell_geometry(s2_cell_id)
+        lat = geometry['center']['lat']
+        lng = geometry['center']['lng']
 
         # Convert Cell To 4 Cell Corners
-        vertices = []
-        for i in range(0, 4):
-            vertex = s2sphere.LatLng.from_point(cell.get_vertex(i))
-            corners = '{}, {}'.format(vertex.lat().degrees, vertex.lng().degrees)
-            vertices.append(corners)
+        vertices = ['{}, {}'.format(vertex['lat'], vertex['lng'])
+                    for vertex in geometry['vertices']]
 
     now_secs = date_secs(now_date)
 
@@ -2491,8 +2729,10 @@ def parse_map(args, map_dict, scan_coords, scan_location, db_update_queue,
 
             start_end = SpawnPoint.start_end(sp, 1)
             seconds_until_despawn = (start_end[1] - now_secs) % 3600
-            disappear_time = now_date + \
-                timedelta(seconds=seconds_until_despawn)
+            # Whole seconds, so every scan of this Pokemon comes up with
+            # the same disappear_time.
+            disappear_time = (now_date + timedelta(
+                seconds=seconds_until_despawn)).replace(microsecond=0)
 
             pokemon_id = p.pokemon_data.pokemon_id
             previous_id = None
@@ -3407,6 +3647,7 @@ def parse_gyms(args, gym_responses, wh_update_queue, db_update_queue):
         with GymMember.database().execution_context():
             DeleteQuery(GymMember).where(
                 GymMember.gym_id << gym_details.keys()).execute()
+        invalidate_gym_documents(gym_details.keys())
 
     # Insert new gym members.
     if gym_members:
@@ -3417,28 +3658,111 @@ def parse_gyms(args, gym_responses, wh_update_queue, db_update_queue):
              len(gym_members))
 
 
+# Primary key fields the write buffer merges rows on, None for models with
+# an auto-increment key.
+def upsert_key_names(model):
+    pk = model._meta.primary_key
+    if isinstance(pk, CompositeKey):
+        return tuple(pk.field_names)
+    if isinstance(pk, PrimaryKeyField):
+        return None
+    return (pk.name,)
+
+
+write_buffer = WriteBehindBuffer(upsert_key_names, args.db_buffer_rows,
+                                 args.db_buffer_time)
+
+
+def upsert(model, data, db, q):
+    start_timer = default_timer()
+    if model is Pokemon and args.db_partitions:
+        delete_moved_pokemon(data.values())
+    bulk_upsert(model, data, db)
+    on_upserted(model, data)
+
+    log.debug('Upserted to %s, %d records (upsert queue '
+              'remaining: %d) in %.6f seconds.',
+              model.__name__,
+              len(data),
+              q.qsize(),
+              default_timer() - start_timer)
+
+
+# Partitioned, the Pokemon table's primary key includes disappear_time and
+# upserting a Pokemon with another one (e.g. once its TTH is found) adds a
+# second row. Drop the old rows first.
+def delete_moved_pokemon(rows):
+    disappear_times = dict((row['encounter_id'],
+                            row['disappear_time'].replace(microsecond=0))
+                           for row in rows)
+    query = (Pokemon
+             .select(Pokemon.encounter_id, Pokemon.disappear_time)
+             .where(Pokemon.encounter_id << list(disappear_times))
+             .tuples())
+
+    # disappear_time -> [encounter_id]
+    moved = {}
+    for encounter_id, disappear_time in query:
+        if disappear_time != disappear_times[encounter_id]:
+            moved.setdefault(disappear_time, []).append(encounter_id)
+
+    deleted = 0
+    for disappear_time, encounter_ids in moved.items():
+        deleted += (Pokemon
+                    .delete()
+                    .where((Pokemon.disappear_time == disappear_time) &
+                           (Pokemon.encounter_id << encounter_ids))
+                    .execute())
+    return deleted
+
+
+# Writes the buffered rows that are due, or all of them. A failed batch
+# goes back into the buffer for the next round.
+def flush_write_buffer(db, q, everything=False):
+    for model, data in write_buffer.take(everything):
+        try:
+            upsert(model, data, db, q)
+            write_buffer.written(model)
+        except Exception as e:
+            log.exception('Failed to write %d %s rows: %s', len(data),
+                          model.__name__, repr(e))
+            if not write_buffer.put_back(model, data):
+                log.error('Dropped %d %s rows after %d failed writes.',
+                          len(data), model.__name__,
+                          write_buffer.retries + 1)
+
+
 def db_updater(q, db):
+    # Wake up for buffered rows even when nothing new comes in.
+    timeout = write_buffer.max_age or None
+
     # The forever loop.
     while True:
         try:
             # Loop the queue.
             while True:
-                model, data = q.get()
-
-                start_timer = default_timer()
-                bulk_upsert(model, data, db)
-                q.task_done()
-
-                log.debug('Upserted to %s, %d records (upsert queue '
-                          'remaining: %d) in %.6f seconds.',
-                          model.__name__,
-                          len(data),
-                          q.qsize(),
-                          default_timer() - start_timer)
-
-                # Helping out the GC.
-                del model
-                del data
+                try:
+                    model, data = q.get(timeout=timeout)
+                    if not write_buffer.add(model, data):
+                        upsert(model, data, db, q)
+                    q.task_done()
+
+                    # Helping out the GC.
+                    del model
+                    del data
+                except Empty:
+                    pass
+
+                flush_write_buffer(db, q)
+
+                stats = write_buffer.report(300)
+                if stats and stats['flushes']:
+                    log.info('DB write buffer: %d rows merged into %d '
+                             '(%.1fx) in %d flushes, flush latency %.2fs '
+                             'avg, %.2fs max.', stats['rows_in'],
+                             stats['rows_out'], stats['ratio'],
+                             stats['flushes'], stats['latency_avg'],
+                             stats['latency_max'])
 
                 if q.qsize() > 50:
                     log.warning(
@@ -3450,307 +3774,580 @@ def db_updater(q, db):
             time.sleep(5)
 
 
-def clean_db_loop(args):
-    step = 250
+# Change log type and key for models that show up on the map.
+change_log_keys = {
+    Pokemon: ('pokemon', 'encounter_id'),
+    Pokestop: ('pokestops', 'pokestop_id'),
+    PokestopDetails: ('pokestops', 'pokestop_id'),
+    Gym: ('gyms', 'gym_id'),
+    GymDetails: ('gyms', 'gym_id'),
+    GymMember: ('gyms', 'gym_id'),
+    Raid: ('gyms', 'gym_id'),
+    ScannedLocation: ('scanned', 'cellid'),
+    SpawnPoint: ('spawnpoints', 'id')
+}
+
+
+def invalidate_gym_documents(gym_ids):
+    gym_documents.invalidate(gym_ids)
+    gym_detail_documents.invalidate(gym_ids)
+
+
+# Keep in-memory views in sync with rows the db updater just committed.
+def on_upserted(model, data):
+    if model in (GymDetails, GymMember, Raid):
+        invalidate_gym_documents([row['gym_id'] for row in data.values()])
+
+    if model is Pokemon and Pokemon.live_index is not None:
+        Pokemon.live_index.update(data.values())
+
+    if change_log.enabled and model in change_log_keys:
+        kind, key = change_log_keys[model]
+        change_log.record(kind, [row[key] for row in data.values()])
+
+        # Map tiles hold everything but spawnpoints.
+        if kind in ('gyms', 'pokestops'):
+            tile_versions.touch(data.values(), key)
+        elif kind != 'spawnpoints':
+            tile_versions.touch(data.values())
+
+    if change_stream.has_subscribers():
+        publish_changes(model, data)
+
+    # The rows are committed and on the map already, counters come last.
+    if model is Pokemon:
+        count_sightings(data.values())
+
+
+# Rescans and encounters upsert the same Pokemon again, count it once.
+def count_sightings(rows):
+    new_rows = new_sightings.filter(rows)
+    if not new_rows:
+        return
+
+    try:
+        update_stats_rollups(new_rows, Pokemon.database())
+    except Exception as e:
+        # Counted again the next time one of them is upserted.
+        new_sightings.release(new_rows)
+        log.exception('Failed to update statistics for %d Pokemon: %s',
+                      len(new_rows), e)
+        return
+
+    new_sightings.counted(new_rows)
+    rarity_table.add(new_rows)
+
+
+# Push changes to map clients connected to /stream.
+def publish_changes(model, data):
+    if model is Pokemon:
+        change_stream.publish(
+            'pokemon',
+            [Pokemon.add_map_fields(dict(row)) for row in data.values()])
+    elif model is Gym:
+        change_stream.publish('gym', data.values(), 'gym_id')
+    elif model is Raid:
+        change_stream.publish('raid', data.values(), 'gym_id')
+    elif model is Pokestop:
+        change_stream.publish(
+            'lure',
+            [row for row in data.values() if row.get('active_fort_modifier')])
+    elif model is LurePokemon:
+        change_stream.publish('lure', data.values())
+
+
+def init_live_index():
+    index = LivePokemonIndex()
+    Pokemon.live_index = index
+
+    # Rows upserted while loading are applied on top, the index only
+    # answers queries once the initial load is done.
+    with Pokemon.database().execution_context():
+        rows = (Pokemon
+                .select()
+                .where(Pokemon.disappear_time > datetime.utcnow())
+                .dicts())
+        index.load(list(rows))
+
+
+# Active Pokemon have been counted in the statistics before a restart,
+# rescans of them mustn't be counted again.
+def init_new_sightings():
+    with Pokemon.database().execution_context():
+        rows = (Pokemon
+                .select(Pokemon.encounter_id, Pokemon.disappear_time)
+                .where(Pokemon.disappear_time > datetime.utcnow())
+                .dicts())
+        new_sightings.load(rows)
+    log.debug('%d active Pokemon already counted in statistics.',
+              len(new_sightings))
+
+
+# Reload the all-time sighting counts behind Pokemon.get_rarity() off the
+# request path.
+def rarity_refresh_loop(refresh_minutes):
+    while True:
+        try:
+            start_timer = default_timer()
+            with replica_router.reads(), \
+                    Pokemon.database().execution_context():
+                query = (PokemonHourlyStats
+                         .select(PokemonHourlyStats.pokemon_id,
+                                 fn.SUM(PokemonHourlyStats.sightings))
+                         .group_by(PokemonHourlyStats.pokemon_id)
+                         .tuples())
+                # SUM() comes back as a Decimal.
+                rarity_table.load(dict(
+                    (pokemon_id, int(count)) for pokemon_id, count in query))
+
+            log.info('Refreshed Pokemon rarity in %.2f seconds.',
+                     default_timer() - start_timer)
+        except Exception as e:
+            log.exception('Exception in rarity_refresh_loop: %s', repr(e))
+            time.sleep(60)
+            continue
+
+        time.sleep(refresh_minutes * 60)
+
+
+# Cleaning task for IncrementalCleaner: deletes (or updates) rows of model
+# matching where(), a batch at a time by primary key. Tables without a
+# single column one get a plain DELETE ... LIMIT instead.
+def clean_rows(model, where, update=None):
+    pk = model._meta.primary_key
+
+    database = model._meta.database
+
+    def task(limit):
+        with database.execution_context():
+            ids = [row[0] for row in (model
+                                      .select(pk)
+                                      .where(where())
+                                      .limit(limit)
+                                      .tuples())]
+            if not ids:
+                return 0
+            if update:
+                query = model.update(**update)
+            else:
+                query = model.delete()
+            query.where(pk << ids).execute()
+        return len(ids)
+
+    def limited_task(limit):
+        if update:
+            query = model.update(**update)
+        else:
+            query = model.delete()
+        sql, params = query.where(where()).sql()
+        with database.execution_context():
+            cursor = database.execute_sql(
+                '{} LIMIT {:d}'.format(sql, limit), params)
+            return cursor.rowcount
+
+    if pk and not model._meta.composite_key:
+        return task
+    return limited_task
+
+
+def older_than(**kwargs):
+    return datetime.utcnow() - timedelta(**kwargs)
+
+
+# (regular, full) cleaning tasks as (name, task) for IncrementalCleaner.
+def cleaning_tasks(args):
+    regular_tasks = [
+        ('MainWorker', clean_rows(
+            MainWorker,
+            lambda: MainWorker.last_modified < older_than(minutes=30))),
+        ('WorkerStatus', clean_rows(
+            WorkerStatus,
+            lambda: WorkerStatus.last_modified < older_than(minutes=30))),
+        # Remove active modifier from expired lured pokestops.
+        ('Pokestop', clean_rows(
+            Pokestop,
+            lambda: Pokestop.lure_expiration < datetime.utcnow(),
+            {'lure_expiration': None, 'active_fort_modifier': None})),
+        # Remove item_id, deployer from expired lured pokestops.
+        ('PokestopDetails', clean_rows(
+            PokestopDetails,
+            lambda: PokestopDetails.expires < datetime.utcnow(),
+            {'item_id': None, 'deployer': None, 'expires': None})),
+        # Remove old (unusable) captcha tokens
+        ('Token', clean_rows(
+            Token, lambda: Token.last_updated < older_than(minutes=2))),
+        # Remove old weather
+        ('Weather', clean_rows(
+            Weather, lambda: Weather.last_updated < older_than(minutes=45)))
+    ]
+
+    full_tasks = [
+        # Remove old gym Details.
+        ('GymDetails', clean_rows(
+            GymDetails,
+            lambda: GymDetails.last_scanned < older_than(days=365))),
+        # Remove old gym locations.
+        ('Gym', clean_rows(
+            Gym, lambda: Gym.last_scanned < older_than(days=365))),
+        # Remove old raid Details.
+        ('Raid', clean_rows(
+            Raid, lambda: Raid.end < older_than(days=365))),
+        # Remove old gym members.
+        ('GymMember', clean_rows(
+            GymMember,
+            lambda: GymMember.last_scanned < older_than(days=365))),
+        # Remove old gym Pokemon.
+        ('GymPokemon', clean_rows(
+            GymPokemon,
+            lambda: GymPokemon.last_seen < older_than(days=365))),
+        # Remove expired HashKeys.
+        ('HashKeys', clean_rows(
+            HashKeys,
+            lambda: ((HashKeys.expires < older_than(days=1)) |
+                     (HashKeys.last_updated < older_than(days=7)))))
+    ]
+
+    # If desired, clear old Pokemon spawns. Partitioned tables are purged
+    # a whole day at a time instead.
+    if args.purge_data > 0 and not args.db_partitions:
+        full_tasks.append(('Pokemon', clean_rows(
+            Pokemon,
+            lambda: Pokemon.disappear_time < older_than(
+                hours=args.purge_data))))
+
+    # Statistics are kept as long as the Pokemon they count, whole hours
+    # and days that are entirely past the purge.
+    if args.purge_data > 0:
+        full_tasks.extend([
+            ('PokemonHourlyStats', clean_rows(
+                PokemonHourlyStats,
+                lambda: PokemonHourlyStats.hour < stats_hour(
+                    older_than(hours=args.purge_data)))),
+            ('SpawnpointDailyStats', clean_rows(
+                SpawnpointDailyStats,
+                lambda: SpawnpointDailyStats.day < stats_day(
+                    older_than(hours=args.purge_data))))
+        ])
+
+    return regular_tasks, full_tasks
+
+
+def clean_db_loop(args, db_updates_queue=None):
+    step = 1000
     cycle = 0
+    cleaner = IncrementalCleaner(db_updates_queue)
+    regular_tasks, full_tasks = cleaning_tasks(args)
+
     while True:
         try:
-            with MainWorker.database().execution_context():
-                query = (MainWorker
-                         .delete()
-                         .where((MainWorker.last_modified <
-                                 (datetime.utcnow() - timedelta(minutes=30)))))
-                query.execute()
-
-                query = (WorkerStatus
-                         .delete()
-                         .where((WorkerStatus.last_modified <
-                                 (datetime.utcnow() - timedelta(minutes=30)))))
-                query.execute()
-
-                # Remove active modifier from expired lured pokestops.
-                query = (Pokestop
-                         .update(lure_expiration=None, active_fort_modifier=None)
-                         .where(Pokestop.lure_expiration < datetime.utcnow()))
-                query.execute()
-
-                # Remove item_id, deployer from expired lured pokestops.
-                query = (PokestopDetails
-                         .update(item_id=None, deployer=None, expires=None)
-                         .where(PokestopDetails.expires < datetime.utcnow()))
-                query.execute()
-
-                # Remove old (unusable) captcha tokens
-                query = (Token
-                         .delete()
-                         .where((Token.last_updated <
-                                 (datetime.utcnow() - timedelta(minutes=2)))))
-                query.execute()
-
-                # Remove old weather
-                query = (Weather
-                         .delete()
-                         .where((Weather.last_updated <
-                                 (datetime.utcnow() - timedelta(minutes=45)))))
-                query.execute()
+            for name, task in regular_tasks:
+                cleaner.run(name, task)
 
             if cycle % 10 != 0:
                 cycle += 1
-                log.info('Regular database cleaning complete.')
+                cleaner.report('Regular database cleaning complete')
                 time.sleep(60)
                 continue
             else:
                 cycle = 1
 
-            with MainWorker.database().execution_context():
-                # Remove old gym Details.
-                query = (GymDetails
-                         .delete()
-                         .where(GymDetails.last_scanned <
-                                (datetime.utcnow() - timedelta(days=365))))
-                query.execute()
-
-                # Remove old gym locations.
-                query = (Gym
-                         .delete()
-                         .where(Gym.last_scanned <
-                                (datetime.utcnow() - timedelta(days=365))))
-                query.execute()
-
-                # Remove old raid Details.
-                query = (Raid
-                         .delete()
-                         .where(Raid.end <
-                                (datetime.utcnow() - timedelta(days=365))))
-                query.execute()
-
-                # Remove old gym members.
-                query = (GymMember
-                         .delete()
-                         .where(GymMember.last_scanned <
-                                (datetime.utcnow() - timedelta(days=365))))
-                query.execute()
-
-                # Remove old gym Pokemon.
-                query = (GymPokemon
-                         .delete()
-                         .where(GymPokemon.last_seen <
-                                (datetime.utcnow() - timedelta(days=365))))
-                query.execute()
-
-                # Remove old and extinct SpawnPoint.
-                db_clean_spawnpoints(step)
-
-                # Remove expired HashKeys.
-                query = (HashKeys
-                         .delete()
-                             .where((HashKeys.expires <
-                                    (datetime.utcnow() - timedelta(days=1))) |
-                                    (HashKeys.last_updated <
-                                    (datetime.utcnow() - timedelta(days=7)))))
-                query.execute()
-
-            # If desired, clear old Pokemon spawns.
-            if args.purge_data > 0:
-                log.info("Beginning purge of old Pokemon spawns.")
-                start = datetime.utcnow()
-                query = (Pokemon
-                         .delete()
-                         .where((Pokemon.disappear_time <
-                                 (datetime.utcnow() -
-                                  timedelta(hours=args.purge_data)))))
-                rows = query.execute()
-                end = datetime.utcnow()
-                diff = end - start
-                log.info("Completed purge of old Pokemon spawns. "
-                         "%i deleted in %f seconds.",
-                         rows, diff.total_seconds())
-
-            log.info('Full database cleaning complete.')
+            for name, task in full_tasks:
+                # Pokemon pile up a lot faster than the rest.
+                cleaner.run(name, task,
+                            cleaner.budget * 10 if name == 'Pokemon'
+                            else None)
+
+            # Remove old and extinct SpawnPoint.
+            with SpawnPoint.database().execution_context(
+                    with_transaction=False):
+                db_clean_spawnpoints(step, throttle=cleaner.throttle)
+
+            if args.db_partitions:
+                purge_partitions()
+
+            cleaner.report('Full database cleaning complete')
             time.sleep(60)
         except Exception as e:
             log.exception('Exception in clean_db_loop: %s', repr(e))
+            time.sleep(60)
 
 
-def db_clean_spawnpoints(step=50, days_age=30, missed=5):
-    start = datetime.utcnow()
-    sp_delete = set()
-    sl_delete = set()
-
-    # Select all ScanSpawnPoint to validate data (many-to-many relationship)
-    ssp_query = ScanSpawnPoint.select().dicts()
-    ssp_spawnpoints = set()
-    ssp_scannedloc = set()
-
-    log.debug('ScanSpawnPoint count: %d', ssp_query.count())
-    for ssp in ssp_query:
-        ssp_spawnpoints.add(ssp['spawnpoint'])
-        ssp_scannedloc.add(ssp['scannedlocation'])
-
-    # Select all SpawnPoint.
-    query = SpawnPoint.select(SpawnPoint.id).dicts()
-    sp_list = [(sp['id']) for sp in query]
-    log.debug('ScanSpawnPoint has %d of %d SpawnPoint.',
-              len(ssp_spawnpoints), len(sp_list))
-
-    # Select all ScannedLocation.
-    query = ScannedLocation.select(ScannedLocation.cellid).dicts()
-    sl_list = [(sl['cellid']) for sl in query]
-    log.debug('ScanSpawnPoint has %d of %d ScannedLocation.',
-              len(ssp_scannedloc), len(sl_list))
-
-    # Select SpawnPoint missing a ScanSpawnPoint.
-    filtered = [x for x in sp_list if x not in ssp_spawnpoints]
-    if filtered:
-        log.warning('SpawnPoint not in ScanSpawnPoint: %d', len(filtered))
-        sp_delete.update(filtered)
-
-    # Filter ScanSpawnPoint missing a SpawnPoint.
-    filtered = [x for x in ssp_spawnpoints if x not in sp_list]
-    if filtered:
-        log.warning('ScanSpawnPoint missing SpawnPoint: %d', len(filtered))
-        sp_delete.update(filtered)
-
-    # Filter ScannedLocation missing a ScanSpawnPoint.
-    # Note: ScannedLocation are created before SpawnPoint and ScanSpawnPoint.
-    filtered = [x for x in sl_list if x not in ssp_scannedloc]
-    if filtered:
-        log.info('ScannedLocation not in ScanSpawnPoint: %d', len(filtered))
-        sl_delete.update(filtered)
-
-    # Filter ScanSpawnPoint missing a ScannedLocation.
-    filtered = [x for x in ssp_scannedloc if x not in sl_list]
-    if filtered:
-        num_records = len(filtered)
-        log.warning('ScanSpawnPoint missing ScannedLocation: %d',
-                    len(filtered))
-        sl_delete.update(filtered)
-
-    # Select old SpawnPoint.
+# Drop the day partitions past --purge-data and --purge-detection-data,
+# and add the ones of the coming days.
+def purge_partitions():
+    now_date = datetime.utcnow()
+    cutoffs = {
+        Pokemon._meta.db_table: (
+            args.purge_data and
+            now_date - timedelta(hours=args.purge_data)),
+        SpawnpointDetectionData._meta.db_table: (
+            args.purge_detection_data and
+            now_date - timedelta(days=args.purge_detection_data))
+    }
+
+    db = Pokemon.database()
+    with db.execution_context():
+        for table in PARTITIONED_TABLES:
+            start = default_timer()
+            dropped = maintain_partitions(db, table, cutoffs[table] or None)
+            if dropped:
+                log.info('Purged %d days of %s in %f seconds.', dropped,
+                         table, default_timer() - start)
+
+
+# Ids selected by a single column query, step at a time in the column's
+# order. Every batch is a new query starting after the last id, so rows
+# deleted in between don't matter and memory stays bounded.
+def id_batches(query, column, step):
+    last = None
+    while True:
+        batch_query = query if last is None else query.where(column > last)
+        batch = [row[0] for row in (batch_query
+                                    .order_by(column)
+                                    .limit(step)
+                                    .tuples())]
+        if not batch:
+            return
+        yield batch
+        if len(batch) < step:
+            return
+        last = batch[-1]
+
+
+# Consistency pass over SpawnPoint, ScanSpawnPoint, ScannedLocation and
+# SpawnpointDetectionData. Orphans are found with anti-joins in MySQL and
+# handled in batches of step. With dry_run nothing is deleted, the returned
+# report only counts what would be.
+def db_clean_spawnpoints(step=50, days_age=30, missed=5, dry_run=False,
+                         throttle=None):
+    start = default_timer()
+    cutoff = datetime.utcnow() - timedelta(days=days_age)
+    database = SpawnPoint._meta.database
+    found = OrderedDict()
+    deleted = OrderedDict()
+
+    def delete(name, query):
+        if not dry_run:
+            deleted[name] = deleted.get(name, 0) + query.execute()
+
+    def each_batch(name, query, column):
+        found.setdefault(name, 0)
+        for ids in id_batches(query, column, step):
+            found[name] += len(ids)
+            yield ids
+            if throttle:
+                throttle()
+
+    def drop_scannedlocations(cellids):
+        for i in range(0, len(cellids), step):
+            chunk = cellids[i:i + step]
+            delete('ScanSpawnPoint', ScanSpawnPoint.delete().where(
+                ScanSpawnPoint.scannedlocation << chunk))
+            delete('ScannedLocation', ScannedLocation.delete().where(
+                (ScannedLocation.cellid << chunk) &
+                (ScannedLocation.last_modified < cutoff)))
+
+    def drop_spawnpoints(ids):
+        # Their ScannedLocation are unlinked from everything as well.
+        cellids = [row[0] for row in (ScanSpawnPoint
+                                      .select(ScanSpawnPoint.scannedlocation)
+                                      .where(ScanSpawnPoint.spawnpoint << ids)
+                                      .distinct()
+                                      .tuples())]
+        found['ScannedLocation of old/bad SpawnPoint'] = found.get(
+            'ScannedLocation of old/bad SpawnPoint', 0) + len(cellids)
+
+        delete('SpawnpointDetectionData', SpawnpointDetectionData.delete()
+               .where(SpawnpointDetectionData.spawnpoint_id << ids))
+        delete('ScanSpawnPoint', ScanSpawnPoint.delete().where(
+            ScanSpawnPoint.spawnpoint << ids))
+        delete('SpawnPoint', SpawnPoint.delete().where(SpawnPoint.id << ids))
+        drop_scannedlocations(cellids)
+
+    # Old SpawnPoint.
     query = (SpawnPoint
              .select(SpawnPoint.id)
-             .where((SpawnPoint.last_scanned <
-                     (datetime.utcnow() - timedelta(days=days_age))) &
-                    (SpawnPoint.missed_count > missed))
-             .dicts())
-    for sp in query:
-        sp_delete.add(sp['id'])
-    log.debug('Found %d old SpawnPoint.', query.count())
-
-    # Select all SpawnPointDetectionData.
-    sd_delete = set(sp_delete)
+             .where((SpawnPoint.last_scanned < cutoff) &
+                    (SpawnPoint.missed_count > missed)))
+    for ids in each_batch('Old SpawnPoint', query, SpawnPoint.id):
+        with database.atomic():
+            drop_spawnpoints(ids)
+
+    # SpawnPoint missing a ScanSpawnPoint.
+    query = (SpawnPoint
+             .select(SpawnPoint.id)
+             .join(ScanSpawnPoint, JOIN.LEFT_OUTER,
+                   on=(ScanSpawnPoint.spawnpoint == SpawnPoint.id))
+             .where(ScanSpawnPoint.spawnpoint >> None))
+    for ids in each_batch('SpawnPoint not in ScanSpawnPoint', query,
+                          SpawnPoint.id):
+        with database.atomic():
+            drop_spawnpoints(ids)
+
+    # ScanSpawnPoint missing a SpawnPoint.
+    query = (ScanSpawnPoint
+             .select(ScanSpawnPoint.spawnpoint)
+             .join(SpawnPoint, JOIN.LEFT_OUTER,
+                   on=(ScanSpawnPoint.spawnpoint == SpawnPoint.id))
+             .where(SpawnPoint.id >> None)
+             .distinct())
+    for ids in each_batch('ScanSpawnPoint missing SpawnPoint', query,
+                          ScanSpawnPoint.spawnpoint):
+        with database.atomic():
+            drop_spawnpoints(ids)
+
+    # SpawnpointDetectionData missing a SpawnPoint.
     query = (SpawnpointDetectionData
              .select(SpawnpointDetectionData.spawnpoint_id)
-             .group_by(SpawnpointDetectionData.spawnpoint_id).dicts())
+             .join(SpawnPoint, JOIN.LEFT_OUTER,
+                   on=(SpawnpointDetectionData.spawnpoint_id ==
+                       SpawnPoint.id))
+             .where(SpawnPoint.id >> None)
+             .distinct())
+    for ids in each_batch('SpawnpointDetectionData missing SpawnPoint',
+                          query, SpawnpointDetectionData.spawnpoint_id):
+        with database.atomic():
+            delete('SpawnpointDetectionData', SpawnpointDetectionData.delete()
+                   .where(SpawnpointDetectionData.spawnpoint_id << ids))
+
+    # Old SpawnpointDetectionData.
+    query = (SpawnpointDetectionData
+             .select(SpawnpointDetectionData.id)
+             .where(SpawnpointDetectionData.scan_time < cutoff))
+    for ids in each_batch('Old SpawnpointDetectionData', query,
+                          SpawnpointDetectionData.id):
+        with database.atomic():
+            delete('SpawnpointDetectionData', SpawnpointDetectionData.delete()
+                   .where(SpawnpointDetectionData.id << ids))
+
+    # Old ScannedLocation missing a ScanSpawnPoint.
+    # Note: ScannedLocation are created before SpawnPoint and ScanSpawnPoint.
+    query = (ScannedLocation
+             .select(ScannedLocation.cellid)
+             .join(ScanSpawnPoint, JOIN.LEFT_OUTER,
+                   on=(ScanSpawnPoint.scannedlocation ==
+                       ScannedLocation.cellid))
+             .where((ScanSpawnPoint.scannedlocation >> None) &
+                    (ScannedLocation.last_modified < cutoff)))
+    for ids in each_batch('Old ScannedLocation not in ScanSpawnPoint', query,
+                          ScannedLocation.cellid):
+        with database.atomic():
+            delete('ScannedLocation', ScannedLocation.delete().where(
+                ScannedLocation.cellid << ids))
+
+    # ScanSpawnPoint missing a ScannedLocation.
+    query = (ScanSpawnPoint
+             .select(ScanSpawnPoint.scannedlocation)
+             .join(ScannedLocation, JOIN.LEFT_OUTER,
+                   on=(ScanSpawnPoint.scannedlocation ==
+                       ScannedLocation.cellid))
+             .where(ScannedLocation.cellid >> None)
+             .distinct())
+    for ids in each_batch('ScanSpawnPoint missing ScannedLocation', query,
+                          ScanSpawnPoint.scannedlocation):
+        with database.atomic():
+            delete('ScanSpawnPoint', ScanSpawnPoint.delete().where(
+                ScanSpawnPoint.scannedlocation << ids))
+
+    for name, count in found.items():
+        if count:
+            log.info('%s%s: %d.', 'Dry run, ' if dry_run else '', name,
+                     count)
+    for name, count in deleted.items():
+        if count:
+            log.info('Deleted %d %s.', count, name)
+
+    log.info('Completed cleanup of old SpawnPoint data in %f seconds.',
+             default_timer() - start)
+    return {'found': found, 'deleted': deleted}
+
+
+# Prepared upsert statements, by model and the fields of the first row.
+upsert_statements = {}
+
+
+# INSERT INTO ... ON DUPLICATE KEY UPDATE x=VALUES(x) for a model, sending
+# many rows in a single statement, plus turning rows into its parameters.
+# We build our own MySQL query because peewee only supports REPLACE INTO
+# for upserting, which deletes the old row before adding the new one,
+# giving a serious performance hit.
+class UpsertStatement(object):
+
+    def __init__(self, cls, field_names, step):
+        meta = cls._meta
+        # The fields peewee's InsertQuery would use: the ones we were given
+        # plus all fields with a default (e.g. required default fields), in
+        # peewee's order.
+        fields = set(meta.fields[name] for name in field_names)
+        fields = sorted(fields | set(meta.defaults),
+                        key=lambda x: x._sort_key)
+        self.names = [f.name for f in fields]
+        # Store defaults so we can fall back to them if a value isn't set.
+        self.defaults = dict((f.name, meta.defaults.get(f))
+                             for f in fields)
+        if len(self.names) > 1:
+            self.getter = itemgetter(*self.names)
+        else:
+            self.getter = lambda row: (row[self.names[0]],)
+
+        # Translate to proper column names, e.g. foreign keys.
+        columns = ['`{}`'.format(f.db_column) for f in fields]
+        self.prefix = 'INSERT INTO `{}` ({}) VALUES '.format(
+            meta.db_table, ', '.join(columns))
+        self.suffix = ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            ['{x} = VALUES({x})'.format(x=c) for c in columns])
+        self.placeholders = '({})'.format(', '.join(['%s'] * len(columns)))
+        # Only full chunks are common enough to keep.
+        self.step = step
+        self.full_sql = self.build_sql(step)
+
+    def build_sql(self, num_rows):
+        return (self.prefix + ', '.join([self.placeholders] * num_rows) +
+                self.suffix)
+
+    def sql(self, num_rows):
+        if num_rows == self.step:
+            return self.full_sql
+        return self.build_sql(num_rows)
+
+    # Values of a row in the statement's order.
+    def values(self, row):
+        try:
+            return self.getter(row)
+        except KeyError:
+            pass
 
-    sd_sp = [(sd['spawnpoint_id']) for sd in query]
-    log.debug('SpawnpointDetectionData SpawnPoint count: %d', len(sd_sp))
+        for name in self.names:
+            # Take a default if we need it.
+            if name not in row:
+                default = self.defaults[name]
 
-    # Filter SpawnPointDetectionData missing a SpawnPoint.
-    filtered = [x for x in sd_sp if x not in sp_list]
-    if filtered:
-        log.warning('SpawnPointDetectionData missing SpawnPoint: %d',
-                    len(filtered))
-        sd_delete.update(filtered)
+                # peewee's defaults can be callable, e.g. current time. We
+                # only call when needed to insert.
+                if callable(default):
+                    default = default()
 
-    num_records = len(sd_delete)
-    sd_delete = list(sd_delete)
+                row[name] = default
 
-    # Remove SpawnpointDetectionData associated with old/bad SpawnPoint.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (SpawnpointDetectionData
-                 .delete()
-                 .where((SpawnpointDetectionData.spawnpoint_id <<
-                         sd_delete[i:min(i + step, num_records)])))
-        num_rows += query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d SpawnpointDetectionData from old/bad SpawnPoint.',
-                 num_rows)
-
-    # Remove old SpawnPointDetectionData.
-    query = (SpawnpointDetectionData
-             .delete()
-             .where((SpawnpointDetectionData.scan_time <
-                     (datetime.utcnow() - timedelta(days=days_age)))))
-    num_rows = query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d old SpawnpointDetectionData.', num_rows)
-
-    num_records = len(sp_delete)
-    sp_delete = list(sp_delete)
-
-    # Select ScannedLocation associated with old SpawnPoints.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (ScanSpawnPoint
-                 .select()
-                 .where((ScanSpawnPoint.spawnpoint <<
-                         sp_delete[i:min(i + step, num_records)]))
-                 .dicts())
-        for sp in query:
-            sl_delete.add(sp['scannedlocation'])
-        num_rows += query.count()
-    log.debug('Found %d ScannedLocation from old/bad SpawnPoint.', num_rows)
-
-    # Remove ScanSpawnPoint associated with old SpawnPoint.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (ScanSpawnPoint
-                 .delete()
-                 .where((ScanSpawnPoint.spawnpoint <<
-                         sp_delete[i:min(i + step, num_records)])))
-        num_rows += query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d ScanSpawnPoint from old/bad SpawnPoint.',
-                 num_rows)
-
-    # Remove old/bad SpawnPoint.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (SpawnPoint
-                 .delete()
-                 .where((SpawnPoint.id <<
-                         sp_delete[i:min(i + step, num_records)])))
-        num_rows += query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d old SpawnPoint.', num_rows)
-
-    sl_delete = list(sl_delete)
-    num_records = len(sl_delete)
-
-    # Remove ScanSpawnPoint associated with old ScannedLocation.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (ScanSpawnPoint
-                 .delete()
-                 .where((ScanSpawnPoint.scannedlocation <<
-                         sl_delete[i:min(i + step, num_records)])))
-        num_rows += query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d ScanSpawnPoint from old ScannedLocation.',
-                 num_rows)
-
-    # Remove ScannedLocation associated with old ScanSpawnPoint.
-    num_rows = 0
-    for i in range(0, num_records, step):
-        query = (ScannedLocation
-                 .delete()
-                 .where((ScannedLocation.cellid <<
-                         sl_delete[i:min(i + step, num_records)]) &
-                        (ScannedLocation.last_modified <
-                         (datetime.utcnow() - timedelta(days=days_age)))))
-        num_rows += query.execute()
-    if num_rows > 0:
-        log.info('Deleted %d ScannedLocation from old SpawnPoint.', num_rows)
-
-    end = datetime.utcnow()
-    diff = end - start
-    log.info('Completed cleanup of old SpawnPoint data in %f seconds.',
-             diff.total_seconds())
+        return self.getter(row)
+
+
+def upsert_statement(cls, row, step):
+    key = (cls, frozenset(row), step)
+    statement = upsert_statements.get(key)
+    if statement is None:
+        statement = UpsertStatement(cls, row.keys(), step)
+        upsert_statements[key] = statement
+    return statement
 
 
-def bulk_upsert(cls, data, db):
+# We used to support SQLite and it has a default max 999 parameters,
+# so we limited how many rows we insert for it.
+# Oracle: 64000
+# MySQL: 65535
+# PostgreSQL: 34464
+# Sqlite: 999
+def bulk_upsert(cls, data, db, step=500):
     rows = data.values()
     num_rows = len(rows)
     i = 0
@@ -3759,120 +4356,33 @@ def bulk_upsert(cls, data, db):
     if num_rows < 1:
         return
 
-    # We used to support SQLite and it has a default max 999 parameters,
-    # so we limited how many rows we insert for it.
-    # Oracle: 64000
-    # MySQL: 65535
-    # PostgreSQL: 34464
-    # Sqlite: 999
-    step = 500
-
-    # Prepare for our query.
-    conn = db.get_conn()
-    cursor = db.get_cursor()
-
-    # We build our own INSERT INTO ... ON DUPLICATE KEY UPDATE x=VALUES(x)
-    # query, making sure all data is properly escaped. We use
-    # placeholders for VALUES(%s, %s, ...) so we can use executemany().
-    # We use peewee's InsertQuery to retrieve the fields because it
-    # takes care of peewee's internals (e.g. required default fields).
-    query = InsertQuery(cls, rows=[rows[0]])
-    # Take the first row. We need to call _iter_rows() for peewee internals.
-    # Using next() for a single item is not considered "pythonic".
-    first_row = {}
-    for row in query._iter_rows():
-        first_row = row
-        break
-    # Convert the row to its fields, sorted by peewee.
-    row_fields = sorted(first_row.keys(), key=lambda x: x._sort_key)
-    row_fields = map(lambda x: x.name, row_fields)
-    # Translate to proper column name, e.g. foreign keys.
-    db_columns = [peewee_attr_to_col(cls, f) for f in row_fields]
-
-    # Store defaults so we can fall back to them if a value
-    # isn't set.
-    defaults = {}
-
-    for f in cls._meta.fields.values():
-        # Use DB column name as key.
-        field_name = f.name
-        field_default = cls._meta.defaults.get(f, None)
-        defaults[field_name] = field_default
-
-    # Assign fields, placeholders and assignments after defaults
-    # so our lists/keys stay in order.
-    table = '`'+conn.escape_string(cls._meta.db_table)+'`'
-    escaped_fields = ['`'+conn.escape_string(f)+'`' for f in db_columns]
-    placeholders = ['%s' for escaped_field in escaped_fields]
-    assignments = ['{x} = VALUES({x})'.format(
-        x=escaped_field
-    ) for escaped_field in escaped_fields]
-
-    # We build our own MySQL query because peewee only supports
-    # REPLACE INTO for upserting, which deletes the old row before
-    # adding the new one, giving a serious performance hit.
-    query_string = ('INSERT INTO {table} ({fields}) VALUES'
-                    + ' ({placeholders}) ON DUPLICATE KEY UPDATE'
-                    + ' {assignments}')
+    statement = upsert_statement(cls, rows[0], step)
+    name = cls.__name__
+    foreign_key_checks = True
 
     # Prepare transaction.
     with db.atomic():
         while i < num_rows:
-            start = i
             end = min(i + step, num_rows)
-            name = cls.__name__
 
-            log.debug('Inserting items %d to %d for %s.', start, end, name)
+            log.debug('Inserting items %d to %d for %s.', i, end, name)
 
             try:
                 # Turn off FOREIGN_KEY_CHECKS on MySQL, because apparently it's
                 # unable to recognize strings to update unicode keys for
                 # foreign key fields, thus giving lots of foreign key
-                # constraint errors.
-                db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
-
-                # Time to bulk upsert our data. Convert objects to a list of
-                # values for executemany(), and fall back to defaults if
-                # necessary.
-                batch = []
-                batch_rows = rows[i:min(i + step, num_rows)]
-
-                # We pop them off one by one so we can gradually release
-                # memory as we pass each item. No duplicate memory usage.
-                while len(batch_rows) > 0:
-                    row = batch_rows.pop()
-                    row_data = []
-
-                    # Parse rows, build arrays of values sorted via row_fields.
-                    for field in row_fields:
-                        # Take a default if we need it.
-                        if field not in row:
-                            default = defaults.get(field, None)
-
-                            # peewee's defaults can be callable, e.g. current
-                            # time. We only call when needed to insert.
-                            if callable(default):
-                                default = default()
-
-                            row[field] = default
-
-                        # Append to keep the exact order, and only these
-                        # fields.
-                        row_data.append(row[field])
-                    # Done preparing, add it to the batch.
-                    batch.append(row_data)
-
-                # Format query and go.
-                formatted_query = query_string.format(
-                    table=table,
-                    fields=', '.join(escaped_fields),
-                    placeholders=', '.join(placeholders),
-                    assignments=', '.join(assignments)
-                )
-
-                cursor.executemany(formatted_query, batch)
-
-                db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
+                # constraint errors. Once is enough unless we had to retry.
+                if foreign_key_checks:
+                    db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
+                    foreign_key_checks = False
+
+                # All rows of the chunk go in a single statement, fall back
+                # to defaults if necessary.
+                params = []
+                for row in rows[i:end]:
+                    params.extend(statement.values(row))
+
+                db.get_cursor().execute(statement.sql(end - i), params)
 
             except Exception as e:
                 # If there is a DB table constraint error, dump the data and
@@ -3888,11 +4398,15 @@ def bulk_upsert(cls, data, db):
                     log.warning(data.items())
                 else:
                     log.warning('%s... Retrying...', repr(e))
+                    foreign_key_checks = True
                     time.sleep(1)
                     continue
 
             i += step
 
+        if not foreign_key_checks:
+            db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
+
 
 def create_tables(db):
     db.connect()
@@ -3900,7 +4414,8 @@ def create_tables(db):
               Gym, Raid, ScannedLocation, GymDetails, GymMember,
               GymPokemon, Trainer, MainWorker, WorkerStatus,
               SpawnPoint, ScanSpawnPoint, SpawnpointDetectionData,
-              Token, LocationAltitude, PlayerLocale, HashKeys, Weather]
+              Token, LocationAltitude, PlayerLocale, HashKeys, Weather,
+              PokemonHourlyStats, SpawnpointDailyStats]
     with db.execution_context():
         for table in tables:
             if not table.table_exists():
@@ -3910,6 +4425,11 @@ def create_tables(db):
                 log.debug('Skipping table %s, it already exists.',
                           table.__name__)
 
+        # Converts the tables on first use.
+        if args.db_partitions:
+            for table in PARTITIONED_TABLES:
+                maintain_partitions(db, table)
+
 
 def drop_tables(db):
     tables = [Geofence, Pokemon, LurePokemon, Pokestop, PokestopDetails,
@@ -3917,7 +4437,8 @@ def drop_tables(db):
               GymMember, GymPokemon, Trainer, MainWorker,
               WorkerStatus, SpawnPoint, ScanSpawnPoint,
               SpawnpointDetectionData, LocationAltitude, PlayerLocale,
-              Token, HashKeys, Weather]
+              Token, HashKeys, Weather, PokemonHourlyStats,
+              SpawnpointDailyStats]
     with db.execution_context():
         db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
         for table in tables:
@@ -4405,6 +4926,48 @@ def database_migrate(db, old_ver):
         #db.execute_sql('DROP TABLE `spawnpoint_old`;')
         #db.execute_sql('DROP TABLE `gymmember_old`;')
         #db.execute_sql('DROP TABLE `gympokemon_old`;')
+
+    if old_ver < 33:
+        db.create_tables([PokemonHourlyStats], safe=True)
+        # Backfill the statistics rollups from the Pokemon we have.
+        log.info('Building hourly Pokemon statistics, this may take a '
+                 'while on large databases.')
+        # The location is the one of the last sighting of each group,
+        # joined back on its disappear_time. Ties keep the first row.
+        hour = "DATE_FORMAT(disappear_time, '%%Y-%%m-%%d %%H:00:00')"
+        db.execute_sql(
+            'INSERT INTO `pokemonhourlystats` (hour, pokemon_id, sightings, '
+            'last_appeared, latitude, longitude) '
+            'SELECT s.h, s.pokemon_id, s.sightings, s.last_appeared, '
+            'p.latitude, p.longitude FROM (SELECT ' + hour + ' AS h, '
+            'pokemon_id, COUNT(*) AS sightings, '
+            'MAX(disappear_time) AS last_appeared '
+            'FROM `pokemon` GROUP BY h, pokemon_id) AS s '
+            'JOIN `pokemon` AS p ON p.pokemon_id = s.pokemon_id '
+            'AND p.disappear_time = s.last_appeared '
+            'ON DUPLICATE KEY UPDATE sightings = VALUES(sightings);')
+
+    if old_ver < 34:
+        # Spawnpoint statistics used to be kept per hour, about a row per
+        # sighting.
+        db.execute_sql('DROP TABLE IF EXISTS `spawnpointhourlystats`;')
+        db.create_tables([SpawnpointDailyStats], safe=True)
+        log.info('Building daily spawnpoint statistics, this may take a '
+                 'while on large databases.')
+        day = "DATE_FORMAT(disappear_time, '%%Y-%%m-%%d 00:00:00')"
+        db.execute_sql(
+            'INSERT INTO `spawnpointdailystats` (pokemon_id, spawnpoint_id, '
+            'day, sightings, last_appeared, latitude, longitude) '
+            'SELECT s.pokemon_id, s.spawnpoint_id, s.d, s.sightings, '
+            's.last_appeared, p.latitude, p.longitude FROM (SELECT '
+            'pokemon_id, spawnpoint_id, ' + day + ' AS d, '
+            'COUNT(*) AS sightings, MAX(disappear_time) AS last_appeared '
+            'FROM `pokemon` GROUP BY pokemon_id, spawnpoint_id, d) AS s '
+            'JOIN `pokemon` AS p ON p.pokemon_id = s.pokemon_id '
+            'AND p.spawnpoint_id = s.spawnpoint_id '
+            'AND p.disappear_time = s.last_appeared '
+            'ON DUPLICATE KEY UPDATE sightings = VALUES(sightings);')
+
     # Always log that we're done.
     log.info('Schema upgrade complete.')
     return True
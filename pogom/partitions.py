@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from datetime import datetime, time, timedelta
+
+log = logging.getLogger(__name__)
+
+# Tables that can be range partitioned by day: the time column and the
+# primary key they get. MySQL wants the partitioning column in every
+# unique key, so encounter_id alone isn't unique any more: the db updater
+# deletes the old row of a Pokemon whose disappear_time changed before
+# upserting it. Partitioned tables can't have foreign keys, these have
+# none.
+PARTITIONED_TABLES = {
+    'pokemon': ('disappear_time', ('encounter_id', 'disappear_time')),
+    'spawnpointdetectiondata': ('scan_time', ('id', 'scan_time'))
+}
+
+# Empty partitions kept ready for the days ahead.
+DAYS_AHEAD = 3
+
+# Rows beyond the last day partition, only used if maintenance stops.
+CATCH_ALL = 'pmax'
+
+
+# A day's partition holds the rows of that day, the first one everything
+# before as well.
+def partition_name(day):
+    return day.strftime('p%Y%m%d')
+
+
+def partition_day(name):
+    try:
+        return datetime.strptime(name, 'p%Y%m%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_definition(day):
+    return "PARTITION {} VALUES LESS THAN (TO_DAYS('{}'))".format(
+        partition_name(day), (day + timedelta(days=1)).isoformat())
+
+
+def catch_all_definition():
+    return 'PARTITION {} VALUES LESS THAN MAXVALUE'.format(CATCH_ALL)
+
+
+# Days to add partitions for and to drop, given the days that have one.
+# A partition is only dropped once all of its rows are older than cutoff.
+def plan_partitions(days, today, days_ahead=DAYS_AHEAD, cutoff=None):
+    last = max(days) if days else today - timedelta(days=1)
+    create = []
+    day = last + timedelta(days=1)
+    while day <= today + timedelta(days=days_ahead):
+        create.append(day)
+        day += timedelta(days=1)
+
+    drop = []
+    if cutoff is not None:
+        drop = [d for d in sorted(days)
+                if datetime.combine(d + timedelta(days=1), time()) <= cutoff]
+    return create, drop
+
+
+# [partition name] of a table, empty if it isn't partitioned.
+def get_partitions(db, table):
+    cursor = db.execute_sql(
+        'SELECT partition_name FROM information_schema.partitions '
+        'WHERE table_schema = DATABASE() AND table_name = %s '
+        'AND partition_name IS NOT NULL '
+        'ORDER BY partition_ordinal_position;', (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def partition_table(db, table, today):
+    column, key = PARTITIONED_TABLES[table]
+    days = [today + timedelta(days=i) for i in range(DAYS_AHEAD + 1)]
+    log.info('Partitioning table %s by day, this might take a while.',
+             table)
+    db.execute_sql(
+        'ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY ({key}) '
+        'PARTITION BY RANGE (TO_DAYS(`{column}`)) ({partitions});'.format(
+            table=table, column=column,
+            key=', '.join('`{}`'.format(k) for k in key),
+            partitions=', '.join([partition_definition(d) for d in days] +
+                                 [catch_all_definition()])))
+
+
+# Adds the partitions of the coming days and drops the ones older than
+# cutoff (a datetime, None to keep everything). Returns the number of
+# partitions dropped.
+def maintain_partitions(db, table, cutoff=None, today=None):
+    today = today or datetime.utcnow().date()
+    names = get_partitions(db, table)
+    if not names:
+        partition_table(db, table, today)
+        names = get_partitions(db, table)
+
+    days = [d for d in map(partition_day, names) if d is not None]
+    create, drop = plan_partitions(days, today, cutoff=cutoff)
+    # Always keep a day partition, pmax can't be dropped from the front.
+    drop = drop[:len(days) + len(create) - 1]
+
+    if create:
+        # Instant while pmax is empty.
+        db.execute_sql(
+            'ALTER TABLE `{}` REORGANIZE PARTITION {} INTO ({});'.format(
+                table, CATCH_ALL, ', '.join(
+                    [partition_definition(d) for d in create] +
+                    [catch_all_definition()])))
+        log.debug('Added %d partitions to %s.', len(create), table)
+
+    if drop:
+        db.execute_sql('ALTER TABLE `{}` DROP PARTITION {};'.format(
+            table, ', '.join(partition_name(d) for d in drop)))
+        log.info('Dropped %d day partitions from %s, up to %s.', len(drop),
+                 table, drop[-1].isoformat())
+
+    return len(drop)
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def get_spawn_group(spawn_rate):
+    if spawn_rate < 0.01:
+        return 'Ultra Rare'
+    elif spawn_rate < 0.03:
+        return 'Very Rare'
+    elif spawn_rate < 0.5:
+        return 'Rare'
+    elif spawn_rate < 1:
+        return 'Uncommon'
+
+    return 'Common'
+
+
+# All-time sighting counts per pokemon_id. A background thread reloads the
+# full aggregation now and then, new sightings are added as the db updater
+# commits them, so a rarity lookup is just a dict access. Callers only pass
+# sightings that haven't been counted yet (see rollup.NewSightings).
+class RarityTable(object):
+
+    def __init__(self):
+        self.ready = False
+        self._counts = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def load(self, counts):
+        with self._lock:
+            self._counts = dict(counts)
+            self._total = sum(self._counts.values())
+            self.ready = True
+
+        log.debug('Loaded rarity table: %d species, %d sightings.',
+                  len(self._counts), self._total)
+
+    def add(self, rows):
+        with self._lock:
+            for row in rows:
+                pokemon_id = row['pokemon_id']
+                self._counts[pokemon_id] = self._counts.get(pokemon_id, 0) + 1
+                self._total += 1
+
+    # Returns None until the table has been loaded.
+    def get_spawn_group(self, pokemon_id):
+        if not self.ready or not self._total:
+            return None
+
+        spawn_rate = round(
+            100 * self._counts.get(pokemon_id, 0) / float(self._total), 4)
+        return get_spawn_group(spawn_rate)
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+
+# Sends the SELECTs of a thread to a read replica while it's inside
+# reads(), for the map endpoints and statistics. Everything else, the
+# scanners' reads and all writes, stays on the primary.
+#
+# Replicas are checked every check_interval seconds and only used while
+# they're less than max_lag seconds behind. With none of them usable,
+# reads go to the primary.
+class ReplicaRouter(object):
+
+    def __init__(self):
+        # [(name, database)]
+        self.replicas = []
+        self.max_lag = 30
+        self.check_interval = 5
+        self.healthy = []
+        # name -> seconds behind, None if not replicating
+        self.lags = {}
+        self._usable = {}
+        self._local = threading.local()
+
+    def configure(self, replicas, max_lag=30, check_interval=5):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        if replicas:
+            t = threading.Thread(target=self.check_loop,
+                                 name='db-replica-check')
+            t.daemon = True
+            t.start()
+
+    # The replica database of this thread, None for the primary.
+    def current(self):
+        return getattr(self._local, 'database', None)
+
+    # How far behind the primary the data read by this thread may be, in
+    # seconds. The lag may have grown since it was last checked.
+    def current_lag(self):
+        if self.current() is None:
+            return 0
+        return self._local.lag + self.check_interval + 1
+
+    def choose(self):
+        healthy = self.healthy
+        return random.choice(healthy) if healthy else None
+
+    @contextmanager
+    def reads(self):
+        replica = self.choose()
+        if replica is None or self.current() is not None:
+            yield
+            return
+
+        name, database = replica
+        self._local.database = database
+        self._local.lag = self.lags.get(name) or 0
+        try:
+            with database.execution_context(with_transaction=False):
+                yield
+        finally:
+            self._local.database = None
+
+    # Seconds the replica is behind its primary, None if it isn't
+    # replicating.
+    def lag(self, database):
+        with database.execution_context(with_transaction=False):
+            cursor = database.execute_sql('SHOW SLAVE STATUS;')
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            status = dict(zip([c[0] for c in cursor.description], row))
+        return status.get('Seconds_Behind_Master',
+                          status.get('Seconds_Behind_Source'))
+
+    def check(self):
+        healthy = []
+        for name, database in self.replicas:
+            try:
+                lag = self.lag(database)
+            except Exception as e:
+                log.debug('Unable to check replica %s: %s', name, repr(e))
+                lag = None
+
+            usable = lag is not None and lag <= self.max_lag
+            if usable != self._usable.get(name):
+                self._usable[name] = usable
+                if usable:
+                    log.info('Reading from replica %s (%ss behind).', name,
+                             lag)
+                else:
+                    log.warning('Not reading from replica %s, it is %s.',
+                                name, 'not replicating' if lag is None
+                                else '{}s behind'.format(lag))
+            self.lags[name] = lag
+            if usable:
+                healthy.append((name, database))
+
+        self.healthy = healthy
+
+    def check_loop(self):
+        while True:
+            self.check()
+            time.sleep(self.check_interval)
+
+
+# Runs a Flask view inside router.reads().
+def replica_reads(router, view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with router.reads():
+            return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from datetime import datetime
+
+
+# Pokemon get upserted again when rescanned or encountered. This picks out
+# the rows of sightings that haven't been seen before, so counters built on
+# top of them count every Pokemon once.
+class NewSightings(object):
+
+    def __init__(self, prune_seconds=60):
+        self.prune_seconds = prune_seconds
+        # encounter_id -> disappear_time
+        self._seen = {}
+        # Returned by filter() but not counted yet.
+        self._pending = set()
+        self._last_prune = time.time()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seen)
+
+    # Mark rows as counted already, e.g. the active Pokemon at startup.
+    def load(self, rows):
+        with self._lock:
+            for row in rows:
+                self._pending.discard(row['encounter_id'])
+                self._seen[row['encounter_id']] = row['disappear_time']
+
+    # Rows from filter() whose counters were written.
+    def counted(self, rows):
+        self.load(rows)
+
+    # Rows from filter() whose counters couldn't be written, so the next
+    # upsert of the same Pokemon picks them up again.
+    def release(self, rows):
+        with self._lock:
+            for row in rows:
+                self._pending.discard(row['encounter_id'])
+
+    # Rows not counted yet. They are held back from other callers until
+    # passed to counted() or release().
+    def filter(self, rows):
+        new_rows = []
+        with self._lock:
+            for row in rows:
+                encounter_id = row['encounter_id']
+                if (encounter_id not in self._seen and
+                        encounter_id not in self._pending):
+                    self._pending.add(encounter_id)
+                    new_rows.append(row)
+
+            # Despawned Pokemon can't show up again.
+            if time.time() - self._last_prune > self.prune_seconds:
+                now_date = datetime.utcnow()
+                self._seen = dict(
+                    (encounter_id, disappear_time)
+                    for encounter_id, disappear_time in self._seen.items()
+                    if disappear_time > now_date)
+                self._last_prune = time.time()
+
+        return new_rows
+
+
+def stats_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def stats_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_sighting(stats, key, row):
+    entry = stats.get(key)
+    if entry is None:
+        stats[key] = {
+            'sightings': 1,
+            'last_appeared': row['disappear_time'],
+            'latitude': row['latitude'],
+            'longitude': row['longitude']
+        }
+        return
+
+    entry['sightings'] += 1
+    if row['disappear_time'] > entry['last_appeared']:
+        entry['last_appeared'] = row['disappear_time']
+        entry['latitude'] = row['latitude']
+        entry['longitude'] = row['longitude']
+
+
+# Aggregate Pokemon sightings into per species counts by hour of
+# disappearance, keyed (hour, pokemon_id), and per species/spawnpoint counts
+# by day, keyed (pokemon_id, spawnpoint_id, day). A spawnpoint spawns at
+# most once an hour, so hourly counts per spawnpoint would be no smaller
+# than the pokemon table.
+def stats_rollups(rows):
+    species = {}
+    spawnpoints = {}
+    for row in rows:
+        hour = stats_hour(row['disappear_time'])
+        _add_sighting(species, (hour, row['pokemon_id']), row)
+        _add_sighting(spawnpoints,
+                      (row['pokemon_id'], row['spawnpoint_id'],
+                       stats_day(hour)), row)
+
+    return species, spawnpoints
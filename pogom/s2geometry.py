@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import math
+import s2sphere
+
+from threading import Lock
+from cachetools import LRUCache, cached
+
+# Weather is reported per level 10 S2 cell, whose geometry never changes.
+WEATHER_CELL_LEVEL = 10
+
+# Level 10 cells are ~10km wide, a map viewport rarely covers more than a
+# few hundred of them.
+cell_geometry_cache = LRUCache(maxsize=20000)
+cell_geometry_lock = Lock()
+
+# Viewport bounds are rounded out to this many degrees to share coverings
+# between clients looking at about the same area.
+COVERAGE_STEP = 0.05
+coverage_cache = LRUCache(maxsize=1000)
+coverage_lock = Lock()
+
+
+# workaround due a bug in POGOprotos
+def get_cell_from_string(str_id):
+    raw_id = long(str_id)
+    if raw_id < 0:  # overflow
+        cell_id = s2sphere.CellId(raw_id)
+        return s2sphere.Cell.from_face_pos_level(
+            cell_id.face(), cell_id.pos(), WEATHER_CELL_LEVEL)
+    else:
+        return s2sphere.Cell(s2sphere.CellId(raw_id))
+
+
+# convert s2cell vertices to google map api format
+def get_vertices_from_s2cell(rect_bound):
+    vertices = []
+    for i in range(0, 4):
+        vertex = s2sphere.LatLng.from_point(rect_bound.get_vertex(i))
+        vertices.append({
+            'lat': vertex.lat().degrees,
+            'lng': vertex.lng().degrees
+        })
+    return vertices
+
+
+# Center and corners of a weather cell, as sent to the map. The result is
+# shared between callers and must not be modified.
+def get_cell_geometry(cell_id):
+    # Numbers from the API and strings from the database share an entry.
+    return _get_cell_geometry(str(cell_id))
+
+
+@cached(cell_geometry_cache, lock=cell_geometry_lock)
+def _get_cell_geometry(str_id):
+    cell = get_cell_from_string(str_id)
+    center = s2sphere.LatLng.from_point(cell.get_center())
+    return {
+        's2_cell_id': str(cell.id().id()),
+        'center': {
+            'lat': center.lat().degrees,
+            'lng': center.lng().degrees
+        },
+        'vertices': get_vertices_from_s2cell(cell)
+    }
+
+
+@cached(coverage_cache, lock=coverage_lock)
+def _get_coverage(swLat, swLng, neLat, neLng):
+    r = s2sphere.RegionCoverer()
+    r.min_level = WEATHER_CELL_LEVEL
+    r.max_level = WEATHER_CELL_LEVEL
+    r.max_cells = 40
+    p1 = s2sphere.LatLng.from_degrees(swLat, swLng)
+    p2 = s2sphere.LatLng.from_degrees(neLat, neLng)
+    covering = r.get_covering(s2sphere.LatLngRect.from_point_pair(p1, p2))
+    return tuple(str(cell_id.id()) for cell_id in covering)
+
+
+# Ids of the weather cells covering a viewport.
+def get_coverage(swLat, swLng, neLat, neLng):
+    return _get_coverage(
+        math.floor(float(swLat) / COVERAGE_STEP) * COVERAGE_STEP,
+        math.floor(float(swLng) / COVERAGE_STEP) * COVERAGE_STEP,
+        math.ceil(float(neLat) / COVERAGE_STEP) * COVERAGE_STEP,
+        math.ceil(float(neLng) / COVERAGE_STEP) * COVERAGE_STEP)
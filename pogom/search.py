@@ -864,6 +864,14 @@ def get_stats_message(threadStatus, search_items_queue_array, db_updates_queue,
              account_queue.qsize(),
              len(account_failures), len(account_captchas))
 
+    # Per lane depth and wait of the db updates.
+    message += 'DB lanes: {}\n'.format(' | '.join(
+        '{} {} ({:.1f}s avg, {:.1f}s oldest{})'.format(
+            name, depth, latency, oldest,
+            ', {} dropped'.format(shed) if shed else '')
+        for name, depth, latency, oldest, shed
+        in db_updates_queue.lane_stats()))
+
     message += (
         'Total active: {}  |  Success: {} ({:.1f}/hr) | ' +
         'Fails: {} ({:.1f}/hr) | Empties: {} ({:.1f}/hr) | ' +
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+from queue import Queue, Full, Empty
+
+log = logging.getLogger(__name__)
+
+
+class Subscription(object):
+
+    def __init__(self, bounds, queue_size):
+        # (swLat, swLng, neLat, neLng)
+        self.bounds = bounds
+        self.overflowed = False
+        self.queue = Queue(maxsize=queue_size)
+
+    def wants(self, lat, lng):
+        return (self.bounds[0] <= lat <= self.bounds[2] and
+                self.bounds[1] <= lng <= self.bounds[3])
+
+    def put(self, kind, row):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait((kind, row))
+        except Full:
+            # Client can't keep up, it'll get a resync instead.
+            self.overflowed = True
+
+    # Returns the next (kind, data) event, or None after timeout seconds
+    # without one.
+    def get(self, timeout):
+        if self.overflowed:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.overflowed = False
+            return ('resync', {})
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+
+# Fans out rows committed by the db updater to map clients subscribed to
+# the area they're in.
+class ChangeStream(object):
+
+    def __init__(self, max_subscribers=200, queue_size=1000):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = set()
+        # Raids don't carry coordinates, remember where their gym is.
+        self._locations = {}
+        self._lock = threading.Lock()
+
+    def has_subscribers(self):
+        return len(self._subscribers) > 0
+
+    def subscribe(self, bounds):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(bounds, self.queue_size)
+            self._subscribers.add(subscription)
+
+        log.debug('Map change stream subscribed, %d clients.',
+                  len(self._subscribers))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+        log.debug('Map change stream unsubscribed, %d clients.',
+                  len(self._subscribers))
+
+    def publish(self, kind, rows, key=None):
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+            for row in rows:
+                if 'latitude' in row and 'longitude' in row:
+                    location = (row['latitude'], row['longitude'])
+                    if key:
+                        self._locations[row[key]] = location
+                elif key and row[key] in self._locations:
+                    location = self._locations[row[key]]
+                    row = dict(row, latitude=location[0],
+                               longitude=location[1])
+                else:
+                    continue
+
+                for subscription in subscribers:
+                    if subscription.wants(*location):
+                        subscription.put(kind, row)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import random
+import threading
+
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+# Map data is served per Web Mercator (slippy map) tile at this zoom level
+# only, which is about 2.4km wide at the equator.
+TILE_ZOOM = 14
+
+
+def tile_for(lat, lng, zoom=TILE_ZOOM):
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) /
+             math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+# Returns (swLat, swLng, neLat, neLng) of a tile.
+def tile_bounds(x, y, zoom=TILE_ZOOM):
+    n = 2.0 ** zoom
+    sw_lng = x / n * 360.0 - 180.0
+    ne_lng = (x + 1) / n * 360.0 - 180.0
+    ne_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    sw_lat = math.degrees(
+        math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return sw_lat, sw_lng, ne_lat, ne_lng
+
+
+def valid_tile(z, x, y):
+    return z == TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+# Version of every tile that has seen a change, bumped by the db updater.
+# The version makes up the tile's ETag, so a tile only has to be rendered
+# again when something inside it was written.
+class TileVersions(object):
+
+    def __init__(self, zoom=TILE_ZOOM):
+        self.zoom = zoom
+        # Versions from a previous run must not match ours.
+        self.epoch = '%x' % random.getrandbits(32)
+        self._seq = 0
+        self._versions = {}
+        # Gym and Pokestop details don't carry coordinates, remember which
+        # tile their fort is in.
+        self._key_tiles = {}
+        self._lock = threading.Lock()
+
+    def touch(self, rows, key=None):
+        with self._lock:
+            for row in rows:
+                if 'latitude' in row and 'longitude' in row:
+                    tile = tile_for(row['latitude'], row['longitude'],
+                                    self.zoom)
+                    if key:
+                        self._key_tiles[row[key]] = tile
+                elif key:
+                    tile = self._key_tiles.get(row[key])
+                    if tile is None:
+                        continue
+                else:
+                    continue
+
+                self._seq += 1
+                self._versions[tile] = self._seq
+
+    def etag(self, x, y):
+        with self._lock:
+            return '{}-{}'.format(self.epoch, self._versions.get((x, y), 0))
+
+
+# When a tile's data changes by itself: the first Pokemon despawning, lure
+# running out, raid hatching or ending, or scanned location getting too old
+# to be shown, None if nothing does. These don't bump the tile's version.
+def tile_expiry(data):
+    now_date = datetime.utcnow()
+    times = [p['disappear_time'] for p in data.get('pokemons', ())]
+    times.extend(p['lure_expiration'] for p in data.get('pokestops', ())
+                 if p.get('lure_expiration'))
+    # Gyms come keyed by gym_id.
+    for gym in data.get('gyms', {}).values():
+        if gym.get('raid'):
+            times.extend((gym['raid']['start'], gym['raid']['end']))
+    # ScannedLocation.get_recent() only has the last 15 minutes.
+    times.extend(s['last_modified'] + timedelta(minutes=15)
+                 for s in data.get('scanned', ()))
+    times = [t for t in times if t > now_date]
+    return min(times) if times else None
+
+
+# ETag of a tile rendered at a version, valid until its expiry.
+def tile_etag(version, expiry):
+    if expiry is None:
+        return version
+    return '{}-{:x}'.format(version, int(
+        (expiry - datetime(1970, 1, 1)).total_seconds()))
@@ -27,7 +27,7 @@ from requests.adapters import HTTPAdapter
 from cHaversine import haversine
 from pprint import pformat
 
-from pogom import dyn_img
+from pogom import dyn_img, compositor
 from pogom.pgpool import pgpool_request_accounts
 
 log = logging.getLogger(__name__)
@@ -356,9 +356,22 @@ def get_args():
                               'This is useful for events that extend lure ' +
                               'duration.'), type=int, default=30)
     parser.add_argument('-pd', '--purge-data',
-                        help=('Clear Pokemon from database this many hours ' +
-                              'after they disappear (0 to disable).'),
+                        help=('Clear Pokemon and their statistics from ' +
+                              'database this many hours after they ' +
+                              'disappear (0 to disable).'),
                         type=int, default=0)
+    parser.add_argument('--purge-detection-data',
+                        help=('Clear spawnpoint detection data from ' +
+                              'database this many days after the scan, ' +
+                              'needs --db-partitions (0 to disable).'),
+                        type=int, default=0)
+    parser.add_argument('--db-partitions',
+                        help=('Partition the pokemon and spawnpoint ' +
+                              'detection data tables by day, so purging ' +
+                              'drops whole days instead of deleting rows. ' +
+                              'Existing tables are converted at startup, ' +
+                              'which can take a while.'),
+                        action='store_true', default=False)
     parser.add_argument('-px', '--proxy',
                         help='Proxy url (e.g. socks5://127.0.0.1:9050)',
                         action='append')
@@ -408,10 +421,36 @@ def get_args():
         default='127.0.0.1')
     group.add_argument(
         '--db-port', help='Port for the database.', type=int, default=3306)
+    parser.add_argument('--db-replica',
+                        help=('host[:port] of a MySQL read replica of the ' +
+                              'database (same name, user and password) to ' +
+                              'serve map data and statistics from. Can be ' +
+                              'given multiple times.'),
+                        action='append', dest='db_replicas', default=None)
+    parser.add_argument('--db-replica-max-lag',
+                        help=('Read from the primary instead of replicas ' +
+                              'more than this many seconds behind.'),
+                        type=int, default=30)
     parser.add_argument('--db-threads',
                         help=('Number of db threads; increase if the db ' +
                               'queue falls behind.'),
                         type=int, default=1)
+    parser.add_argument('--db-buffer-time',
+                        help=('Seconds to hold back database writes so ' +
+                              'updates of the same rows are merged into ' +
+                              'one. 0 to disable.'),
+                        type=float, default=1.0)
+    parser.add_argument('--db-buffer-rows',
+                        help=('Write buffered rows of a table once this ' +
+                              'many are waiting.'),
+                        type=int, default=1000)
+    parser.add_argument('--db-queue-max',
+                        help=('Max queued db updates per lane (map data, ' +
+                              'other scan data, worker status). Scanners ' +
+                              'wait for a full map or scan lane, the ' +
+                              'oldest worker status updates are dropped. ' +
+                              '0 for no limit.'),
+                        type=int, default=1000)
     parser.add_argument('-wh', '--webhook',
                         help='Define URL(s) to POST webhook information to.',
                         default=None, dest='webhooks', action='append')
@@ -421,6 +460,17 @@ def get_args():
                         action='store_true', default=False)
     parser.add_argument('-DC', '--enable-clean', help='Enable DB cleaner.',
                         action='store_true', default=False)
+    parser.add_argument('-rri', '--rarity-refresh-interval',
+                        help=('Minutes between full reloads of the Pokemon ' +
+                              'rarity table. New sightings are added as ' +
+                              'they are saved.'),
+                        type=int, default=60)
+    parser.add_argument('-lpi', '--live-pokemon-index',
+                        help=('Answer map Pokemon queries from an in-memory ' +
+                              'index fed by the db updater instead of ' +
+                              'MySQL. Needs the scanner and web server in ' +
+                              'the same process.'),
+                        action='store_true', default=False)
     parser.add_argument(
         '--wh-types',
         help=('Defines the type of messages to send to webhooks.'),
@@ -545,7 +595,9 @@ def get_args():
                         help='Do various things to let map accounts gain XP.',
                         action='store_true', default=False)
     parser.add_argument('-gen', '--generate-images',
-                        help='Use ImageMagick to generate dynamic icons on demand.',
+                        help=('Generate dynamic icons on demand, in-process '
+                              'with Pillow if installed, else with '
+                              'ImageMagick.'),
                         action='store_true', default=False)
     parser.add_argument('-pgsu', '--pgscout-url', default=None,
                         help='URL to query PGScout for Pokemon IV/CP.')
@@ -898,24 +950,30 @@ def get_args():
 
 def init_dynamic_images(args):
     if args.generate_images:
-        executable = determine_imagemagick_binary()
-        if executable:
+        if compositor.available():
             dyn_img.generate_images = True
-            dyn_img.imagemagick_executable = executable
-            log.info("Generating icons using ImageMagick executable '{}'.".format(executable))
-
-            if args.pogo_assets:
-                decr_assets_dir = os.path.join(args.pogo_assets, 'sprites')
-                if os.path.isdir(decr_assets_dir):
-                    log.info("Using PogoAssets repository at '{}'".format(args.pogo_assets))
-                    dyn_img.pogo_assets = args.pogo_assets
-                else:
-                    log.error("Could not find PogoAssets repository at '{}'."
-                              " Clone via 'git clone -depth 1 https://github.com/ZeChrales/PogoAssets.git'".format(args.pogo_assets))
+            dyn_img.native_images = True
+            log.info("Generating icons in-process using Pillow.")
         else:
-            log.error("Could not find ImageMagick executable. Make sure you can execute either 'magick' (ImageMagick 7)"
-                      " or 'convert' (ImageMagick 6) from the commandline. Otherwise you cannot use --generate-images")
-            sys.exit(1)
+            executable = determine_imagemagick_binary()
+            if executable:
+                dyn_img.generate_images = True
+                dyn_img.imagemagick_executable = executable
+                log.info("Generating icons using ImageMagick executable '{}'.".format(executable))
+            else:
+                log.error("Could not find Pillow or an ImageMagick executable. Install Pillow (pip install Pillow)"
+                          " or make sure you can execute either 'magick' (ImageMagick 7) or 'convert' (ImageMagick 6)"
+                          " from the commandline. Otherwise you cannot use --generate-images")
+                sys.exit(1)
+
+        if args.pogo_assets:
+            decr_assets_dir = os.path.join(args.pogo_assets, 'sprites')
+            if os.path.isdir(decr_assets_dir):
+                log.info("Using PogoAssets repository at '{}'".format(args.pogo_assets))
+                dyn_img.pogo_assets = args.pogo_assets
+            else:
+                log.error("Could not find PogoAssets repository at '{}'."
+                          " Clone via 'git clone -depth 1 https://github.com/ZeChrales/PogoAssets.git'".format(args.pogo_assets))
 
 
 def is_imagemagick_binary(binary):
@@ -1077,20 +1135,6 @@ def get_pokemon_id(pokemon_name):
     return get_pokemon_id.ids.get(pokemon_name, -1)
 
 
-def get_pokemon_name(pokemon_id):
-    return i8ln(get_pokemon_data(pokemon_id)['name'])
-
-
-def get_pokemon_rarity(pokemon_id):
-    return i8ln(get_pokemon_data(pokemon_id)['rarity'])
-
-
-def get_pokemon_types(pokemon_id):
-    pokemon_types = get_pokemon_data(pokemon_id)['types']
-    return map(lambda x: {"type": i8ln(x['type']), "color": x['color']},
-               pokemon_types)
-
-
 def get_moves_data(move_id):
     if not hasattr(get_moves_data, 'moves'):
         args = get_args()
@@ -1104,21 +1148,82 @@ def get_moves_data(move_id):
     return get_moves_data.moves[str(move_id)]
 
 
+# Species and move details resolved for the configured locale, built once
+# and shared by every caller. Values must not be modified.
+def init_lookup_tables():
+    if not hasattr(get_pokemon_data, 'pokemon'):
+        get_pokemon_data(1)
+    if not hasattr(get_moves_data, 'moves'):
+        get_moves_data(1)
+
+    species = {}
+    for pokemon_id, data in get_pokemon_data.pokemon.iteritems():
+        info = {
+            'name': i8ln(data['name']),
+            'types': tuple({'type': i8ln(t['type']), 'color': t['color']}
+                           for t in data['types'])
+        }
+        if 'rarity' in data:
+            info['rarity'] = i8ln(data['rarity'])
+        species[int(pokemon_id)] = info
+
+    moves = {}
+    for move_id, data in get_moves_data.moves.iteritems():
+        moves[int(move_id)] = {
+            'name': i8ln(data['name']),
+            'damage': i8ln(data['damage']),
+            'energy': i8ln(data['energy']),
+            'type': {'type': i8ln(data['type']), 'type_en': data['type']}
+        }
+
+    get_pokemon_info.species = species
+    get_move_info.moves = moves
+
+
+def get_pokemon_info(pokemon_id):
+    if not hasattr(get_pokemon_info, 'species'):
+        init_lookup_tables()
+    try:
+        return get_pokemon_info.species[pokemon_id]
+    except KeyError:
+        return get_pokemon_info.species[int(pokemon_id)]
+
+
+def get_move_info(move_id):
+    if not hasattr(get_move_info, 'moves'):
+        init_lookup_tables()
+    try:
+        return get_move_info.moves[move_id]
+    except KeyError:
+        return get_move_info.moves[int(move_id)]
+
+
+def get_pokemon_name(pokemon_id):
+    return get_pokemon_info(pokemon_id)['name']
+
+
+def get_pokemon_rarity(pokemon_id):
+    return get_pokemon_info(pokemon_id)['rarity']
+
+
+def get_pokemon_types(pokemon_id):
+    return get_pokemon_info(pokemon_id)['types']
+
+
 def get_move_name(move_id):
-    return i8ln(get_moves_data(move_id)['name'])
+    return get_move_info(move_id)['name']
 
 
 def get_move_damage(move_id):
-    return i8ln(get_moves_data(move_id)['damage'])
+    return get_move_info(move_id)['damage']
 
 
 def get_move_energy(move_id):
-    return i8ln(get_moves_data(move_id)['energy'])
+    return get_move_info(move_id)['energy']
 
 
 def get_move_type(move_id):
-    move_type = get_moves_data(move_id)['type']
-    return {'type': i8ln(move_type), 'type_en': move_type}
+    return get_move_info(move_id)['type']
 
 
 def dottedQuadToNum(ip):
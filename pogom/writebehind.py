@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+# Write-behind stage in front of bulk_upsert.
+#
+# Queued rows are merged per model by primary key until a model has
+# max_rows rows waiting or its oldest row is max_age seconds old. A row
+# merged into one that's already waiting updates it, so the result is the
+# same as upserting both in order. Models without a key of their own
+# (key_names() returns None) aren't held back.
+class WriteBehindBuffer(object):
+
+    def __init__(self, key_names, max_rows=1000, max_age=1.0, retries=3):
+        self.key_names = key_names
+        self.max_rows = max_rows
+        self.max_age = max_age
+        # Failed writes of a model in a row before its rows are dropped.
+        self.retries = retries
+        # model -> (time of the oldest row, {key: row})
+        self._pending = {}
+        self._keys = {}
+        # model -> failed writes in a row
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats_since = time.time()
+        self.rows_in = 0
+        self.rows_out = 0
+        self.flushes = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _row_key(self, model):
+        if model not in self._keys:
+            self._keys[model] = self.key_names(model)
+        return self._keys[model]
+
+    # Returns False if the rows have to be written right away instead.
+    def add(self, model, data):
+        names = self._row_key(model) if self.max_age > 0 else None
+        if names is None:
+            return False
+
+        try:
+            if len(names) == 1:
+                keyed = [(row[names[0]], row) for row in data.values()]
+            else:
+                keyed = [(tuple(row[n] for n in names), row)
+                         for row in data.values()]
+        except KeyError:
+            return False
+
+        with self._lock:
+            if model not in self._pending:
+                self._pending[model] = (time.time(), {})
+            rows = self._pending[model][1]
+            for key, row in keyed:
+                if key in rows:
+                    # Don't touch the caller's dicts.
+                    merged = dict(rows[key])
+                    merged.update(row)
+                    row = merged
+                rows[key] = row
+            self.rows_in += len(keyed)
+
+        return True
+
+    # Takes the rows of every model due for a flush, or all of them. Rows
+    # are grouped by their set of fields, bulk_upsert() fills in defaults
+    # for fields missing from a row.
+    def take(self, everything=False):
+        now = time.time()
+        batches = []
+        with self._lock:
+            for model, (since, rows) in list(self._pending.items()):
+                if not (everything or len(rows) >= self.max_rows or
+                        now - since >= self.max_age):
+                    continue
+
+                del self._pending[model]
+                self.rows_out += len(rows)
+                self.flushes += 1
+                self.latency_total += now - since
+                self.latency_max = max(self.latency_max, now - since)
+
+                groups = {}
+                for key, row in rows.items():
+                    groups.setdefault(frozenset(row), {})[key] = row
+                for group in groups.values():
+                    batches.append((model, group))
+
+        return batches
+
+    # Puts the rows of a failed write back in front of anything added since.
+    # Returns False if the model failed too often, the rows are dropped.
+    def put_back(self, model, data):
+        with self._lock:
+            failures = self._failures.get(model, 0) + 1
+            if failures > self.retries:
+                self._failures.pop(model, None)
+                return False
+            self._failures[model] = failures
+
+            since, rows = self._pending.get(model, (time.time(), {}))
+            for key, row in data.items():
+                if key in rows:
+                    merged = dict(row)
+                    merged.update(rows[key])
+                    row = merged
+                rows[key] = row
+            # Due again right away.
+            self._pending[model] = (min(since, time.time() - self.max_age),
+                                    rows)
+            self.rows_out -= len(data)
+            return True
+
+    def written(self, model):
+        with self._lock:
+            self._failures.pop(model, None)
+
+    def pending_rows(self):
+        with self._lock:
+            return sum(len(rows) for since, rows in self._pending.values())
+
+    # Coalescing ratio and flush latency since the last reset.
+    def stats(self, reset=False):
+        with self._lock:
+            return self._stats(reset)
+
+    # Stats for the last interval seconds, once per interval for however
+    # many db threads ask.
+    def report(self, interval):
+        with self._lock:
+            if time.time() - self.stats_since < interval:
+                return None
+            return self._stats(True)
+
+    def _stats(self, reset):
+        stats = {
+            'seconds': time.time() - self.stats_since,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'ratio': (float(self.rows_in) / self.rows_out
+                      if self.rows_out else 1.0),
+            'flushes': self.flushes,
+            'latency_avg': (self.latency_total / self.flushes
+                            if self.flushes else 0.0),
+            'latency_max': self.latency_max
+        }
+        if reset:
+            self._reset_stats()
+        return stats
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import atexit
 import os
 import sys
 import logging
@@ -22,13 +23,18 @@ from colorlog import ColoredFormatter
 
 from pogom.app import Pogom
 from pogom.utils import (get_args, now, gmaps_reverse_geolocate,
-                         log_resource_usage_loop, init_args, get_debug_dump_link)
+                         log_resource_usage_loop, init_args, get_debug_dump_link,
+                         init_lookup_tables)
 from pogom.altitude import get_gmaps_altitude
 
 from pogom.models import (init_database, create_tables, drop_tables,
                           PlayerLocale, db_updater, clean_db_loop,
-                          verify_table_encoding, verify_database_schema)
+                          verify_table_encoding, verify_database_schema,
+                          init_live_index, init_new_sightings,
+                          flush_write_buffer,
+                          rarity_refresh_loop, change_log)
 from pogom.webhook import wh_updater
+from pogom.dbqueue import DBUpdateQueue
 
 from pogom.osm import exgyms
 from pogom.proxy import initialize_proxies
@@ -263,6 +269,114 @@ def startup_db(app, clear_db):
     return db
 
 
+def create_app(position):
+    app = Pogom(__name__,
+                root_path=os.path.dirname(
+                          os.path.abspath(__file__)).decode('utf8'))
+    app.before_request(app.validate_request)
+    app.set_current_location(position)
+    return app
+
+
+def setup_app(app, args, control_flags, heartbeat, new_location_queue):
+    if args.cors:
+        CORS(app)
+
+    # No more stale JS.
+    init_cache_busting(app)
+
+    app.set_control_flags(control_flags)
+    app.set_heartbeat_control(heartbeat)
+    app.set_location_queue(new_location_queue)
+
+
+def create_control_flags(args):
+    # Control the search status (running or not) across threads.
+    control_flags = {
+      'on_demand': Event(),
+      'api_watchdog': Event(),
+      'search_control': Event()
+    }
+
+    for flag in control_flags.values():
+        flag.clear()
+
+    if args.on_demand_timeout > 0:
+        control_flags['on_demand'].set()
+
+    return control_flags
+
+
+# Threads of the db updaters and the map's in-memory views. Every process
+# serving the map needs them, the scanner's as well as WSGI workers.
+def start_db_threads(args, app, db, db_updates_queue):
+    # Map clients can only follow the change log of this process' db
+    # updater.
+    if app and not args.only_server:
+        change_log.enabled = True
+
+    # The live index is fed by the db updater, so it only makes sense when
+    # the scanner and the web server share this process.
+    if args.live_pokemon_index:
+        if app and not args.only_server:
+            log.info('Serving map Pokemon from the in-memory live index.')
+            init_live_index()
+        else:
+            log.warning('Live Pokemon index needs the scanner and the web ' +
+                        'server in the same process; disabled.')
+
+    # Thread(s) to process database updates.
+    init_new_sightings()
+    for i in range(args.db_threads):
+        log.debug('Starting db-updater worker thread %d', i)
+        t = Thread(target=db_updater, name='db-updater-{}'.format(i),
+                   args=(db_updates_queue, db))
+        t.daemon = True
+        t.start()
+    # Rows still held back by the write buffer on the way out.
+    atexit.register(flush_write_buffer, db, db_updates_queue, True)
+
+    # Pokemon rarity is served from a table refreshed in the background.
+    if app:
+        t = Thread(target=rarity_refresh_loop, name='rarity-refresh',
+                   args=(args.rarity_refresh_interval,))
+        t.daemon = True
+        t.start()
+
+
+# Map web app for a WSGI server in its own process(es), see wsgi.py. Sets up
+# what main() does for --only-server, without the Flask development server.
+def create_wsgi_app():
+    args = get_args()
+    args.only_server = True
+
+    set_log_and_verbosity(log)
+    args.root_path = os.path.dirname(os.path.abspath(__file__))
+    init_args(args)
+
+    if not validate_assets(args):
+        sys.exit(1)
+
+    init_lookup_tables()
+
+    position = extract_coordinates(args.location)
+    app = create_app(position)
+    db = startup_db(app, False)
+
+    # Scout results are saved through the app's db queue.
+    db_updates_queue = DBUpdateQueue(args.db_queue_max)
+    app.set_db_updates_queue(db_updates_queue)
+    start_db_threads(args, app, db, db_updates_queue)
+
+    new_location_queue = Queue()
+    new_location_queue.put(position)
+    setup_app(app, args, create_control_flags(args), [now()],
+              new_location_queue)
+
+    log.info('Map web app ready for the WSGI server.')
+    return app
+
+
 def extract_coordinates(location):
     # Use lat/lng directly if matches such a pattern.
     prog = re.compile("^(\-?\d+\.\d+),?\s?(\-?\d+\.\d+)$")
@@ -342,6 +456,9 @@ def main():
     if not args.no_server and not validate_assets(args):
         sys.exit(1)
 
+    # Species and move names for the configured locale.
+    init_lookup_tables()
+
     position = extract_coordinates(args.location)
 
     # Use the latitude and longitude to get the local altitude from Google.
@@ -376,26 +493,11 @@ def main():
 
     app = None
     if not args.no_server and not args.clear_db:
-        app = Pogom(__name__,
-                    root_path=os.path.dirname(
-                              os.path.abspath(__file__)).decode('utf8'))
-        app.before_request(app.validate_request)
-        app.set_current_location(position)
+        app = create_app(position)
 
     db = startup_db(app, args.clear_db)
 
-    # Control the search status (running or not) across threads.
-    control_flags = {
-      'on_demand': Event(),
-      'api_watchdog': Event(),
-      'search_control': Event()
-    }
-
-    for flag in control_flags.values():
-        flag.clear()
-
-    if args.on_demand_timeout > 0:
-        control_flags['on_demand'].set()
+    control_flags = create_control_flags(args)
 
     heartbeat = [now()]
 
@@ -404,21 +506,16 @@ def main():
     new_location_queue.put(position)
 
     # DB Updates
-    db_updates_queue = Queue()
+    db_updates_queue = DBUpdateQueue(args.db_queue_max)
     if app:
         app.set_db_updates_queue(db_updates_queue)
 
-    # Thread(s) to process database updates.
-    for i in range(args.db_threads):
-        log.debug('Starting db-updater worker thread %d', i)
-        t = Thread(target=db_updater, name='db-updater-{}'.format(i),
-                   args=(db_updates_queue, db))
-        t.daemon = True
-        t.start()
+    start_db_threads(args, app, db, db_updates_queue)
 
     # Database cleaner; really only need one ever.
     if args.enable_clean:
-        t = Thread(target=clean_db_loop, name='db-cleaner', args=(args,))
+        t = Thread(target=clean_db_loop, name='db-cleaner',
+                   args=(args, db_updates_queue))
         t.daemon = True
         t.start()
 
@@ -503,15 +600,7 @@ def main():
             time.sleep(60)
     else:
 
-        if args.cors:
-            CORS(app)
-
-        # No more stale JS.
-        init_cache_busting(app)
-
-        app.set_control_flags(control_flags)
-        app.set_heartbeat_control(heartbeat)
-        app.set_location_queue(new_location_queue)
+        setup_app(app, args, control_flags, heartbeat, new_location_queue)
         ssl_context = None
         if (args.ssl_certificate and args.ssl_privatekey and
                 os.path.exists(args.ssl_certificate) and
@@ -35,6 +35,7 @@ var languageLookupThreshold = 3
 var searchMarkerStyles
 
 var timestamp
+var seq
 var excludedPokemon = []
 var excludedPokemonByRarity = []
 var excludedRarity
@@ -74,6 +75,8 @@ var selectedStyle = 'light'
 
 var updateWorker
 var lastUpdateTime
+var changeStream = null
+var changeStreamUpdate = null
 var redrawTimeout = null
 
 const gymTypes = ['Uncontested', 'Mystic', 'Valor', 'Instinct']
@@ -325,6 +328,7 @@ function initMap() { // eslint-disable-line no-unused-vars
 
     map.setMapTypeId(Store.get('map_style'))
     map.addListener('idle', updateMap)
+    map.addListener('idle', startChangeStream)
 
     map.addListener('zoom_changed', function () {
         //Fix For Timer Drawing
@@ -2059,6 +2063,7 @@ function loadRawData() {
         data: {
             'userAuthCode': userAuthCode,
             'timestamp': timestamp,
+            'seq': seq,
             'pokemon': loadPokemon,
             'lurePokemon': loadLurePokemon,
             'lastpokemon': lastpokemon,
@@ -2531,6 +2536,58 @@ function updateGeofences(geofences) {
     }
 }
 
+// Follow changes pushed by the server for the visible area, see /stream.
+// Polling slows down while the stream is connected.
+function startChangeStream() {
+    if (!window.EventSource) {
+        return
+    }
+    if (changeStream) {
+        changeStream.close()
+    }
+
+    var bounds = map.getBounds()
+    var swPoint = bounds.getSouthWest()
+    var nePoint = bounds.getNorthEast()
+    changeStream = new EventSource('stream?' + $.param({
+        'userAuthCode': localStorage.getItem('userAuthCode'),
+        'swLat': swPoint.lat(),
+        'swLng': swPoint.lng(),
+        'neLat': nePoint.lat(),
+        'neLng': nePoint.lng()
+    }))
+
+    changeStream.addEventListener('pokemon', function (e) {
+        processPokemons([JSON.parse(e.data)])
+    })
+    $.each(['gym', 'raid', 'lure', 'resync'], function (i, name) {
+        changeStream.addEventListener(name, scheduleMapUpdate)
+    })
+    changeStream.onerror = function () {
+        // Server doesn't stream (e.g. web only instance), keep polling.
+        if (changeStream && changeStream.readyState === EventSource.CLOSED) {
+            changeStream = null
+        }
+    }
+}
+
+// Batch pushed gym, raid and lure changes into one incremental update.
+function scheduleMapUpdate() {
+    if (changeStreamUpdate === null) {
+        changeStreamUpdate = setTimeout(function () {
+            changeStreamUpdate = null
+            updateMap()
+        }, 1000)
+    }
+}
+
+function pollMap() {
+    var streaming = changeStream !== null && changeStream.readyState === EventSource.OPEN
+    if (!streaming || Date.now() - lastUpdateTime > 30000) {
+        updateMap()
+    }
+}
+
 function updateMap() {
     loadRawData().done(function (result) {
         var lurePokemons = {}
@@ -2595,6 +2652,7 @@ function updateMap() {
             }, reincludedPokemon)
         }
         timestamp = result.timestamp
+        seq = result.seq
         lastUpdateTime = Date.now()
     })
 }
@@ -3505,7 +3563,7 @@ $(function () {
     // run interval timers to regularly update map and timediffs
     window.setInterval(updateLabelDiffTime, 1000)
     window.setInterval(updateLabelTime, 1000)
-    window.setInterval(updateMap, 5000)
+    window.setInterval(pollMap, 5000)
     window.setInterval(updateGeoLocation, 1000)
 
     createUpdateWorker()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import pytest
+
+from peewee import SqliteDatabase
+
+from pogom import utils
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+# Stands in for the parsed command line, with the flags models reads.
+class Args(object):
+    purge_data = 0
+    db_partitions = False
+    no_pokemon = False
+    no_gyms = False
+    no_pokestops = False
+    db_buffer_rows = 1000
+    db_buffer_time = 1.0
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+# models reads its args on import.
+utils.get_args = lambda: Args()
+
+from pogom import models  # noqa: E402
+
+
+# Replaces models.args for one test.
+@pytest.fixture
+def models_args():
+    def patch(**kwargs):
+        patcher = mock.patch.object(models, 'args', Args(**kwargs))
+        patchers.append(patcher)
+        return patcher.start()
+
+    patchers = []
+    yield patch
+    for patcher in reversed(patchers):
+        patcher.stop()
+
+
+# An SQLite database behind the models. Queries run in their own execution
+# context need a file all connections share.
+@pytest.fixture
+def sqlite_db():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    db = SqliteDatabase(path)
+    models.flaskDb._load_database(None, db)
+    yield db
+    db.close()
+    os.remove(path)
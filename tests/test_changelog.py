@@ -0,0 +1,80 @@
+import unittest
+
+from pogom import changelog
+from pogom.changelog import ChangeLog
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class ChangeLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time = changelog.time
+        changelog.time = self.clock
+        self.change_log = ChangeLog(('pokemon', 'gyms'), maxlen=3)
+
+    def tearDown(self):
+        changelog.time = self.time
+
+    def test_changes_since_cursor(self):
+        cursor, changed = self.change_log.since(None)
+        self.assertEqual(changed, {'pokemon': None, 'gyms': None})
+
+        self.change_log.record('pokemon', [1, 2])
+        cursor, changed = self.change_log.since(cursor)
+        self.assertEqual(changed, {'pokemon': set([1, 2]), 'gyms': set()})
+
+        cursor, changed = self.change_log.since(cursor)
+        self.assertEqual(changed, {'pokemon': set(), 'gyms': set()})
+
+    def test_cursor_too_old(self):
+        cursor = self.change_log.cursor()
+        self.change_log.record('pokemon', [1, 2, 3, 4])
+        self.change_log.record('gyms', ['a'])
+        cursor, changed = self.change_log.since(cursor)
+        # Change 1 has been pushed out, gyms are still complete.
+        self.assertIsNone(changed['pokemon'])
+        self.assertEqual(changed['gyms'], set(['a']))
+
+    def test_cursor_of_another_run(self):
+        other = ChangeLog(('pokemon', 'gyms'))
+        cursor, changed = self.change_log.since(other.cursor())
+        self.assertEqual(changed, {'pokemon': None, 'gyms': None})
+
+        for cursor in ('', 'x', self.change_log.epoch + ':1',
+                       self.change_log.epoch + ':a:b'):
+            changed = self.change_log.since(cursor)[1]
+            self.assertEqual(changed, {'pokemon': None, 'gyms': None})
+
+    def test_cursor_from_the_future(self):
+        cursor = self.change_log.epoch + ':5:0'
+        self.assertIsNone(self.change_log.since(cursor)[1]['pokemon'])
+
+    def test_cursor_held_back_by_lag(self):
+        cursor = self.change_log.cursor()
+        self.change_log.record('pokemon', [1])
+        self.clock.now += 30
+        self.change_log.record('pokemon', [2])
+        self.clock.now += 5
+
+        # A replica 10s behind may not have 2 yet, it's sent again.
+        behind, changed = self.change_log.since(cursor, 10)
+        self.assertEqual(changed['pokemon'], set([1, 2]))
+        self.assertEqual(self.change_log.since(behind)[1]['pokemon'],
+                         set([2]))
+
+        # Nothing recorded in time, the cursor stays where it was.
+        behind, changed = self.change_log.since(cursor, 60)
+        self.assertEqual(self.change_log.since(behind)[1]['pokemon'],
+                         set([1, 2]))
+
+        latest = self.change_log.since(cursor)[0]
+        self.assertEqual(self.change_log.since(latest)[1]['pokemon'], set())
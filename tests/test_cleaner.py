@@ -0,0 +1,50 @@
+import unittest
+
+from pogom.cleaner import IncrementalCleaner
+
+
+class Queue(object):
+
+    def __init__(self, depth):
+        self.depth = depth
+
+    def qsize(self):
+        return self.depth
+
+
+class Table(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.batches = []
+
+    def clean(self, limit):
+        rows = min(limit, self.rows)
+        self.rows -= rows
+        self.batches.append(rows)
+        return rows
+
+
+class IncrementalCleanerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cleaner = IncrementalCleaner(Queue(0), batch_size=10, budget=25,
+                                          pause=0)
+
+    def test_batches_stop_when_done(self):
+        table = Table(15)
+        self.assertEqual(self.cleaner.run('table', table.clean), 15)
+        self.assertEqual(table.batches, [10, 5])
+
+    def test_budget_leaves_the_rest_for_later(self):
+        table = Table(100)
+        self.assertEqual(self.cleaner.run('table', table.clean), 25)
+        self.assertEqual(table.batches, [10, 10, 5])
+        self.assertEqual(self.cleaner.run('table', table.clean, 50), 50)
+        self.assertEqual(self.cleaner.cleaned['table'], 75)
+
+    def test_backed_up_queue_slows_down(self):
+        self.cleaner.max_pause = 1
+        self.assertEqual(self.cleaner.throttle(), 0)
+        self.cleaner.db_updates_queue.depth = 100
+        self.assertEqual(self.cleaner.throttle(), 1)
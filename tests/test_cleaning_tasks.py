@@ -0,0 +1,57 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from pogom import models
+
+
+class CleaningTasksTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def database(self, sqlite_db, models_args):
+        self.db = sqlite_db
+        self.regular_tasks, self.full_tasks = models.cleaning_tasks(
+            models_args(purge_data=1))
+        self.db.create_tables([
+            getattr(models, name)
+            for name, task in self.regular_tasks + self.full_tasks])
+
+    def test_every_task_runs(self):
+        for name, task in self.regular_tasks + self.full_tasks:
+            self.assertEqual(task(10), 0, name)
+
+    def test_table_without_primary_key(self):
+        old = datetime.utcnow() - timedelta(days=400)
+        models.GymMember.insert_many([
+            {'gym_id': 'gym', 'pokemon_uid': uid, 'last_scanned': old,
+             'deployment_time': old, 'cp_decayed': 10}
+            for uid in range(15)]).execute()
+        models.GymMember.create(gym_id='gym', pokemon_uid=15,
+                                deployment_time=old, cp_decayed=10)
+
+        task = dict(self.full_tasks)['GymMember']
+        self.assertEqual(task(10), 10)
+        self.assertEqual(task(10), 5)
+        self.assertEqual(task(10), 0)
+        self.assertEqual(models.GymMember.select().count(), 1)
+
+    def test_statistics_follow_the_purge(self):
+        hour = models.stats_hour(datetime.utcnow())
+        models.PokemonHourlyStats.insert_many([
+            {'hour': hour - timedelta(hours=hours), 'pokemon_id': 1,
+             'sightings': 1, 'last_appeared': hour, 'latitude': 0.0,
+             'longitude': 0.0}
+            for hours in (0, 1, 2, 3)]).execute()
+        day = models.stats_day(datetime.utcnow())
+        models.SpawnpointDailyStats.insert_many([
+            {'day': day - timedelta(days=days), 'pokemon_id': 1,
+             'spawnpoint_id': 1, 'sightings': 1, 'last_appeared': day,
+             'latitude': 0.0, 'longitude': 0.0}
+            for days in (0, 1, 2)]).execute()
+
+        tasks = dict(self.full_tasks)
+        # Pokemon are purged an hour after they disappear.
+        self.assertEqual(tasks['PokemonHourlyStats'](10), 2)
+        self.assertEqual(tasks['SpawnpointDailyStats'](10), 2)
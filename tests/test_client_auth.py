@@ -0,0 +1,93 @@
+import time
+import unittest
+
+from requests.exceptions import ConnectionError
+from requests.models import Response
+
+from pogom import client_auth
+from pogom.client_auth import DiscordAuthCache
+
+
+class Args(object):
+    uas_discord_required_guild = '1'
+    uas_discord_required_roles = None
+
+
+def make_entry(checked):
+    return {'access_token': 'token', 'guilds': [{'id': '1'}],
+            'checked': checked}
+
+
+class DiscordAuthCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.get_user_guilds = client_auth.get_user_guilds
+        self.requests_get = client_auth.requests.get
+        self.cache = DiscordAuthCache(maxsize=2)
+
+    def tearDown(self):
+        client_auth.get_user_guilds = self.get_user_guilds
+        client_auth.requests.get = self.requests_get
+
+    def discord_returns(self, status_code):
+        def get(url, **kwargs):
+            response = Response()
+            response.status_code = status_code
+            response.url = url
+            response._content = b'[{"id": "1"}]'
+            return response
+        client_auth.requests.get = get
+
+    def test_oldest_users_are_evicted(self):
+        for code in ('a', 'b', 'c'):
+            self.cache.put(code, make_entry(time.time()))
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_refresh_replaces_entry(self):
+        client_auth.get_user_guilds = lambda token: [{'id': '2'}]
+        self.cache.put('a', make_entry(0))
+        entry = self.cache.refresh('a', Args())
+        self.assertEqual(entry['guilds'], [{'id': '2'}])
+        self.assertLess(self.cache.age(self.cache.get('a')), 60)
+
+    def test_refresh_drops_rejected_users(self):
+        client_auth.get_user_guilds = lambda token: False
+        self.cache.put('a', make_entry(0))
+        self.assertIsNone(self.cache.refresh('a', Args()))
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_refresh_keeps_entry_when_discord_is_down(self):
+        def unreachable(token):
+            raise ConnectionError()
+        client_auth.get_user_guilds = unreachable
+        self.cache.put('a', make_entry(0))
+        self.assertIsNotNone(self.cache.refresh('a', Args()))
+        self.assertEqual(self.cache.get('a')['checked'], 0)
+
+    def test_refresh_drops_revoked_users(self):
+        for status_code in (401, 403):
+            self.discord_returns(status_code)
+            self.cache.put('a', make_entry(0))
+            self.assertIsNone(self.cache.refresh('a', Args()))
+            self.assertIsNone(self.cache.get('a'))
+
+    def test_refresh_keeps_entry_when_rate_limited(self):
+        self.discord_returns(429)
+        self.cache.put('a', make_entry(0))
+        self.assertIsNotNone(self.cache.refresh('a', Args()))
+        self.assertEqual(self.cache.get('a')['checked'], 0)
+
+    def test_refresh_keeps_entry_on_discord_errors(self):
+        for status_code in (500, 502, 503):
+            self.discord_returns(status_code)
+            self.cache.put('a', make_entry(0))
+            self.assertIsNotNone(self.cache.refresh('a', Args()))
+            self.assertEqual(self.cache.get('a')['checked'], 0)
+
+    def test_refresh_with_discord_ok(self):
+        self.discord_returns(200)
+        self.cache.put('a', make_entry(0))
+        self.assertEqual(self.cache.refresh('a', Args())['guilds'],
+                         [{'id': '1'}])
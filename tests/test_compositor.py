@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pogom import compositor
+
+if compositor.available():
+    from PIL import Image
+
+
+@unittest.skipUnless(compositor.available(), 'Pillow is not installed')
+class CompositorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def image(self, name, size, color):
+        path = os.path.join(self.path, name)
+        Image.new('RGBA', size, color).save(path)
+        return path
+
+    def test_layer_larger_than_canvas_is_cut_off(self):
+        canvas = Image.new('RGBA', (10, 10), (0, 0, 0, 0))
+        layer = Image.new('RGBA', (14, 14), (255, 0, 0, 255))
+        compositor.composite(canvas, layer, 'center')
+        self.assertEqual(canvas.getpixel((0, 0)), (255, 0, 0, 255))
+        self.assertEqual(canvas.getpixel((9, 9)), (255, 0, 0, 255))
+
+    def test_battle_icon(self):
+        # Only the base image is drawn on, no badges need the font.
+        icon = compositor.GymIcon.__new__(compositor.GymIcon)
+        icon.image = compositor.load_image(
+            self.image('gym.png', (96, 96), (0, 0, 255, 255)))
+        icon.battle(self.image('battle.png', (200, 150), (255, 0, 0, 255)))
+        self.assertEqual(icon.image.size, (96, 96))
+        self.assertEqual(icon.image.getpixel((48, 48)), (255, 0, 0, 255))
+        self.assertEqual(icon.image.getpixel((48, 2)), (0, 0, 255, 255))
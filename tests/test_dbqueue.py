@@ -0,0 +1,66 @@
+import time
+import unittest
+
+from collections import deque
+from queue import Empty, Full
+
+from pogom.dbqueue import DBUpdateQueue, MAX_WAIT
+
+
+class Pokemon(object):
+    pass
+
+
+class ScannedLocation(object):
+    pass
+
+
+class WorkerStatus(object):
+    pass
+
+
+class DBUpdateQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = DBUpdateQueue(maxsize=2)
+
+    def test_map_lane_is_served_first(self):
+        self.queue.put((WorkerStatus, {}))
+        self.queue.put((ScannedLocation, {}))
+        self.queue.put((Pokemon, {}))
+        self.assertEqual(self.queue.qsize(), 3)
+        self.assertIs(self.queue.get()[0], Pokemon)
+        self.assertIs(self.queue.get()[0], ScannedLocation)
+        self.assertIs(self.queue.get()[0], WorkerStatus)
+        self.assertRaises(Empty, self.queue.get, timeout=0)
+
+    def test_full_lane_blocks(self):
+        self.queue.put((Pokemon, {}))
+        self.queue.put((Pokemon, {}))
+        self.assertRaises(Full, self.queue.put, (Pokemon, {}), timeout=0.01)
+        self.assertRaises(Full, self.queue.put_nowait, (Pokemon, {}))
+        # Other lanes aren't affected.
+        self.queue.put_nowait((ScannedLocation, {}))
+
+    def test_status_lane_sheds_oldest(self):
+        for i in range(3):
+            self.queue.put((WorkerStatus, {0: i}))
+        self.assertEqual(self.queue.get()[1], {0: 1})
+        self.assertEqual(self.queue.lane_stats()[2][4], 1)
+
+    def test_longest_overdue_lane_is_served_first(self):
+        self.queue.put((ScannedLocation, {}))
+        self.queue.put((Pokemon, {0: 1}))
+        self.queue.put((Pokemon, {0: 2}))
+        self.queue.put((WorkerStatus, {}))
+        # Backdate every item past MAX_WAIT, the scan was enqueued first.
+        now = time.time()
+        for lane, waits in zip(self.queue.lanes, ([20, 10], [30], [5])):
+            lane.items = deque(
+                (now - MAX_WAIT - wait, item)
+                for wait, (enqueued, item) in zip(waits, lane.items))
+
+        self.assertIs(self.queue.get()[0], ScannedLocation)
+        self.assertEqual(self.queue.get()[1], {0: 1})
+        self.assertEqual(self.queue.get()[1], {0: 2})
+        self.assertIs(self.queue.get()[0], WorkerStatus)
@@ -0,0 +1,76 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from pogom.liveindex import LivePokemonIndex
+
+
+def make_row(encounter_id, lat, lng, minutes=10, pokemon_id=1):
+    return {
+        'encounter_id': encounter_id,
+        'pokemon_id': pokemon_id,
+        'latitude': lat,
+        'longitude': lng,
+        'disappear_time': datetime.utcnow() + timedelta(minutes=minutes),
+        'last_modified': datetime.utcnow()
+    }
+
+
+class LivePokemonIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LivePokemonIndex()
+        self.index.load([
+            make_row(1, 40.0, -73.0),
+            make_row(2, 40.5, -73.5, pokemon_id=2),
+            make_row(3, 41.0, -74.0),
+            make_row(4, 40.1, -73.1, minutes=-1)
+        ])
+
+    def test_expired_rows_are_not_indexed(self):
+        self.assertEqual(len(self.index), 3)
+
+    def test_query_bounds(self):
+        rows = self.index.query('39.9', '-73.6', '40.6', '-72.9')
+        self.assertEqual(sorted(r['encounter_id'] for r in rows), [1, 2])
+
+    def test_query_without_bounds_returns_all(self):
+        rows = self.index.query(None, None, None, None)
+        self.assertEqual(len(rows), 3)
+
+    def test_query_excludes_old_bounds(self):
+        rows = self.index.query('39.9', '-74.1', '41.1', '-72.9',
+                                oSwLat='40.4', oSwLng='-73.6',
+                                oNeLat='41.1', oNeLng='-73.4')
+        self.assertEqual(sorted(r['encounter_id'] for r in rows), [1, 3])
+
+    def test_query_pokemon_ids(self):
+        rows = self.index.query(None, None, None, None, pokemon_ids={2})
+        self.assertEqual([r['encounter_id'] for r in rows], [2])
+
+    def test_update_moves_row(self):
+        self.index.update([make_row(1, 41.0, -74.0)])
+        rows = self.index.query('39.9', '-73.6', '40.6', '-72.9')
+        self.assertEqual([r['encounter_id'] for r in rows], [2])
+        self.assertEqual(len(self.index), 3)
+
+    def test_results_are_copies(self):
+        rows = self.index.query(None, None, None, None)
+        for row in rows:
+            row['encounter_id'] = str(row['encounter_id'])
+        rows = self.index.query(None, None, None, None)
+        self.assertTrue(all(isinstance(r['encounter_id'], int) for r in rows))
+
+    def test_updated_rows_are_modified_now(self):
+        timestamp = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+        row = make_row(5, 40.0, -73.0)
+        del row['last_modified']
+        self.index.update([row])
+        rows = self.index.query(None, None, None, None,
+                                timestamp=timestamp * 1000 - 1)
+        self.assertIn(5, [r['encounter_id'] for r in rows])
+
+    def test_query_bounds_at_zero(self):
+        self.index.update([make_row(5, 0.0, 0.0), make_row(6, 0.5, 0.5)])
+        rows = self.index.query(0.0, 0.0, 0.1, 0.1)
+        self.assertEqual([r['encounter_id'] for r in rows], [5])
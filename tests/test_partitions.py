@@ -0,0 +1,36 @@
+import unittest
+
+from datetime import date, datetime
+
+from pogom.partitions import (partition_name, partition_day,
+                              partition_definition, plan_partitions)
+
+
+class PartitionsTest(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(partition_name(date(2018, 3, 9)), 'p20180309')
+        self.assertEqual(partition_day('p20180309'), date(2018, 3, 9))
+        self.assertIsNone(partition_day('pmax'))
+        self.assertEqual(partition_definition(date(2018, 3, 31)),
+                         "PARTITION p20180331 VALUES LESS THAN "
+                         "(TO_DAYS('2018-04-01'))")
+
+    def test_future_days_are_added(self):
+        days = [date(2018, 3, 1), date(2018, 3, 2)]
+        create, drop = plan_partitions(days, date(2018, 3, 2), 2)
+        self.assertEqual(create, [date(2018, 3, 3), date(2018, 3, 4)])
+        self.assertEqual(drop, [])
+
+        create, drop = plan_partitions(days, date(2018, 3, 1), 1)
+        self.assertEqual(create, [])
+
+    def test_only_whole_days_are_dropped(self):
+        days = [date(2018, 3, d) for d in range(1, 6)]
+        create, drop = plan_partitions(days, date(2018, 3, 4), 1,
+                                       datetime(2018, 3, 3, 12))
+        self.assertEqual(drop, [date(2018, 3, 1), date(2018, 3, 2)])
+
+        create, drop = plan_partitions(days, date(2018, 3, 4), 1,
+                                       datetime(2018, 3, 3))
+        self.assertEqual(drop, [date(2018, 3, 1), date(2018, 3, 2)])
@@ -0,0 +1,41 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from pogom import models
+
+
+class MovedPokemonTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def database(self, sqlite_db, models_args):
+        self.db = sqlite_db
+        models_args(purge_data=1, db_partitions=True)
+        # The partitioned table's primary key.
+        self.db.execute_sql(
+            'CREATE TABLE pokemon (encounter_id INTEGER, '
+            'disappear_time DATETIME, last_modified DATETIME, '
+            'PRIMARY KEY (encounter_id, disappear_time));')
+
+    def insert(self, encounter_id, disappear_time):
+        models.Pokemon.insert(encounter_id=encounter_id,
+                              disappear_time=disappear_time).execute()
+
+    def test_reupsert_with_shifted_disappear_time(self):
+        disappear_time = datetime.utcnow().replace(microsecond=0)
+        self.insert(1, disappear_time)
+        self.insert(2, disappear_time)
+
+        rows = [
+            {'encounter_id': 1,
+             'disappear_time': disappear_time + timedelta(seconds=1)},
+            {'encounter_id': 2,
+             'disappear_time': disappear_time.replace(microsecond=400000)},
+            {'encounter_id': 3, 'disappear_time': disappear_time}]
+        self.assertEqual(models.delete_moved_pokemon(rows), 1)
+        self.assertEqual(
+            [p.encounter_id for p in models.Pokemon
+             .select(models.Pokemon.encounter_id)],
+            [2])
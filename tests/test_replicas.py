@@ -0,0 +1,69 @@
+import unittest
+
+from pogom.replicas import ReplicaRouter
+
+
+class Database(object):
+
+    def __init__(self, lag):
+        self.lag = lag
+        self.contexts = 0
+
+    def execution_context(self, with_transaction=True):
+        database = self
+
+        class Context(object):
+            def __enter__(self):
+                database.contexts += 1
+
+            def __exit__(self, *args):
+                pass
+
+        return Context()
+
+
+class Router(ReplicaRouter):
+
+    def lag(self, database):
+        if isinstance(database.lag, Exception):
+            raise database.lag
+        return database.lag
+
+
+class ReplicaRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.router.max_lag = 10
+
+    def test_primary_without_replicas(self):
+        with self.router.reads():
+            self.assertIsNone(self.router.current())
+            self.assertEqual(self.router.current_lag(), 0)
+
+    def test_lagging_replicas_are_skipped(self):
+        fresh = Database(2)
+        self.router.replicas = [('fresh', fresh), ('behind', Database(60)),
+                                ('broken', Database(None)),
+                                ('down', Database(IOError()))]
+        self.router.check()
+        self.assertEqual(self.router.healthy, [('fresh', fresh)])
+
+        with self.router.reads():
+            self.assertIs(self.router.current(), fresh)
+            self.assertEqual(self.router.current_lag(),
+                             2 + self.router.check_interval + 1)
+            # Nested reads stay where they are.
+            with self.router.reads():
+                self.assertIs(self.router.current(), fresh)
+        self.assertIsNone(self.router.current())
+        self.assertEqual(fresh.contexts, 1)
+
+    def test_falls_back_to_primary(self):
+        replica = Database(2)
+        self.router.replicas = [('replica', replica)]
+        self.router.check()
+        replica.lag = 30
+        self.router.check()
+        with self.router.reads():
+            self.assertIsNone(self.router.current())
@@ -0,0 +1,75 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from pogom.rollup import NewSightings, stats_rollups
+
+
+def make_row(encounter_id):
+    return {'encounter_id': encounter_id,
+            'disappear_time': datetime.utcnow() + timedelta(minutes=10)}
+
+
+class NewSightingsTest(unittest.TestCase):
+
+    def test_rescans_count_once(self):
+        sightings = NewSightings()
+        self.assertEqual(len(sightings.filter([make_row(1), make_row(2)])),
+                         2)
+        self.assertEqual(sightings.filter([make_row(1)]), [])
+
+    def test_loaded_rows_are_not_counted(self):
+        sightings = NewSightings()
+        sightings.load([make_row(1)])
+        self.assertEqual(len(sightings), 1)
+        rows = sightings.filter([make_row(1), make_row(2)])
+        self.assertEqual([r['encounter_id'] for r in rows], [2])
+
+    def test_released_rows_are_counted_again(self):
+        sightings = NewSightings()
+        rows = sightings.filter([make_row(1)])
+        # Held back until the counters are written or given up on.
+        self.assertEqual(sightings.filter([make_row(1)]), [])
+        sightings.release(rows)
+        rows = sightings.filter([make_row(1)])
+        self.assertEqual(len(rows), 1)
+        sightings.counted(rows)
+        self.assertEqual(len(sightings), 1)
+        self.assertEqual(sightings.filter([make_row(1)]), [])
+
+
+class StatsRollupsTest(unittest.TestCase):
+
+    def sighting(self, pokemon_id, spawnpoint_id, disappear_time):
+        return {'pokemon_id': pokemon_id, 'spawnpoint_id': spawnpoint_id,
+                'disappear_time': disappear_time,
+                'latitude': float(spawnpoint_id), 'longitude': 0.0}
+
+    def test_counts_by_hour_and_by_day(self):
+        day = datetime(2018, 5, 1)
+        species, spawnpoints = stats_rollups([
+            self.sighting(1, 10, day + timedelta(hours=1, minutes=5)),
+            self.sighting(1, 11, day + timedelta(hours=1, minutes=30)),
+            self.sighting(1, 10, day + timedelta(hours=2, minutes=5)),
+            self.sighting(2, 10, day + timedelta(hours=3, minutes=5))])
+
+        self.assertEqual(sorted((key, s['sightings'])
+                                for key, s in species.items()),
+                         [((day + timedelta(hours=1), 1), 2),
+                          ((day + timedelta(hours=2), 1), 1),
+                          ((day + timedelta(hours=3), 2), 1)])
+        self.assertEqual(sorted((key, s['sightings'])
+                                for key, s in spawnpoints.items()),
+                         [((1, 10, day), 2), ((1, 11, day), 1),
+                          ((2, 10, day), 1)])
+
+    def test_location_follows_the_last_sighting(self):
+        day = datetime(2018, 5, 1)
+        species, spawnpoints = stats_rollups([
+            self.sighting(1, 11, day + timedelta(minutes=30)),
+            self.sighting(1, 10, day + timedelta(minutes=5))])
+
+        stats = species[(day, 1)]
+        self.assertEqual(stats['last_appeared'],
+                         day + timedelta(minutes=30))
+        self.assertEqual(stats['latitude'], 11.0)
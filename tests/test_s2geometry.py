@@ -0,0 +1,14 @@
+import unittest
+
+from pogom.s2geometry import cell_geometry_cache, get_cell_geometry
+
+
+class CellGeometryTest(unittest.TestCase):
+
+    def test_cell_id_types_share_a_cache_entry(self):
+        cell_geometry_cache.clear()
+        cell_id = 9749618446378729472
+        geometry = get_cell_geometry(long(cell_id))
+        self.assertIs(get_cell_geometry(str(cell_id)), geometry)
+        self.assertEqual(len(cell_geometry_cache), 1)
+        self.assertEqual(geometry['s2_cell_id'], str(cell_id))
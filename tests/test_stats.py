@@ -0,0 +1,90 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from pogom import models
+from pogom.rollup import stats_day, stats_hour
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class StatsQueriesTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def database(self, sqlite_db, models_args):
+        self.db = sqlite_db
+        models_args()
+        self.db.create_tables([models.Pokemon, models.PokemonHourlyStats,
+                               models.SpawnpointDailyStats])
+        # get_seen() is cached.
+        models.cache.clear()
+        self.hour = stats_hour(datetime.utcnow())
+        self.day = stats_day(datetime.utcnow())
+        # Names come from the built static data.
+        with mock.patch.object(models, 'get_pokemon_name', str):
+            yield
+
+    def hourly(self, hour, pokemon_id, sightings, latitude):
+        models.PokemonHourlyStats.create(
+            hour=hour, pokemon_id=pokemon_id, sightings=sightings,
+            last_appeared=hour + timedelta(minutes=latitude),
+            latitude=latitude, longitude=0.0)
+
+    def daily(self, day, spawnpoint_id, sightings):
+        models.SpawnpointDailyStats.create(
+            pokemon_id=1, spawnpoint_id=spawnpoint_id, day=day,
+            sightings=sightings, last_appeared=day,
+            latitude=float(spawnpoint_id), longitude=0.0)
+
+    def test_seen_sums_hours_at_the_last_location(self):
+        self.hour -= timedelta(hours=1)
+        self.hourly(self.hour - timedelta(hours=2), 1, 3, 10)
+        self.hourly(self.hour, 1, 2, 20)
+        self.hourly(self.hour, 2, 1, 30)
+
+        seen = models.Pokemon.get_seen(0)
+        self.assertEqual(seen['total'], 6)
+        pokemon = dict((p['pokemon_id'], p) for p in seen['pokemon'])
+        self.assertEqual(pokemon[1]['count'], 5)
+        self.assertEqual(pokemon[1]['latitude'], 20)
+        self.assertEqual(pokemon[2]['count'], 1)
+
+        # Only the last two hours.
+        seen = models.Pokemon.get_seen(2)
+        self.assertEqual(seen['total'], 3)
+
+    def test_appearances_sum_days_per_spawnpoint(self):
+        self.daily(self.day - timedelta(days=3), 10, 4)
+        self.daily(self.day, 10, 2)
+        self.daily(self.day, 11, 1)
+
+        appearances = dict(
+            (a['spawnpoint_id'], a['count'])
+            for a in models.Pokemon.get_appearances(1, 0))
+        self.assertEqual(appearances, {10: 6, 11: 1})
+
+        # Rounded out to whole days.
+        appearances = dict(
+            (a['spawnpoint_id'], a['count'])
+            for a in models.Pokemon.get_appearances(1, 1))
+        self.assertEqual(appearances, {10: 2, 11: 1})
+
+    def test_appearance_times_come_from_the_pokemon(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        for encounter_id, (spawnpoint_id, hours) in enumerate(
+                [(10, 5), (10, 1), (11, 1)]):
+            models.Pokemon.insert(
+                encounter_id=encounter_id, spawnpoint_id=spawnpoint_id,
+                pokemon_id=1, latitude=0.0, longitude=0.0,
+                disappear_time=now - timedelta(hours=hours)).execute()
+
+        times = models.Pokemon.get_appearances_times_by_spawnpoint(1, 10, 0)
+        self.assertEqual(times, [now - timedelta(hours=5),
+                                 now - timedelta(hours=1)])
+        times = models.Pokemon.get_appearances_times_by_spawnpoint(1, 10, 2)
+        self.assertEqual(times, [now - timedelta(hours=1)])
@@ -0,0 +1,60 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from pogom.tiles import TileVersions, tile_etag, tile_expiry
+
+
+class TilesTest(unittest.TestCase):
+
+    def test_expiry_is_the_first_despawn(self):
+        now_date = datetime.utcnow()
+        soon = now_date + timedelta(minutes=5)
+        data = {
+            'pokemons': [
+                {'disappear_time': now_date + timedelta(minutes=20)},
+                {'disappear_time': soon},
+                {'disappear_time': now_date - timedelta(minutes=1)}],
+            'pokestops': [{'lure_expiration': None}]
+        }
+        self.assertEqual(tile_expiry(data), soon)
+
+        lure = now_date + timedelta(minutes=2)
+        data['pokestops'].append({'lure_expiration': lure})
+        self.assertEqual(tile_expiry(data), lure)
+        self.assertIsNone(tile_expiry({'pokemons': [], 'gyms': {}}))
+
+    def test_expiry_includes_raids_and_scans(self):
+        now_date = datetime.utcnow()
+        data = {
+            'pokemons': [
+                {'disappear_time': now_date + timedelta(minutes=20)}],
+            'gyms': {
+                'gym': {'raid': {
+                    'start': now_date + timedelta(minutes=10),
+                    'end': now_date + timedelta(minutes=55)}},
+                'other': {'raid': None}},
+            'scanned': [
+                {'last_modified': now_date - timedelta(minutes=10)}]
+        }
+        # The scan falls out of the last 15 minutes first.
+        self.assertEqual(tile_expiry(data), now_date + timedelta(minutes=5))
+
+        data['scanned'] = []
+        self.assertEqual(tile_expiry(data), now_date + timedelta(minutes=10))
+
+        # Hatched already, until it ends.
+        data['gyms']['gym']['raid']['start'] = now_date
+        data['pokemons'] = []
+        self.assertEqual(tile_expiry(data), now_date + timedelta(minutes=55))
+
+    def test_etag_changes_with_expiry(self):
+        versions = TileVersions()
+        version = versions.etag(1, 2)
+        self.assertEqual(tile_etag(version, None), version)
+
+        expiry = datetime(2018, 3, 1, 12)
+        etag = tile_etag(version, expiry)
+        self.assertNotEqual(etag, version)
+        self.assertNotEqual(
+            tile_etag(version, expiry + timedelta(seconds=1)), etag)
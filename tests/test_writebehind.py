@@ -0,0 +1,87 @@
+import time
+import unittest
+
+from pogom.writebehind import WriteBehindBuffer
+
+
+KEYS = {'status': ('username',), 'link': ('cell', 'spawnpoint'),
+        'sighting': None}
+
+
+class WriteBehindBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = WriteBehindBuffer(KEYS.get, max_rows=3, max_age=60)
+
+    def test_rows_are_merged_by_key(self):
+        self.buffer.add('status', {0: {'username': 'a', 'success': 1}})
+        self.buffer.add('status', {0: {'username': 'a', 'success': 2,
+                                       'fail': 0}})
+        self.buffer.add('status', {0: {'username': 'b', 'success': 1}})
+        batches = self.buffer.take(everything=True)
+
+        rows = dict((row['username'], row)
+                    for model, data in batches for row in data.values())
+        self.assertEqual(rows['a'], {'username': 'a', 'success': 2,
+                                     'fail': 0})
+        self.assertEqual(self.buffer.stats()['rows_in'], 3)
+        self.assertEqual(self.buffer.stats()['rows_out'], 2)
+
+    def test_rows_are_grouped_by_fields(self):
+        self.buffer.add('status', {0: {'username': 'a', 'success': 1},
+                                   1: {'username': 'b', 'fail': 1}})
+        batches = self.buffer.take(everything=True)
+        self.assertEqual(len(batches), 2)
+
+    def test_composite_keys(self):
+        self.buffer.add('link', {1: {'cell': 1, 'spawnpoint': 2},
+                                 2: {'cell': 1, 'spawnpoint': 2},
+                                 3: {'cell': 1, 'spawnpoint': 3}})
+        model, data = self.buffer.take(everything=True)[0]
+        self.assertEqual(len(data), 2)
+
+    def test_flush_on_size_or_age(self):
+        self.buffer.add('status', {0: {'username': 'a'}})
+        self.assertEqual(self.buffer.take(), [])
+
+        self.buffer.add('status', {0: {'username': 'b'},
+                                   1: {'username': 'c'}})
+        self.assertEqual(len(self.buffer.take()), 1)
+        self.assertEqual(self.buffer.pending_rows(), 0)
+
+        self.buffer.max_age = 0.01
+        self.buffer.add('status', {0: {'username': 'd'}})
+        time.sleep(0.02)
+        self.assertEqual(len(self.buffer.take()), 1)
+
+    def test_models_without_key_are_not_held(self):
+        self.assertFalse(self.buffer.add('sighting', {0: {'id': 1}}))
+        self.assertFalse(self.buffer.add('status', {0: {'success': 1}}))
+        self.assertEqual(self.buffer.pending_rows(), 0)
+
+    def test_failed_rows_are_put_back(self):
+        self.buffer.add('status', {0: {'username': 'a', 'success': 1}})
+        model, data = self.buffer.take(everything=True)[0]
+        # Written again after the failure, the newer row wins.
+        self.buffer.add('status', {0: {'username': 'a', 'success': 2}})
+        self.assertTrue(self.buffer.put_back(model, data))
+
+        batches = self.buffer.take()
+        self.assertEqual([row for _, rows in batches
+                          for row in rows.values()],
+                         [{'username': 'a', 'success': 2}])
+
+    def test_rows_are_dropped_after_retries(self):
+        self.buffer.add('status', {0: {'username': 'a'}})
+        for attempt in range(3):
+            model, data = self.buffer.take(everything=True)[0]
+            self.assertTrue(self.buffer.put_back(model, data))
+        model, data = self.buffer.take(everything=True)[0]
+        self.assertFalse(self.buffer.put_back(model, data))
+        self.assertEqual(self.buffer.pending_rows(), 0)
+
+        # Failures only count in a row.
+        self.buffer.add('status', {0: {'username': 'a'}})
+        model, data = self.buffer.take(everything=True)[0]
+        self.buffer.written(model)
+        self.assertTrue(self.buffer.put_back(model, data))
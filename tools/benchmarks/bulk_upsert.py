@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Upsert synthetic rows with bulk_upsert() and report rows/sec per model
+# and chunk size. Rows are deleted again afterwards, but use a scratch
+# database anyway. Options not listed here are passed on to RocketMap's
+# own config parsing, e.g. the database settings.
+#
+# Usage: python tools/benchmarks/bulk_upsert.py -cf config/config.ini
+#            [-n 5000] [-b 100,250,500,1000] [-m Pokemon,Gym]
+
+import argparse
+import random
+import sys
+import uuid
+
+from datetime import datetime
+from timeit import default_timer
+
+sys.path.append('.')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--rows', type=int, default=5000,
+                    help='Rows per upsert.')
+parser.add_argument('-b', '--batch-sizes', default='100,250,500,1000',
+                    help='Comma separated rows per INSERT statement.')
+parser.add_argument('-m', '--models',
+                    default='Pokemon,Pokestop,Gym,SpawnPoint,ScannedLocation')
+parser.add_argument('-r', '--repeat', type=int, default=3)
+args, sys.argv[1:] = parser.parse_known_args()
+
+from peewee import (BooleanField, CharField, DateTimeField,  # noqa: E402
+                    DoubleField, FloatField, IntegerField,
+                    SmallIntegerField, TextField)
+from pogom import models  # noqa: E402
+from pogom.models import init_database, create_tables  # noqa: E402
+
+
+def field_value(field):
+    if isinstance(field, BooleanField):
+        return random.random() < 0.5
+    if isinstance(field, DateTimeField):
+        return datetime.utcnow()
+    if isinstance(field, (DoubleField, FloatField)):
+        return random.uniform(-90, 90)
+    if isinstance(field, SmallIntegerField):
+        return random.randint(0, 100)
+    if isinstance(field, IntegerField):
+        return random.randint(0, 2 ** 31 - 1)
+    if isinstance(field, (CharField, TextField)):
+        return uuid.uuid4().hex[:getattr(field, 'max_length', 32) or 32]
+    return None
+
+
+# Every field set, the way the parsers send full rows.
+def make_rows(cls, count):
+    pk = cls._meta.primary_key
+    rows = {}
+    while len(rows) < count:
+        row = dict((f.name, field_value(f)) for f in cls._meta.sorted_fields)
+        if isinstance(pk, CharField):
+            row[pk.name] = 'bench-' + uuid.uuid4().hex
+        else:
+            # Far away from real ids.
+            row[pk.name] = random.randint(2 ** 62, 2 ** 63)
+        rows[row[pk.name]] = row
+    return rows
+
+
+def main():
+    db = init_database(None)
+    create_tables(db)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+
+    for name in args.models.split(','):
+        cls = getattr(models, name)
+        pk = cls._meta.primary_key
+        rows = make_rows(cls, args.rows)
+        try:
+            for step in batch_sizes:
+                best = None
+                for _ in range(args.repeat):
+                    # After the first run these are all updates, make sure
+                    # they actually change something.
+                    for row in rows.values():
+                        for f in cls._meta.sorted_fields:
+                            if f is not pk and isinstance(f, DateTimeField):
+                                row[f.name] = datetime.utcnow()
+                    start = default_timer()
+                    models.bulk_upsert(cls, rows, db, step=step)
+                    elapsed = default_timer() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                print('{:>16} {:>5} rows/statement: {:>9.0f} rows/sec.'.format(
+                    name, step, len(rows) / best))
+        finally:
+            ids = list(rows.keys())
+            with db.atomic():
+                for i in range(0, len(ids), 1000):
+                    cls.delete().where(pk << ids[i:i + 1000]).execute()
+
+
+if __name__ == '__main__':
+    main()
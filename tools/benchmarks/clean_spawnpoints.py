@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Fill an empty scratch database with synthetic spawnpoints, scanned
+# locations, their links and detection data (with a share of old and
+# orphaned rows), then time db_clean_spawnpoints() as a dry run and for
+# real. Options not listed here are passed on to RocketMap's own config
+# parsing, e.g. the database settings.
+#
+# Usage: python tools/benchmarks/clean_spawnpoints.py -cf config/config.ini
+#            [-n 1000000] [-s 1000]
+
+import argparse
+import random
+import sys
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+sys.path.append('.')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--spawnpoints', type=int, default=1000000)
+parser.add_argument('-s', '--step', type=int, default=1000,
+                    help='Batch size of the cleanup.')
+parser.add_argument('-b', '--bad', type=float, default=0.01,
+                    help='Share of old/orphaned rows of each kind.')
+parser.add_argument('--skip-fill', action='store_true',
+                    help='Reuse the data of a previous run.')
+args, sys.argv[1:] = parser.parse_known_args()
+
+from pogom.models import (init_database, create_tables,  # noqa: E402
+                          db_clean_spawnpoints, SpawnPoint, ScannedLocation,
+                          ScanSpawnPoint, SpawnpointDetectionData)
+
+# Spawnpoints per scanned location.
+DENSITY = 10
+
+
+def insert(model, rows, db):
+    with db.atomic():
+        for i in range(0, len(rows), 1000):
+            model.insert_many(rows[i:i + 1000]).execute()
+
+
+def fill(db, count, bad):
+    now = datetime.utcnow()
+    old = now - timedelta(days=60)
+
+    def is_bad():
+        return random.random() < bad
+
+    start = default_timer()
+    for first in range(0, count, 100000):
+        spawnpoints = []
+        cells = []
+        links = []
+        sightings = []
+        for sp_id in range(first + 1, min(first + 100000, count) + 1):
+            spawnpoints.append({
+                'id': sp_id, 'latitude': 0, 'longitude': 0,
+                'last_scanned': old if is_bad() else now,
+                'missed_count': 10 if is_bad() else 0,
+                'latest_seen': 0, 'earliest_unseen': 0})
+            cell = (sp_id - 1) // DENSITY
+            if (sp_id - 1) % DENSITY == 0:
+                cells.append({'cellid': cell, 'latitude': 0, 'longitude': 0,
+                              'last_modified': old if is_bad() else now})
+            # Spawnpoints without links, links to missing spawnpoints or
+            # missing cells.
+            if not is_bad():
+                links.append({'spawnpoint': sp_id, 'scannedlocation': cell})
+            if is_bad():
+                links.append({'spawnpoint': count + sp_id,
+                              'scannedlocation': cell})
+            if is_bad():
+                links.append({'spawnpoint': sp_id,
+                              'scannedlocation': count + cell})
+            sightings.append({
+                'encounter_id': sp_id,
+                'spawnpoint_id': count + sp_id if is_bad() else sp_id,
+                'scan_time': old if is_bad() else now})
+
+        insert(SpawnPoint, spawnpoints, db)
+        insert(ScannedLocation, cells, db)
+        insert(ScanSpawnPoint, links, db)
+        insert(SpawnpointDetectionData, sightings, db)
+        print('Inserted {} spawnpoints.'.format(first + len(spawnpoints)))
+
+    print('Filled in {:.1f} seconds.'.format(default_timer() - start))
+
+
+def main():
+    db = init_database(None)
+    create_tables(db)
+
+    if not args.skip_fill:
+        if SpawnPoint.select().exists():
+            print('SpawnPoint table is not empty, use an empty scratch ' +
+                  'database or --skip-fill.')
+            sys.exit(1)
+        db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
+        fill(db, args.spawnpoints, args.bad)
+        db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
+
+    for dry_run in (True, False):
+        start = default_timer()
+        with db.execution_context(with_transaction=False):
+            report = db_clean_spawnpoints(args.step, dry_run=dry_run)
+        elapsed = default_timer() - start
+        print('{}: {:.1f} seconds.'.format(
+            'Dry run' if dry_run else 'Cleanup', elapsed))
+        for name, count in report['found'].items():
+            print('  {:>8} {}'.format(count, name))
+        for name, count in report['deleted'].items():
+            print('  {:>8} deleted from {}'.format(count, name))
+
+
+if __name__ == '__main__':
+    main()
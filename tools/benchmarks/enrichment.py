@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Time the per row enrichment done for map and webhook data (species name
+# and types, move names and types) using the old per call lookups against
+# the preloaded lookup tables in pogom/utils.py.
+#
+# Usage: python tools/benchmarks/enrichment.py [-n 10000] [-L de]
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from timeit import default_timer
+
+sys.path.append('.')
+from pogom.utils import (i8ln, get_pokemon_data, get_moves_data,  # noqa: E402
+                         init_lookup_tables, get_pokemon_name,
+                         get_pokemon_types, get_move_name, get_move_type)
+
+
+# What the helpers did before the lookup tables.
+def legacy_pokemon_name(pokemon_id):
+    return i8ln(get_pokemon_data(pokemon_id)['name'])
+
+
+def legacy_pokemon_types(pokemon_id):
+    pokemon_types = get_pokemon_data(pokemon_id)['types']
+    return map(lambda x: {"type": i8ln(x['type']), "color": x['color']},
+               pokemon_types)
+
+
+def legacy_move_name(move_id):
+    return i8ln(get_moves_data(move_id)['name'])
+
+
+def legacy_move_type(move_id):
+    move_type = get_moves_data(move_id)['type']
+    return {'type': i8ln(move_type), 'type_en': move_type}
+
+
+def enrich(rows, pokemon_name, pokemon_types, move_name, move_type):
+    for row in rows:
+        row['pokemon_name'] = pokemon_name(row['pokemon_id'])
+        row['pokemon_types'] = pokemon_types(row['pokemon_id'])
+        row['move_1_name'] = move_name(row['move_1'])
+        row['move_1_type'] = move_type(row['move_1'])
+        row['move_2_name'] = move_name(row['move_2'])
+        row['move_2_type'] = move_type(row['move_2'])
+
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--rows', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-L', '--locale', default='en')
+    args = parser.parse_args()
+
+    # Seed the loaders directly so no config is needed.
+    get_pokemon_data.pokemon = load_json('static/data/pokemon.json')
+    get_moves_data.moves = load_json('static/data/moves.json')
+    locale_file = 'static/locales/{}.json'.format(args.locale)
+    i8ln.dictionary = (load_json(locale_file)
+                       if os.path.isfile(locale_file) else {})
+
+    pokemon_ids = [int(k) for k in get_pokemon_data.pokemon]
+    move_ids = [int(k) for k in get_moves_data.moves]
+    rows = [{'pokemon_id': random.choice(pokemon_ids),
+             'move_1': random.choice(move_ids),
+             'move_2': random.choice(move_ids)}
+            for _ in range(args.rows)]
+
+    start = default_timer()
+    init_lookup_tables()
+    print('Built lookup tables in {:.2f} ms.'.format(
+        (default_timer() - start) * 1000))
+
+    for name, helpers in (
+            ('per call', (legacy_pokemon_name, legacy_pokemon_types,
+                          legacy_move_name, legacy_move_type)),
+            ('tables', (get_pokemon_name, get_pokemon_types,
+                        get_move_name, get_move_type))):
+        best = None
+        for _ in range(args.repeat):
+            start = default_timer()
+            enrich(rows, *helpers)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print('{:>8}: {:.2f} ms per 10k rows.'.format(
+            name, best * 10000 / args.rows * 1000))
+
+
+if __name__ == '__main__':
+    main()
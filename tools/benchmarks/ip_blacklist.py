@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Check the compiled IP blacklist table against a plain scan of the raw
+# ranges, and compare its lookup cost with the old sorted list lookup.
+#
+# Usage: python tools/benchmarks/ip_blacklist.py [-n 50000] [-l 100000]
+
+import argparse
+import random
+import socket
+import struct
+import sys
+
+from bisect import bisect_left
+from timeit import default_timer
+
+sys.path.append('.')
+from pogom.blacklist import IPRangeTable  # noqa: E402
+
+
+def num_to_ip(num):
+    return socket.inet_ntoa(struct.pack('!L', num))
+
+
+def ip_to_num(ip):
+    return struct.unpack('!L', socket.inet_aton(ip))[0]
+
+
+def random_ranges(count):
+    ranges = []
+    for _ in range(count):
+        start = random.randint(0, 2 ** 32 - 1)
+        # Mostly small ranges, some large ones that overlap others.
+        size = random.choice((0, 255, 4095, 65535, 2 ** 20))
+        end = min(start + random.randint(0, size), 2 ** 32 - 1)
+        ranges.append([num_to_ip(start), num_to_ip(end)])
+    return ranges
+
+
+# What Pogom did before: sort once, then per lookup re-parse the nearest
+# range's ends (with the IP converted for the bisect this time).
+class SortedRanges(object):
+
+    def __init__(self, ranges):
+        self.ranges = sorted(ranges, key=lambda r: ip_to_num(r[0]))
+        self.keys = [ip_to_num(r[0]) for r in self.ranges]
+
+    def contains(self, ip):
+        pos = max(bisect_left(self.keys, ip_to_num(ip)) - 1, 0)
+        ip_range = self.ranges[pos]
+        start = ip_to_num(ip_range[0])
+        end = ip_to_num(ip_range[1])
+        return start <= ip_to_num(ip) <= end
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--ranges', type=int, default=50000)
+    parser.add_argument('-l', '--lookups', type=int, default=100000)
+    parser.add_argument('-c', '--checks', type=int, default=2000)
+    args = parser.parse_args()
+
+    ranges = random_ranges(args.ranges)
+    intervals = [(ip_to_num(r[0]), ip_to_num(r[1])) for r in ranges]
+
+    start = default_timer()
+    table = IPRangeTable(ranges)
+    print('Compiled {} ranges into {} intervals in {:.1f} ms.'.format(
+        len(ranges), len(table), (default_timer() - start) * 1000))
+
+    old = SortedRanges(ranges)
+
+    # Half the probes inside a random range, half anywhere.
+    probes = []
+    for i in range(args.lookups):
+        if i % 2:
+            low, high = random.choice(intervals)
+            probes.append(num_to_ip(random.randint(low, high)))
+        else:
+            probes.append(num_to_ip(random.randint(0, 2 ** 32 - 1)))
+
+    table_errors = old_errors = 0
+    for ip in probes[:args.checks]:
+        num = ip_to_num(ip)
+        expected = any(low <= num <= high for low, high in intervals)
+        table_errors += table.contains(ip) != expected
+        old_errors += old.contains(ip) != expected
+    print('Checked {} lookups against a full scan: {} wrong with the table, '
+          '{} wrong with the sorted list.'.format(
+              min(args.checks, len(probes)), table_errors, old_errors))
+
+    for name, lookup in (('sorted list', old.contains),
+                         ('table', table.contains)):
+        start = default_timer()
+        for ip in probes:
+            lookup(ip)
+        elapsed = default_timer() - start
+        print('{:>11}: {:.2f} us per lookup.'.format(
+            name, elapsed / len(probes) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
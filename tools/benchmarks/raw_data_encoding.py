@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compare payload size and serialization time of the regular /raw_data
+# format against the column oriented one (?format=columns).
+#
+# Usage: python tools/benchmarks/raw_data_encoding.py [-n 5000]
+
+import argparse
+import calendar
+import copy
+import gzip
+import io
+import json
+import random
+import sys
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+sys.path.append('.')
+from pogom.columnar import to_columns  # noqa: E402
+
+
+# Same conversions as CustomJSONEncoder in pogom/app.py, without Flask.
+def encode_default(obj):
+    if isinstance(obj, datetime):
+        return int(calendar.timegm(obj.timetuple()) * 1000 +
+                   obj.microsecond / 1000)
+    return list(obj)
+
+
+def fake_pokemon(encounter_id, encountered):
+    pokemon_id = random.randint(1, 386)
+    row = {
+        'encounter_id': str(encounter_id),
+        'spawnpoint_id': '%012x' % random.getrandbits(48),
+        'pokemon_id': pokemon_id,
+        'latitude': 40.0 + random.random(),
+        'longitude': -74.0 + random.random(),
+        'disappear_time': datetime.utcnow() + timedelta(
+            seconds=random.randint(60, 3600)),
+        'last_modified': datetime.utcnow(),
+        'pokemon_name': 'Pokemon %d' % pokemon_id,
+        'pokemon_rarity': random.choice(['Common', 'Uncommon', 'Rare']),
+        'pokemon_types': [{'type': 'Grass', 'color': '#8BC34A'},
+                          {'type': 'Poison', 'color': '#9C27B0'}]
+    }
+    for field in ('individual_attack', 'individual_defense',
+                  'individual_stamina', 'move_1', 'move_2', 'cp',
+                  'cp_multiplier', 'weight', 'height', 'gender', 'form',
+                  'catch_prob_1', 'catch_prob_2', 'catch_prob_3',
+                  'rating_attack', 'rating_defense', 'previous_id',
+                  'weather_id', 'time_id', 'costume_id'):
+        row[field] = None
+    if encountered:
+        row.update({
+            'individual_attack': random.randint(0, 15),
+            'individual_defense': random.randint(0, 15),
+            'individual_stamina': random.randint(0, 15),
+            'move_1': random.randint(200, 300),
+            'move_2': random.randint(13, 140),
+            'cp': random.randint(10, 3000),
+            'cp_multiplier': random.random(),
+            'gender': random.randint(1, 3)
+        })
+    return row
+
+
+def gzipped_size(payload):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(payload.encode('utf-8'))
+    return len(buf.getvalue())
+
+
+def measure(name, d, encode, rounds):
+    start = default_timer()
+    for _ in range(rounds):
+        payload = encode(copy.copy(d))
+    elapsed = (default_timer() - start) / rounds
+
+    print('{:<10} {:>12,} bytes {:>10,} gzipped {:>9.2f} ms'.format(
+        name, len(payload), gzipped_size(payload), elapsed * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--pokemon', type=int, default=5000,
+                        help='Number of Pokemon in the response.')
+    parser.add_argument('-e', '--encountered', type=float, default=0.2,
+                        help='Share of Pokemon with IVs.')
+    parser.add_argument('-r', '--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    d = {
+        'timestamp': datetime.utcnow(),
+        'pokemons': [fake_pokemon(i, random.random() < args.encountered)
+                     for i in range(args.pokemon)]
+    }
+
+    def rows(d):
+        return json.dumps(d, default=encode_default)
+
+    def columns(d):
+        return json.dumps(to_columns(d), default=encode_default)
+
+    print('{} Pokemon, {:.0%} encountered, average of {} rounds.'.format(
+        args.pokemon, args.encountered, args.rounds))
+    measure('rows', d, rows, args.rounds)
+    measure('columns', d, columns, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
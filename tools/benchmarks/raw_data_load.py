@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Load test /raw_data the way map clients poll it: a first full request per
+# client, then incremental ones for random viewports around a location.
+# Run it against the Flask development server and against wsgi.py to
+# compare requests/sec.
+#
+# Usage: python tools/benchmarks/raw_data_load.py -u http://127.0.0.1:5000
+#            -l 40.7,-74.0 -c 20 -d 60
+
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+
+def viewport(lat, lng, span):
+    lat += random.uniform(-span, span)
+    lng += random.uniform(-span, span)
+    return {'swLat': lat - span / 2, 'swLng': lng - span / 2,
+            'neLat': lat + span / 2, 'neLng': lng + span / 2}
+
+
+def client(args, lat, lng, deadline, results, lock):
+    session = requests.Session()
+    session.headers['Referer'] = args.url
+    timestamp = None
+    seq = None
+
+    while time.time() < deadline:
+        params = viewport(lat, lng, args.span)
+        params.update({'gyms': 'true', 'pokestops': 'true',
+                       'pokemon': 'true', 'scanned': 'true'})
+        if timestamp:
+            params.update({'timestamp': timestamp, 'lastgyms': 'true',
+                           'lastpokestops': 'true', 'lastpokemon': 'true',
+                           'lastslocs': 'true'})
+        if seq:
+            params['seq'] = seq
+
+        start = time.time()
+        try:
+            r = session.get(args.url + '/raw_data', params=params,
+                            timeout=30)
+            ok = r.status_code == 200
+            if ok:
+                data = r.json()
+                timestamp = data.get('timestamp')
+                seq = data.get('seq')
+        except requests.RequestException:
+            ok = False
+
+        with lock:
+            results.append((ok, time.time() - start,
+                            len(r.content) if ok else 0))
+
+        if args.interval:
+            time.sleep(args.interval)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--url', default='http://127.0.0.1:5000')
+    parser.add_argument('-l', '--location', required=True,
+                        help='Center of the test area as "lat,lng".')
+    parser.add_argument('-s', '--span', type=float, default=0.02,
+                        help='Viewport size in degrees.')
+    parser.add_argument('-c', '--clients', type=int, default=10)
+    parser.add_argument('-d', '--duration', type=int, default=30,
+                        help='Test duration in seconds.')
+    parser.add_argument('-i', '--interval', type=float, default=0,
+                        help='Seconds between polls of a client, 0 to ' +
+                             'hammer the server.')
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+    lat, lng = [float(x) for x in args.location.split(',')]
+
+    results = []
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=client,
+                                args=(args, lat, lng, deadline, results,
+                                      lock))
+               for _ in range(args.clients)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies = sorted(r[1] for r in results if r[0])
+    errors = len([r for r in results if not r[0]])
+    if not latencies:
+        print('No successful requests, {} errors.'.format(errors))
+        return
+
+    print('{} clients for {}s against {}'.format(
+        args.clients, args.duration, args.url))
+    print('Requests:  {} ok, {} errors'.format(len(latencies), errors))
+    print('Req/sec:   {:.1f}'.format(len(latencies) / float(args.duration)))
+    print('Latency:   p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms'.format(
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.95) * 1000,
+        percentile(latencies, 0.99) * 1000))
+    print('Avg size:  {:.0f} bytes'.format(
+        sum(r[2] for r in results) / float(len(latencies))))
+
+
+if __name__ == '__main__':
+    main()
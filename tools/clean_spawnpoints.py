@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Run the spawnpoint consistency pass of the database cleaner once. With
+# --dry-run it only reports what would be deleted. Options not listed here
+# are passed on to RocketMap's own config parsing, e.g. the database
+# settings.
+#
+# Usage: python tools/clean_spawnpoints.py -cf config/config.ini --dry-run
+
+import argparse
+import logging
+import sys
+
+sys.path.append('.')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dry-run', action='store_true',
+                    help='Only report what would be deleted.')
+parser.add_argument('--days', type=int, default=30,
+                    help='Age in days of data considered old.')
+parser.add_argument('--missed', type=int, default=5,
+                    help='Missed scans of a spawnpoint considered old.')
+parser.add_argument('-s', '--step', type=int, default=1000)
+args, sys.argv[1:] = parser.parse_known_args()
+
+from pogom.models import init_database, db_clean_spawnpoints  # noqa: E402
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    db = init_database(None)
+    with db.execution_context(with_transaction=False):
+        db_clean_spawnpoints(args.step, args.days, args.missed,
+                             dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
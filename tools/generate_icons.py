@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Pre-generate the dynamic Pokemon and gym icons served by /pkm_img and
+# /gym_img, so the first map viewers after a deploy don't wait for them.
+#
+# Usage: python tools/generate_icons.py [-pa /path/to/PogoAssets]
+#            [-p 8] [-rb 144,145,146,150]
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append('.')
+from pogom import dyn_img, compositor  # noqa: E402
+from pogom.utils import determine_imagemagick_binary  # noqa: E402
+from pgoapi.protos.pogoprotos.enums.costume_pb2 import Costume  # noqa: E402
+from pgoapi.protos.pogoprotos.enums.form_pb2 import Form  # noqa: E402
+from pgoapi.protos.pogoprotos.enums.gender_pb2 import (  # noqa: E402
+    MALE, FEMALE, GENDERLESS)
+from pgoapi.protos.pogoprotos.enums.weather_condition_pb2 import (  # noqa
+    WeatherCondition)
+from pgoapi.protos.pogoprotos.networking.responses.get_map_objects_response_pb2 import (  # noqa
+    GetMapObjectsResponse)
+
+log = logging.getLogger('generate_icons')
+
+GYM_TEAMS = ('Uncontested', 'Mystic', 'Valor', 'Instinct')
+# Forms only change the icon of these Pokemon, see
+# dyn_img.pokemon_asset_path_shuffle().
+FORM_PREFIXES = {201: 'UNOWN_', 351: 'CASTFORM_'}
+
+
+def pokemon_variants(pokemon_ids, pogo_assets):
+    times = GetMapObjectsResponse.TimeOfDay.values()
+    weathers = [0] + [w for w in WeatherCondition.values() if w]
+    # Without PogoAssets icons come from the spritesheet and only vary by
+    # weather and time. The map adds the gender to every icon URL, unless
+    # it's unknown.
+    genders = (None, MALE, FEMALE, GENDERLESS) if pogo_assets else (None,)
+
+    for pkm in pokemon_ids:
+        costumes = [costume for costume in Costume.values()
+                    if costume and pogo_assets and os.path.isfile(
+                        os.path.join(pogo_assets, 'sprites',
+                                     '{}_{:02d}.png'.format(pkm, costume)))]
+        forms = []
+        if pogo_assets and pkm in FORM_PREFIXES:
+            forms = [form for name, form in Form.items()
+                     if name.startswith(FORM_PREFIXES[pkm])]
+
+        for t in times:
+            for weather in weathers:
+                for gender in genders:
+                    yield 'map', pkm, t, {'weather': weather,
+                                          'gender': gender}
+
+                    if not pogo_assets:
+                        continue
+
+                    # Unown and Castform are genderless.
+                    if gender in (None, GENDERLESS):
+                        for form in forms:
+                            yield 'map', pkm, t, {'weather': weather,
+                                                  'gender': gender,
+                                                  'form': form}
+
+                    for costume in costumes:
+                        yield 'map', pkm, t, {'weather': weather,
+                                              'gender': gender,
+                                              'costume': costume}
+
+                    if pkm in dyn_img.medal_images:
+                        yield 'map', pkm, t, {'weather': weather,
+                                              'gender': gender,
+                                              'medal': True}
+
+        if pogo_assets:
+            for gender in genders:
+                yield 'raw', pkm, 0, {'gender': gender}
+
+
+def gym_variants(raid_bosses):
+    for team in GYM_TEAMS:
+        # The level is the number of defenders, uncontested gyms have none.
+        levels = (0,) if team == 'Uncontested' else range(1, 7)
+        for level in levels:
+            for battle in (0, 1):
+                yield 'gym', team, level, {'is_in_battle': battle}
+                for raidlevel in range(1, 6):
+                    yield 'gym', team, level, {'raidlevel': raidlevel,
+                                               'is_in_battle': battle}
+
+            # Gyms with an ongoing raid are drawn without the battle mark.
+            for raidlevel in range(1, 6):
+                for pkm in raid_bosses:
+                    yield 'gym', team, level, {'raidlevel': raidlevel,
+                                               'pkm': pkm,
+                                               'is_in_battle': 0}
+
+
+def init_worker(native_images, imagemagick_executable, pogo_assets):
+    # Worker processes don't inherit the parent's setup on Windows.
+    dyn_img.generate_images = True
+    dyn_img.native_images = native_images
+    dyn_img.imagemagick_executable = imagemagick_executable
+    dyn_img.pogo_assets = pogo_assets
+
+
+def render(variant):
+    kind, subject, arg, kwargs = variant
+    try:
+        if kind == 'map':
+            dyn_img.get_pokemon_map_icon(subject, arg, **kwargs)
+        elif kind == 'raw':
+            dyn_img.get_pokemon_raw_icon(subject, arg, **kwargs)
+        else:
+            dyn_img.get_gym_icon(subject, arg, kwargs.get('raidlevel'),
+                                 kwargs.get('pkm'), 0,
+                                 kwargs['is_in_battle'])
+    except Exception as e:
+        return '{}: {}'.format(variant, repr(e))
+    return None
+
+
+def count_generated():
+    count = 0
+    for root, dirs, files in os.walk(dyn_img.path_generated):
+        count += len(files)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-pa', '--pogo-assets', default=None,
+                        help='PogoAssets root directory.')
+    parser.add_argument('-p', '--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of rendering processes.')
+    parser.add_argument('-rb', '--raid-bosses', default='',
+                        help='Comma separated Pokemon ids to render raid '
+                             'gym icons for.')
+    parser.add_argument('--no-pokemon', action='store_true',
+                        help='Skip Pokemon icons.')
+    parser.add_argument('--no-gyms', action='store_true',
+                        help='Skip gym icons.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    # Don't log every single icon.
+    logging.getLogger('pogom.dyn_img').setLevel(logging.WARNING)
+
+    native_images = compositor.available()
+    imagemagick_executable = None
+    if not native_images:
+        imagemagick_executable = determine_imagemagick_binary()
+        if not imagemagick_executable:
+            log.error('Install Pillow or ImageMagick to generate icons.')
+            sys.exit(1)
+    if args.pogo_assets and not os.path.isdir(
+            os.path.join(args.pogo_assets, 'sprites')):
+        log.error("Could not find PogoAssets repository at '%s'.",
+                  args.pogo_assets)
+        sys.exit(1)
+
+    with open(os.path.join(dyn_img.path_static, 'data',
+                           'pokemon.json')) as f:
+        pokemon_ids = sorted(int(pkm) for pkm in json.load(f))
+    raid_bosses = [int(pkm) for pkm in args.raid_bosses.split(',') if pkm]
+
+    variants = []
+    if not args.no_pokemon:
+        variants.extend(pokemon_variants(pokemon_ids, args.pogo_assets))
+    if not args.no_gyms:
+        variants.extend(gym_variants(raid_bosses))
+
+    log.info('Rendering %d icon variants using %d processes (%s).',
+             len(variants), args.processes,
+             'Pillow' if native_images else imagemagick_executable)
+
+    existing = count_generated()
+    errors = 0
+    start = time.time()
+    pool = multiprocessing.Pool(
+        args.processes, init_worker,
+        (native_images, imagemagick_executable, args.pogo_assets))
+    try:
+        for i, error in enumerate(pool.imap_unordered(render, variants, 64)):
+            if error:
+                errors += 1
+                log.warning('Failed to render %s', error)
+            if (i + 1) % 1000 == 0:
+                log.info('%d/%d variants, %.1f/s.', i + 1, len(variants),
+                         (i + 1) / (time.time() - start))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    generated = count_generated() - existing
+    log.info('Done in %.1f seconds: %d variants (%.1f/s), %d new icons '
+             '(%.1f/s), %d errors.', elapsed, len(variants),
+             len(variants) / elapsed, generated, generated / elapsed, errors)
+
+
+if __name__ == '__main__':
+    main()
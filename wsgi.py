@@ -0,0 +1,27 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Serve the map from a production WSGI server instead of Flask's
+# development server, in separate processes from the scanner. For example
+# with gunicorn and cooperative gevent workers:
+#
+#   pip install gunicorn gevent
+#   POGOMAP_CONFIG=config/config.ini \
+#       gunicorn -k gevent -w 4 -b 0.0.0.0:5000 wsgi:app
+#
+# Options are read from the same config file as runserver.py (POGOMAP_CONFIG
+# or config/config.ini), from POGOMAP_* environment variables and from
+# POGOMAP_ARGS, e.g. POGOMAP_ARGS='-cf config/web.ini'. --only-server is
+# implied. Don't use gunicorn's --preload, every worker needs its own
+# database connections.
+
+import os
+import shlex
+import sys
+
+# get_args() parses sys.argv, which belongs to the WSGI server here.
+sys.argv = sys.argv[:1] + shlex.split(os.environ.get('POGOMAP_ARGS', ''))
+
+from runserver import create_wsgi_app  # noqa: E402
+
+app = create_wsgi_app()